@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.instrumentation.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -68,15 +69,20 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+# CONN_MAX_AGE - время жизни (сек.) постоянного соединения с БД (0 - новое соединение на каждый запрос или задачу
+# шедулера), перед повторным использованием соединение проверяется (CONN_HEALTH_CHECKS). Для подключения через
+# пул соединений (pgbouncer) указываются его DB_HOST и DB_PORT.
 
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("NAME"),
         "USER": "postgres",
-        "HOST": "localhost",
-        "PORT": "5432",
+        "HOST": os.getenv("DB_HOST", "localhost"),
+        "PORT": os.getenv("DB_PORT", "5432"),
         "PASSWORD": os.getenv("PASSWORD"),
+        "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": os.getenv("CONN_HEALTH_CHECKS", "True") == "True",
     }
 }
 
@@ -147,11 +153,20 @@ CACHE_ENABLED = True
 if CACHE_ENABLED:
     CACHES = {
         "default": {
-            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "BACKEND": "config.instrumentation.InstrumentedRedisCache",
             "LOCATION": os.getenv("LOCATION"),
         }
     }
 
+# Инструментирование запросов (config.instrumentation): заголовок Server-Timing и журнал запросов, которые
+# дольше INSTRUMENTATION_SLOW_MS (мс). Доля запросов METRICS_SAMPLE_RATE (от 0 до 1) собирается для /metrics/,
+# при нуле эндпоинт отключен. Эндпоинт отвечает только на запросы с заголовком Authorization: Bearer METRICS_TOKEN
+# (без токена он тоже отключен): адрес клиента не проверяется, за обратным прокси все запросы приходят с его адреса.
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "True") == "True"
+INSTRUMENTATION_SLOW_MS = int(os.getenv("INSTRUMENTATION_SLOW_MS", 500))
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 
 LOGGING = {
     "version": 1,
@@ -185,5 +200,10 @@ LOGGING = {
             "level": "DEBUG",
             "propagate": True,
         },
+        "config.instrumentation": {
+            "handlers": ["console"],
+            "level": os.getenv("INSTRUMENTATION_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
     },
 }
@@ -3,9 +3,12 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from config.instrumentation import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("mailing.urls", namespace="mailing")),
     path("users/", include("users.urls", namespace="users")),
     path("blog/", include("blog.urls", namespace="blog")),
+    path("metrics/", metrics_view, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -3,6 +3,7 @@ from django.conf import settings
 from apscheduler.schedulers.background import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 from django_apscheduler import util
@@ -16,6 +17,13 @@ def delete_old_job_executions(max_age=604_800):
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
 
 
+@util.close_old_connections
+def check_mailings():
+    """Задача выполняется в потоке шедулера, у каждого потока свое соединение с БД. До и после задачи
+    закрываются устаревшие (CONN_MAX_AGE) и неисправные соединения."""
+    check_and_send_mailings()
+
+
 class Command(BaseCommand):
     help = "Runs APScheduler"
 
@@ -24,7 +32,7 @@ class Command(BaseCommand):
         scheduler.add_jobstore(DjangoJobStore(), "default")
 
         scheduler.add_job(
-            check_and_send_mailings,
+            check_mailings,
             trigger=IntervalTrigger(seconds=5),
             id="check_mailings",
             seconds=10,
@@ -41,4 +49,5 @@ class Command(BaseCommand):
         except KeyboardInterrupt:
             logger.info("шедулер остановлен")
             scheduler.shutdown()
+            connections.close_all()
             logger.info("шедулер остановлен успешно")
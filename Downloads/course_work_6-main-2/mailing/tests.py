@@ -1,3 +1,54 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from config import settings
+from config.instrumentation import registry
+from mailing.models import Client
+
+
+class RequestMetricsTestCase(TestCase):
+    """Метрики запросов: заголовок Server-Timing шаблонных представлений и эндпоинт /metrics/."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email="owner@example.com")
+        Client.objects.create(
+            email="client@example.com", full_name="Иванов Иван", owner=self.user
+        )
+        self.client.force_login(self.user)
+        registry.views.clear()
+
+    def server_timing(self, response):
+        return dict(
+            entry.split(";", 1) for entry in response["Server-Timing"].split(", ")
+        )
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("mailing:client_list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Иванов Иван")
+        timing = self.server_timing(response)
+        # список клиентов читается при рендеринге шаблона, эти запросы тоже учитываются
+        self.assertIn(f'desc="{len(queries)} queries"', timing["db"])
+        self.assertEqual(set(timing), {"db", "cache", "render", "total"})
+        self.assertNotEqual(timing["render"], "dur=0.00")
 
-# Create your tests here.
+    @patch.object(settings, "METRICS_TOKEN", "secret")
+    @patch.object(settings, "METRICS_SAMPLE_RATE", 1)
+    def test_metrics(self):
+        url = reverse("metrics")
+        self.client.get(reverse("mailing:client_list"))
+        # адрес клиента не дает доступа (за обратным прокси все запросы приходят с 127.0.0.1)
+        response = self.client.get(url, REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count{view="mailing:client_list",method="GET"} 1',
+            response.content.decode(),
+        )
@@ -0,0 +1,86 @@
+# Асинхронный доступ к общему кешу для асинхронных представлений (library.async_views).
+# Асинхронные методы кеша Django (aget, aset) выполняют синхронный клиент Redis в отдельном потоке, поэтому
+# для Redis используется клиент redis.asyncio. Ключи, формат значений и сроки хранения те же, что у кеша Django,
+# поэтому синхронные и асинхронные представления читают и пишут одни и те же записи. Для других бэкендов
+# (локальный кеш процесса) вызываются асинхронные методы кеша Django.
+# Соединения redis.asyncio привязаны к циклу событий, поэтому клиент создается для каждого цикла.
+
+import asyncio
+from weakref import WeakKeyDictionary
+
+import redis.asyncio
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+from config.instrumentation import cache_lookup
+
+_clients = WeakKeyDictionary()  # цикл событий -> клиент redis.asyncio
+
+
+def get_client(backend):
+    """Клиент redis.asyncio текущего цикла событий или None, если общий кеш не Redis.
+    Как и синхронный клиент Django, пишет и читает первый сервер из LOCATION."""
+    if not isinstance(backend, RedisCache):
+        return None
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = redis.asyncio.Redis.from_url(backend._servers[0])
+    return client
+
+
+async def aget(key, default=None):
+    backend = caches["default"]
+    client = get_client(backend)
+    if client is None:
+        return await backend.aget(key, default)
+    value = await client.get(backend.make_and_validate_key(key))
+    if value is None:
+        cache_lookup(0, 1)
+        return default
+    cache_lookup(1, 0)
+    return backend._cache._serializer.loads(value)
+
+
+async def aget_many(keys):
+    backend = caches["default"]
+    client = get_client(backend)
+    if client is None:
+        return await backend.aget_many(keys)
+    values = await client.mget([backend.make_and_validate_key(key) for key in keys])
+    found = {
+        key: backend._cache._serializer.loads(value)
+        for key, value in zip(keys, values)
+        if value is not None
+    }
+    cache_lookup(len(found), len(keys) - len(found))
+    return found
+
+
+async def aset(key, value, timeout=DEFAULT_TIMEOUT):
+    backend = caches["default"]
+    client = get_client(backend)
+    if client is None:
+        return await backend.aset(key, value, timeout)
+    key = backend.make_and_validate_key(key)
+    timeout = backend.get_backend_timeout(timeout)
+    if timeout == 0:
+        await client.delete(key)
+    else:
+        await client.set(key, backend._cache._serializer.dumps(value), ex=timeout)
+
+
+async def aadd(key, value, timeout=DEFAULT_TIMEOUT):
+    backend = caches["default"]
+    client = get_client(backend)
+    if client is None:
+        return await backend.aadd(key, value, timeout)
+    return bool(
+        await client.set(
+            backend.make_and_validate_key(key),
+            backend._cache._serializer.dumps(value),
+            ex=backend.get_backend_timeout(timeout),
+            nx=True,
+        )
+    )
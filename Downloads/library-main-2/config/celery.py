@@ -3,6 +3,8 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
+from django.db import close_old_connections
 
 # Установка переменной окружения для настроек проекта
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -15,3 +17,13 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Автоматическое обнаружение и регистрация задач из файлов tasks.py в приложениях Django
 app.autodiscover_tasks()
+
+
+@task_prerun.connect
+@task_postrun.connect
+def close_old_db_connections(task=None, **kwargs):
+    """Перед задачей и после нее закрываются устаревшие и неисправные соединения с БД, как после запроса
+    к веб-серверу. Задачи, выполняемые сразу (task_always_eager), работают в соединении вызывающего кода.
+    """
+    if not getattr(task.request, "is_eager", False):
+        close_old_connections()
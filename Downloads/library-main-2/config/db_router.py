@@ -0,0 +1,88 @@
+# Чтение с реплики основной БД (DATABASES["replica"], включается REPLICA_DB_HOST вместе с общим кешем CACHE_LOCATION).
+# Журнал операций, его выгрузка, каталог и отчеты по сводным таблицам читаются с реплики, чтобы отчеты не мешали
+# выдаче книг на основной БД. Представления выбирают БД явно (queryset.using), поэтому строки выгрузки
+# читаются с реплики и после выхода из представления. Любая запись идет в основную БД (ReplicaRouter),
+# в том числе запись объектов, прочитанных с реплики. Реплика отстает от основной БД, поэтому после успешной
+# записи пользователь REPLICA_STICKY_SECONDS секунд читает из основной БД и видит свои изменения. Отметки
+# хранятся в общем кеше и видны всем процессам веб-сервера. Так же закрепляются разделы каталога после
+# изменения: кеш ответов каталога (library.cache) не заполняется устаревшими данными с реплики.
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+
+from config import async_cache, settings
+
+REPLICA_DB_ALIAS = "replica"
+
+
+def pin_key(name):
+    return f"replica:pinned:{name}"
+
+
+def pin_to_primary(*names):
+    """Функция закрепляет чтение по именам names (пользователь, раздел каталога) за основной БД."""
+    if settings.REPLICA_ENABLED and names:
+        cache.set_many(
+            {pin_key(name): True for name in names}, settings.REPLICA_STICKY_SECONDS
+        )
+
+
+def is_pinned(*names):
+    return bool(cache.get_many([pin_key(name) for name in names]))
+
+
+async def ais_pinned(*names):
+    return bool(await async_cache.aget_many([pin_key(name) for name in names]))
+
+
+def read_db(request):
+    """Функция возвращает БД для чтения в запросе: реплику или основную БД, если пользователь недавно
+    записывал данные. Результат запоминается на время запроса."""
+    if not hasattr(request, "_read_db"):
+        request._read_db = DEFAULT_DB_ALIAS
+        if settings.REPLICA_ENABLED and not is_pinned(f"user:{request.user.pk}"):
+            request._read_db = REPLICA_DB_ALIAS
+    return request._read_db
+
+
+async def aread_db(request):
+    """Асинхронный вариант read_db для асинхронных представлений (library.async_views)."""
+    if not hasattr(request, "_read_db"):
+        request._read_db = DEFAULT_DB_ALIAS
+        if settings.REPLICA_ENABLED and not await ais_pinned(f"user:{request.user.pk}"):
+            request._read_db = REPLICA_DB_ALIAS
+    return request._read_db
+
+
+class ReplicaRouter:
+    """Запись всегда в основную БД. Чтение без явного выбора БД - из основной БД (или из БД объекта,
+    по которому читаются связанные объекты). Реплика - копия основной БД, поэтому миграции к ней не применяются.
+    """
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """Примесь к представлениям DRF: безопасные запросы (GET, HEAD, OPTIONS) читают с реплики, успешная запись
+    закрепляет пользователя за основной БД."""
+
+    def filter_queryset(self, queryset):
+        if self.request.method in SAFE_METHODS:
+            queryset = queryset.using(read_db(self.request))
+        return super().filter_queryset(queryset)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in SAFE_METHODS and status.is_success(
+            response.status_code
+        ):
+            pin_to_primary(f"user:{request.user.pk}")
+        return super().finalize_response(request, response, *args, **kwargs)
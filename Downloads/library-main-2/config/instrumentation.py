@@ -0,0 +1,339 @@
+# Инструментирование запросов: количество и время SQL-запросов, попадания в кеш, время сериализации (DRF),
+# рендеринга ответа и общее время обработки. Метрики запроса отдаются клиенту в заголовке Server-Timing
+# и пишутся в журнал (logger config.instrumentation) одной JSON-строкой: медленные запросы - с уровнем WARNING,
+# остальные - DEBUG. Доля запросов METRICS_SAMPLE_RATE накапливается в памяти процесса и отдается эндпоинтом
+# /metrics/ в текстовом формате Prometheus (у каждого процесса веб-сервера свои счетчики).
+# Метрики текущего запроса хранятся в ContextVar, поэтому вне запросов (Celery, команды) учет не ведется.
+# Middleware работает и в синхронном (WSGI), и в асинхронном (ASGI) режиме.
+
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from rest_framework.serializers import ListSerializer
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+_current = ContextVar("request_metrics", default=None)
+_missing = object()
+# границы корзин гистограммы времени ответа (сек.)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    """Метрики одного запроса. Длительности хранятся в секундах."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0
+        self.db_queries = 0
+        self.db = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.spans = {"serializer": 0, "render": 0}
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.db_queries += 1
+
+    def as_dict(self):
+        return {
+            "total_ms": round(self.total * 1000, 2),
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            **{
+                f"{name}_ms": round(value * 1000, 2)
+                for name, value in self.spans.items()
+            },
+        }
+
+    def server_timing(self):
+        return ", ".join(
+            (
+                f'db;dur={self.db * 1000:.2f};desc="{self.db_queries} queries"',
+                f'cache;desc="hits={self.cache_hits} misses={self.cache_misses}"',
+                *(
+                    f"{name};dur={value * 1000:.2f}"
+                    for name, value in self.spans.items()
+                ),
+                f"total;dur={self.total * 1000:.2f}",
+            )
+        )
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Обертка выполнения SQL: запрос учитывается в метриках запроса, в контексте которого он выполняется."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """Обертка подключается к каждому соединению с БД при его открытии (сигнал connection_created).
+    Асинхронный ORM выполняет запросы в отдельных потоках со своими соединениями, поэтому обертку нельзя
+    подключить к соединениям только на время запроса. Обертка ставится первой, чтобы не мешать временным
+    оберткам connection.execute_wrapper, которые снимаются с конца списка."""
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, query_wrapper)
+
+
+connection_created.connect(instrument_connection)
+
+
+@contextmanager
+def span(name):
+    """Учет времени участка обработки запроса (сериализация, рендеринг) в метриках текущего запроса."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.spans[name] = metrics.spans.get(name, 0) + time.perf_counter() - started
+
+
+def cache_lookup(hits, misses):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class CacheMetricsMixin:
+    """Примесь к бэкенду кеша: учет попаданий и промахов get/get_many в метриках текущего запроса."""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            cache_lookup(0, 1)
+            return default
+        cache_lookup(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        cache_lookup(len(values), len(keys) - len(values))
+        return values
+
+
+class InstrumentedRedisCache(CacheMetricsMixin, RedisCache):
+    pass
+
+
+class InstrumentedLocMemCache(CacheMetricsMixin, LocMemCache):
+    pass
+
+
+class TimedListSerializer(ListSerializer):
+    @property
+    def data(self):
+        with span("serializer"):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """Примесь к сериализатору: время получения serializer.data (одного объекта и списка при many=True)
+    учитывается в метриках запроса. Ленивые запросы queryset, выполняемые при сериализации, входят в это время.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, "Meta", None)
+        if meta is not None and not hasattr(meta, "list_serializer_class"):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with span("serializer"):
+            return super().data
+
+
+class MetricsRegistry:
+    """Накопленные метрики выборки запросов в разрезе представления и метода."""
+
+    COUNTERS = (
+        "db_queries",
+        "db_seconds",
+        "cache_hits",
+        "cache_misses",
+        "serializer_seconds",
+        "render_seconds",
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, method, metrics):
+        values = {
+            "db_queries": metrics.db_queries,
+            "db_seconds": metrics.db,
+            "cache_hits": metrics.cache_hits,
+            "cache_misses": metrics.cache_misses,
+            "serializer_seconds": metrics.spans["serializer"],
+            "render_seconds": metrics.spans["render"],
+        }
+        with self.lock:
+            entry = self.views.setdefault(
+                (view, method),
+                {
+                    "count": 0,
+                    "seconds": 0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                    **dict.fromkeys(self.COUNTERS, 0),
+                },
+            )
+            entry["count"] += 1
+            entry["seconds"] += metrics.total
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if metrics.total <= bound:
+                    entry["buckets"][index] += 1
+            for name, value in values.items():
+                entry[name] += value
+
+    def render(self):
+        with self.lock:
+            views = {
+                labels: dict(entry, buckets=list(entry["buckets"]))
+                for labels, entry in self.views.items()
+            }
+        lines = [
+            f"# sampled requests, sample rate {settings.METRICS_SAMPLE_RATE}",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (view, method), entry in sorted(views.items()):
+            labels = f'view="{view}",method="{method}"'
+            for bound, count in zip(LATENCY_BUCKETS, entry["buckets"]):
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}'
+            )
+            lines.append(
+                f"http_request_duration_seconds_sum{{{labels}}} {entry['seconds']:.6f}"
+            )
+            lines.append(
+                f"http_request_duration_seconds_count{{{labels}}} {entry['count']}"
+            )
+        for name in self.COUNTERS:
+            lines.append(f"# TYPE http_request_{name}_total counter")
+            for (view, method), entry in sorted(views.items()):
+                lines.append(
+                    f'http_request_{name}_total{{view="{view}",method="{method}"}} {entry[name]:g}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """Метрики каждого запроса: заголовок Server-Timing, журнал и выборка для /metrics/.
+    Подключается первым в MIDDLEWARE, чтобы общее время включало остальные обработчики.
+    SQL-запросы, выполняемые при чтении потокового ответа (StreamingHttpResponse), не учитываются.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        metrics.total = time.perf_counter() - metrics.started
+        response["Server-Timing"] = metrics.server_timing()
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        slow = metrics.total * 1000 >= settings.INSTRUMENTATION_SLOW_MS
+        level = logging.WARNING if slow else logging.DEBUG
+        # запись журнала собирается, только если ее уровень включен (обычно - только для медленных запросов)
+        if logger.isEnabledFor(level):
+            record = {
+                "view": view,
+                "method": request.method,
+                "status": response.status_code,
+                **metrics.as_dict(),
+            }
+            logger.log(
+                level,
+                json.dumps(record, ensure_ascii=False),
+                extra={"metrics": record},
+            )
+        if random.random() < settings.METRICS_SAMPLE_RATE:
+            registry.observe(view, request.method, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        """Ответы DRF и TemplateResponse рендерятся после представления: время рендеринга считается
+        от этого вызова до обратного вызова после рендеринга."""
+        metrics = _current.get()
+        started = time.perf_counter()
+
+        def rendered(response):
+            metrics.spans["render"] += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics_view(request):
+    """Метрики выборки запросов в формате Prometheus. Доступны только при включенной выборке
+    (METRICS_SAMPLE_RATE > 0) и по токену METRICS_TOKEN (Authorization: Bearer)."""
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not (
+        settings.METRICS_SAMPLE_RATE
+        and settings.METRICS_TOKEN
+        and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+    ):
+        raise Http404
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
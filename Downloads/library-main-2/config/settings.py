@@ -3,6 +3,7 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,6 +26,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "django_filters",
@@ -36,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.instrumentation.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -90,16 +93,55 @@ WSGI_APPLICATION = "config.wsgi.application"
 # }
 
 
+# Соединения с БД. CONN_MAX_AGE - время жизни (сек.) постоянного соединения потока WSGI-сервера или воркера Celery
+# (0 - новое соединение на каждый запрос), перед повторным использованием соединение проверяется (CONN_HEALTH_CHECKS).
+# Под ASGI запросы выполняются в своих потоках и постоянные соединения не используются (CONN_MAX_AGE=0), соединения
+# переиспользует пул: pgbouncer (DB_HOST=pgbouncer, сервис в docker-compose.yaml) или пул psycopg 3 (DB_POOL_MAX_SIZE,
+# требует пакета psycopg[pool] вместо psycopg2). pgbouncer в режиме пула транзакций не поддерживает курсоры
+# на стороне сервера (выгрузка журнала операций), они отключаются DB_DISABLE_SERVER_SIDE_CURSORS.
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("POSTGRES_DB"),
         "USER": os.getenv("POSTGRES_USER"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
-        'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('PORT', '5432'),
+        "HOST": os.getenv("DB_HOST", "db"),
+        "PORT": os.getenv("PORT", "5432"),
+        "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": os.getenv("CONN_HEALTH_CHECKS", "True") == "True",
+        "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS")
+        == "True",
     }
 }
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 0))
+if DB_POOL_MAX_SIZE:
+    # пул несовместим с постоянными соединениями: соединение возвращается в пул по окончании запроса
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        }
+    }
+
+# Реплика основной БД для чтения журнала операций, каталога и отчетов (config.db_router). Включается адресом
+# реплики REPLICA_DB_HOST, остальные параметры соединения те же, что у основной БД. После записи пользователь
+# REPLICA_STICKY_SECONDS секунд читает из основной БД (больше отставания реплики). В тестах реплика -
+# то же соединение, что и основная БД (TEST MIRROR). Отметки о записи хранятся в кеше и должны быть видны всем
+# процессам веб-сервера, поэтому реплика используется только вместе с общим кешем (CACHE_LOCATION, см. ниже):
+# с локальным кешем процесса запрос, обслуженный другим процессом, сразу после записи читал бы устаревшую реплику.
+REPLICA_ENABLED = bool(os.getenv("REPLICA_DB_HOST")) and bool(
+    os.getenv("CACHE_LOCATION")
+)
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+DATABASES["replica"] = {
+    **DATABASES["default"],
+    "HOST": os.getenv("REPLICA_DB_HOST", DATABASES["default"]["HOST"]),
+    "PORT": os.getenv("REPLICA_DB_PORT", DATABASES["default"]["PORT"]),
+    "TEST": {"MIRROR": "default"},
+}
+DATABASE_ROUTERS = ["config.db_router.ReplicaRouter"]
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -158,15 +200,125 @@ STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_TIMEZONE = "Europe/Moscow"
+# Celery закрывает соединение с БД до и после каждой задачи, а при CELERY_DB_REUSE_MAX - только раз в столько задач.
+# Между задачами закрываются устаревшие (CONN_MAX_AGE) и неисправные соединения (config.celery).
+CELERY_DB_REUSE_MAX = int(os.getenv("CELERY_DB_REUSE_MAX", 1000))
 CELERY_BEAT_SCHEDULE = {
     # Задача для предупреждения о необходимости возврата книги в библиотеку
     "check_last_login": {
         "task": "library.tasks.send_mail_return_books",
         "schedule": timedelta(minutes=1),
     },
+    # Ночная сверка сводных таблиц отчетов с журналом операций
+    "check_lending_stats": {
+        "task": "library.tasks.check_lending_stats",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    # Сверка счетчиков книг с журналом операций: ночью инкрементальная, по воскресеньям полная
+    "reconcile_book_counters": {
+        "task": "library.tasks.reconcile_book_counters",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "reconcile_book_counters_full": {
+        "task": "library.tasks.reconcile_book_counters",
+        "schedule": crontab(hour=4, minute=0, day_of_week=0),
+        "kwargs": {"full": True},
+    },
+    # Секции журнала операций на следующий год и перенос закрытых операций в архив
+    "maintain_lending_partitions": {
+        "task": "library.tasks.maintain_lending_partitions",
+        "schedule": crontab(hour=2, minute=0, day_of_month=1),
+    },
 }
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 60 * 60
+# Уведомления читателей отправляются отдельными воркерами через очереди каналов,
+# чтобы медленный SMTP-сервер или недоступность Телеграма не останавливали друг друга.
+CELERY_TASK_ROUTES = {
+    "library.tasks.send_email_notifications": {"queue": "email"},
+    "library.tasks.send_telegram_notifications": {"queue": "telegram"},
+}
+NOTIFICATIONS_CHUNK_SIZE = int(os.getenv("NOTIFICATIONS_CHUNK_SIZE", 100))
+# Скорость отправки сообщений (не порций) одним процессом воркера канала, в формате Celery: "10/s", "600/m",
+# "0" - без ограничения. Лимит провайдера (SMTP-сервера, Телеграма) делится на количество процессов
+# воркеров канала (--concurrency, умноженное на количество воркеров).
+NOTIFICATIONS_EMAIL_RATE_LIMIT = os.getenv("NOTIFICATIONS_EMAIL_RATE_LIMIT") or "10/s"
+NOTIFICATIONS_TELEGRAM_RATE_LIMIT = (
+    os.getenv("NOTIFICATIONS_TELEGRAM_RATE_LIMIT") or "25/s"
+)
+
+# Повторы транзакции операции по библиотеке после взаимной блокировки или ошибки сериализации:
+# количество и начальная задержка (сек.), которая удваивается с каждым повтором (library.services.lending_atomic)
+LENDING_MAX_RETRIES = int(os.getenv("LENDING_MAX_RETRIES", 3))
+LENDING_RETRY_DELAY = float(os.getenv("LENDING_RETRY_DELAY", 0.05))
+
+# Секционирование журнала операций по годам (library.partitions): закрытые операции старше LENDING_ARCHIVE_YEARS лет
+# переносятся в архивные секции (при LENDING_ARCHIVE_TABLESPACE - в этом табличном пространстве PostgreSQL),
+# секции создаются заранее на LENDING_PARTITIONS_AHEAD лет вперед.
+LENDING_ARCHIVE_YEARS = int(os.getenv("LENDING_ARCHIVE_YEARS", 3))
+LENDING_PARTITIONS_AHEAD = int(os.getenv("LENDING_PARTITIONS_AHEAD", 1))
+LENDING_ARCHIVE_TABLESPACE = os.getenv("LENDING_ARCHIVE_TABLESPACE", "")
+
+# Общий кеш (Redis) для метрик и кеширования. Без CACHE_LOCATION используется локальный кеш процесса,
+# а кеширование ответов каталога и ролей пользователей отключается, так как его сброс не виден другим процессам.
+CACHE_ENABLED = bool(os.getenv("CACHE_LOCATION"))
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv("CATALOGUE_CACHE_TIMEOUT", 60 * 10))
+ROLE_CACHE_TIMEOUT = int(os.getenv("ROLE_CACHE_TIMEOUT", 60 * 60))
+# Аутентификация по JWT без чтения пользователя из БД на каждый запрос. Отзыв токенов хранится в общем кеше,
+# поэтому режим включается только вместе с ним. Redis не должен вытеснять ключи (maxmemory-policy noeviction),
+# иначе вытесненная отметка отзыва снова делает токен действительным.
+TOKEN_USER_ENABLED = CACHE_ENABLED and os.getenv("TOKEN_USER_ENABLED", False) == "True"
+if TOKEN_USER_ENABLED:
+    REST_FRAMEWORK["DEFAULT_AUTHENTICATION_CLASSES"] = (
+        "users.authentication.TokenUserAuthentication",
+    )
+# бэкенды кеша учитывают попадания и промахи в метриках запроса (config.instrumentation)
+if CACHE_ENABLED:
+    CACHES = {
+        "default": {
+            "BACKEND": "config.instrumentation.InstrumentedRedisCache",
+            "LOCATION": os.getenv("CACHE_LOCATION"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "config.instrumentation.InstrumentedLocMemCache",
+        }
+    }
+
+# Инструментирование запросов (config.instrumentation): заголовок Server-Timing и журнал запросов, которые
+# дольше INSTRUMENTATION_SLOW_MS (мс). Доля запросов METRICS_SAMPLE_RATE (от 0 до 1) собирается для /metrics/,
+# при нуле эндпоинт отключен. Эндпоинт отвечает только на запросы с заголовком Authorization: Bearer METRICS_TOKEN
+# (без токена он тоже отключен): адрес клиента не проверяется, за обратным прокси все запросы приходят с его адреса.
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "True") == "True"
+INSTRUMENTATION_SLOW_MS = int(os.getenv("INSTRUMENTATION_SLOW_MS", 500))
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {
+            "format": "{levelname} {asctime} {name} {message}",
+            "style": "{",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "simple",
+        },
+    },
+    "loggers": {
+        "config.instrumentation": {
+            "handlers": ["console"],
+            "level": os.getenv("INSTRUMENTATION_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
 
 CORS_ALLOWED_ORIGINS = [
     "https://read-only.example.com",
@@ -183,6 +335,16 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", False) == "True"
 EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", False) == "True"
+# сколько писем отправляется через одно SMTP-соединение, после чего оно открывается заново
+EMAIL_MAX_MESSAGES_PER_CONNECTION = int(
+    os.getenv("EMAIL_MAX_MESSAGES_PER_CONNECTION", 100)
+)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_URL = os.getenv("TELEGRAM_URL")
+TELEGRAM_TIMEOUT = (3.05, 10)  # тайм-ауты соединения и чтения ответа Bot API (сек.)
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 10))
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_MAX_RETRY_AFTER = (
+    60  # дольше этого времени (сек.) не ждем, даже если Телеграм просит
+)
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
+from config.instrumentation import metrics_view
 from library.urls import schema_view
 from library.views import AuthorsViewSet, BooksViewSet
 
@@ -20,6 +21,7 @@ urlpatterns = [
         name="schema-swagger-ui",
     ),
     path("redoc/", schema_view.with_ui("redoc", cache_timeout=0), name="schema-redoc"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
 urlpatterns += router_books.urls
 urlpatterns += router_authors.urls
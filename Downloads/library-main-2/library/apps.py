@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "library"
+
+    def ready(self):
+        import config.instrumentation  # noqa: F401 (учет SQL-запросов во всех соединениях с БД)
+        import library.signals  # noqa: F401
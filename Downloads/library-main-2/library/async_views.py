@@ -0,0 +1,163 @@
+# Асинхронные представления чтения каталога книг и журнала операций для развертывания через ASGI
+# (config/asgi.py, uvicorn). Пока запрос ожидает БД или кеш, процесс веб-сервера обслуживает другие запросы.
+# Ответы совпадают с синхронными представлениями (library.views): те же фильтры, пагинация, сериализаторы,
+# права доступа и записи кеша каталога. Строки читаются асинхронным ORM Django (aget, acount, async for),
+# кеш - клиентом redis.asyncio (config.async_cache), пользователь аутентифицируется по JWT (aauthenticate).
+# Фильтры django-filter и поиск по каталогу могут обращаться к БД синхронно, поэтому queryset с фильтрами
+# по параметрам запроса строится в отдельном потоке. Чтение с реплики выбирается так же, как в синхронных
+# представлениях (config.db_router).
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import (APIException, AuthenticationFailed,
+                                       NotAuthenticated)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+from rest_framework_simplejwt.authentication import \
+    JWTStatelessUserAuthentication
+
+from config import async_cache, settings
+from config.db_router import aread_db
+from config.instrumentation import span
+from library.cache import (CATALOGUE_DEPENDENCIES, acatalogue_generation,
+                           acatalogue_pinned, catalogue_cache_key,
+                           catalogue_etag, catalogue_headers)
+from library.paginations import BooksPaginator, LendingCursorPaginator
+from library.serializer import (BooksSerializerReadOnly,
+                                LendingSerializerReadOnly)
+from library.views import (BooksViewSet, LendingListApiView,
+                           LendingRetrieveApiView)
+from users.authentication import aauthenticate
+from users.permissions import ais_librarian
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    with span("render"):
+        content = JSONRenderer().render(data)
+    return HttpResponse(
+        content, status=status_code, headers=headers, content_type="application/json"
+    )
+
+
+def error_response(request, exc):
+    """Ответ с ошибкой в том же виде, что у представлений DRF."""
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        exc.auth_header = JWTStatelessUserAuthentication().authenticate_header(request)
+    response = exception_handler(exc, {})
+    headers = {}
+    if "WWW-Authenticate" in response:
+        headers["WWW-Authenticate"] = response["WWW-Authenticate"]
+    return json_response(response.data, response.status_code, headers)
+
+
+def async_api_view(view):
+    """Общая часть асинхронных представлений: только GET, доступ для аутентифицированных пользователей
+    (IsAuthenticated), роль пользователя и ошибки в формате DRF. Представление получает запрос DRF.
+    """
+
+    @require_GET
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await aauthenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+            request.user = user
+            await ais_librarian(request)
+            await aread_db(request)
+            api_request = Request(request)
+            api_request.user = user
+            return await view(api_request, *args, **kwargs)
+        except (APIException, Http404) as exc:
+            return error_response(request, exc)
+
+    return wrapper
+
+
+async def filtered_queryset(view_class, request, **initkwargs):
+    """queryset синхронного представления с его фильтрами. Без параметров запроса фильтры не обращаются к БД
+    и вызываются сразу, иначе - в отдельном потоке."""
+    view = view_class(
+        request=request, args=(), kwargs={}, format_kwarg=None, **initkwargs
+    )
+
+    def build():
+        return view.filter_queryset(view.get_queryset())
+
+    if request.query_params:
+        return await sync_to_async(build)()
+    return build()
+
+
+async def catalogue_response(request, basename, action, pk, load):
+    """Ответ каталога через кеш ответов (library.cache), общий с синхронными представлениями."""
+    if not settings.CACHE_ENABLED:
+        return json_response(await load())
+    generation = await acatalogue_generation(CATALOGUE_DEPENDENCIES[basename])
+    key = catalogue_cache_key(
+        request, basename, action, pk, request._is_librarian, generation
+    )
+    cached = await async_cache.aget(key)
+    if cached is None:
+        if await acatalogue_pinned(CATALOGUE_DEPENDENCIES[basename]):
+            request._read_db = DEFAULT_DB_ALIAS
+        cached = {"data": await load(), "etag": catalogue_etag(key)}
+        await async_cache.aset(key, cached, settings.CATALOGUE_CACHE_TIMEOUT)
+    headers = catalogue_headers(cached)
+    if cached["etag"] in request.headers.get("If-None-Match", ""):
+        return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return json_response(cached["data"], headers=headers)
+
+
+@async_api_view
+async def books_list(request):
+    """Список книг (асинхронный вариант BooksViewSet.list)."""
+
+    async def load():
+        queryset = await filtered_queryset(
+            BooksViewSet, request, action="list", basename="books"
+        )
+        paginator = BooksPaginator()
+        page = await paginator.apaginate_queryset(queryset, request)
+        data = BooksSerializerReadOnly(page, many=True).data
+        return paginator.get_paginated_response(data).data
+
+    return await catalogue_response(request, "books", "list", "", load)
+
+
+@async_api_view
+async def book_detail(request, pk):
+    """Книга (асинхронный вариант BooksViewSet.retrieve)."""
+
+    async def load():
+        queryset = await filtered_queryset(
+            BooksViewSet, request, action="retrieve", basename="books"
+        )
+        return BooksSerializerReadOnly(await aget_object_or_404(queryset, pk=pk)).data
+
+    return await catalogue_response(request, "books", "retrieve", pk, load)
+
+
+@async_api_view
+async def lending_list(request):
+    """Журнал операций (асинхронный вариант LendingListApiView)."""
+    queryset = await filtered_queryset(LendingListApiView, request)
+    paginator = LendingCursorPaginator()
+    page = await paginator.apaginate_queryset(queryset, request)
+    data = LendingSerializerReadOnly(page, many=True).data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+@async_api_view
+async def lending_detail(request, pk):
+    """Операция по библиотеке (асинхронный вариант LendingRetrieveApiView)."""
+    queryset = await filtered_queryset(LendingRetrieveApiView, request)
+    lending = await aget_object_or_404(queryset, pk=pk)
+    return json_response(LendingSerializerReadOnly(lending).data)
@@ -0,0 +1,140 @@
+# Кеширование ответов каталога (авторы и книги) для list/retrieve.
+# Ключ ответа содержит номер поколения каталога, параметры запроса, страницу и роль пользователя (библиотекарь
+# или читатель). При изменении книги, автора или операции по библиотеке номер поколения увеличивается, и все
+# ранее сохраненные ответы перестают использоваться (сами записи удаляются из кеша по истечении срока хранения).
+# Асинхронные представления (library.async_views) используют те же ключи и записи кеша.
+# При чтении с реплики (config.db_router) ответ, сохраняемый в кеш сразу после изменения каталога, строится
+# по основной БД: реплика может еще не содержать изменения, а кеш хранил бы устаревший ответ.
+
+import hashlib
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from config import async_cache, settings
+from config.db_router import ais_pinned, is_pinned, pin_to_primary
+from users.permissions import IsLibrarian
+
+# от каких поколений зависит ответ представления: книги показывают автора и счетчики операций
+CATALOGUE_DEPENDENCIES = {
+    "authors": ("authors",),
+    "books": ("authors", "books"),
+}
+
+
+def catalogue_generation(names):
+    """Функция возвращает текущие номера поколений каталога."""
+    keys = [f"catalogue:generation:{name}" for name in names]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, 1, None)
+            generations[key] = cache.get(key, 1)
+    return ".".join(str(generations[key]) for key in keys)
+
+
+async def acatalogue_generation(names):
+    """Асинхронный вариант catalogue_generation."""
+    keys = [f"catalogue:generation:{name}" for name in names]
+    generations = await async_cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await async_cache.aadd(key, 1, None)
+            generations[key] = await async_cache.aget(key, 1)
+    return ".".join(str(generations[key]) for key in keys)
+
+
+def catalogue_cache_key(request, basename, action, pk, librarian, generation):
+    """Ключ кешированного ответа каталога."""
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = ":".join(
+        (
+            request.get_host(),
+            action,
+            str(pk),
+            "librarian" if librarian else "reader",
+            query,
+        )
+    )
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f"catalogue:{basename}:{generation}:{digest}"
+
+
+def catalogue_etag(key):
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def catalogue_headers(cached):
+    return {"ETag": cached["etag"], "Cache-Control": "private, no-cache"}
+
+
+def catalogue_bump(names):
+    for name in names:
+        key = f"catalogue:generation:{name}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+    pin_to_primary(*(f"catalogue:{name}" for name in names))
+
+
+def catalogue_invalidate(*names):
+    """Функция сбрасывает кешированные ответы каталога, увеличивая номер поколения. Внутри транзакции
+    поколение увеличивается после ее фиксации: иначе параллельное чтение между сбросом и фиксацией
+    сохранило бы в кеше под новым поколением еще не измененные данные."""
+    transaction.on_commit(lambda: catalogue_bump(names))
+
+
+def catalogue_pinned(names):
+    """Функция проверяет, изменялся ли каталог недавно (ответ нужно строить по основной БД)."""
+    return settings.REPLICA_ENABLED and is_pinned(
+        *(f"catalogue:{name}" for name in names)
+    )
+
+
+async def acatalogue_pinned(names):
+    """Асинхронный вариант catalogue_pinned."""
+    return settings.REPLICA_ENABLED and await ais_pinned(
+        *(f"catalogue:{name}" for name in names)
+    )
+
+
+class CachedCatalogueMixin:
+    """Примесь к ViewSet: кеширует ответы list/retrieve и поддерживает ETag (ответ 304 на If-None-Match)."""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cache_key(self, request):
+        return catalogue_cache_key(
+            request,
+            self.basename,
+            self.action,
+            self.kwargs.get("pk", ""),
+            IsLibrarian().has_permission(request, self),
+            catalogue_generation(CATALOGUE_DEPENDENCIES[self.basename]),
+        )
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if not settings.CACHE_ENABLED:
+            return view(request, *args, **kwargs)
+        key = self.cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            if catalogue_pinned(CATALOGUE_DEPENDENCIES[self.basename]):
+                request._read_db = DEFAULT_DB_ALIAS
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cached = {"data": response.data, "etag": catalogue_etag(key)}
+            cache.set(key, cached, settings.CATALOGUE_CACHE_TIMEOUT)
+        headers = catalogue_headers(cached)
+        if cached["etag"] in request.headers.get("If-None-Match", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(cached["data"], headers=headers)
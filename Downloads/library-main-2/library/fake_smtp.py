@@ -0,0 +1,76 @@
+# Локальная заглушка SMTP-сервера для тестов и замеров отправки писем без почтового провайдера.
+# Сервер понимает минимальный набор команд SMTP, считает соединения и принятые письма, но никуда их не отправляет.
+
+import socketserver
+import threading
+
+
+class FakeSMTPServer:
+    """Заглушка SMTP. Используется как контекстный менеджер, адрес - в атрибутах host и port.
+    При drop_after сервер один раз разрывает соединение после приема стольких писем (обрыв связи с провайдером).
+    Адреса из refuse сервер отклоняет ответом 550, как несуществующие ящики.
+    """
+
+    def __init__(self, drop_after=None, refuse=()):
+        self.drop_after = drop_after
+        self.refuse = set(refuse)
+        self.messages = 0  # сколько писем принято
+        self.connections = 0  # сколько SMTP-соединений открыли клиенты
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def handler(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                with fake.lock:
+                    fake.connections += 1
+                self.reply("220 fake ESMTP")
+                while line := self.rfile.readline():
+                    command = line[:4].upper()
+                    if command == b"DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                            pass
+                        with fake.lock:
+                            fake.messages += 1
+                            drop = fake.messages == fake.drop_after
+                        self.reply("250 OK")
+                        if drop:
+                            break
+                    elif command == b"RCPT" and any(
+                        address.encode() in line for address in fake.refuse
+                    ):
+                        self.reply("550 No such user")
+                    elif command == b"QUIT":
+                        self.reply("221 Bye")
+                        break
+                    elif command in (
+                        b"EHLO",
+                        b"HELO",
+                        b"MAIL",
+                        b"RCPT",
+                        b"RSET",
+                        b"NOOP",
+                    ):
+                        self.reply("250 OK")
+                    else:
+                        self.reply("502 Command not implemented")
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,72 @@
+# Локальная заглушка Bot API Телеграма для тестов и замеров пропускной способности уведомлений без сети.
+# Сервер принимает sendMessage, запоминает сообщения и по желанию отвечает 429 (превышен лимит) первые N раз
+# или 502 на первые N принятых сообщений (ошибка шлюза после того, как сообщение уже принято).
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegramServer:
+    """Заглушка Bot API. Используется как контекстный менеджер, адрес для TELEGRAM_URL - в атрибуте url."""
+
+    def __init__(self, rate_limited=0, retry_after=1, server_errors=0):
+        self.messages = []
+        self.rate_limited = rate_limited  # сколько первых запросов получат ответ 429
+        self.retry_after = retry_after
+        self.server_errors = server_errors  # сколько принятых сообщений получат ответ 502
+        self.connections = 0  # сколько TCP-соединений открыли клиенты
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}/bot"
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake.lock:
+                    if fake.rate_limited > 0:
+                        fake.rate_limited -= 1
+                        status = 429
+                        answer = {
+                            "ok": False,
+                            "error_code": 429,
+                            "parameters": {"retry_after": fake.retry_after},
+                        }
+                    else:
+                        status = 200
+                        fake.messages.append(json.loads(body or b"{}"))
+                        answer = {"ok": True, "result": {}}
+                        if fake.server_errors > 0:
+                            fake.server_errors -= 1
+                            status = 502
+                            answer = {"ok": False, "error_code": 502}
+                content = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
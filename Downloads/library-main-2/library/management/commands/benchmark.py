@@ -0,0 +1,786 @@
+# Замеры производительности библиотеки на синтетических данных.
+# Команда наполняет журнал операций служебными книгами и читателями, поэтому запускать ее следует
+# только на тестовой (копии) базы данных, но не на рабочей.
+
+import asyncio
+import io
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.contrib.auth.models import Group
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.mail import send_mail
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from config import settings
+from library.fake_smtp import FakeSMTPServer
+from library.fake_telegram import FakeTelegramServer
+from library.metrics import lending_retries
+from library.models import Authors, Books, Lending
+from library.partitions import (LIVE_TABLE, ensure_partitions,
+                                maintain_partitions, partitions_info)
+from library.reconcile import counters_drift
+from library.search import catalogue_search
+from library.serializer import (BooksSerializerReadOnly,
+                                LendingSerializerReadOnly)
+from library.services import (email_connection_close, email_send_many,
+                              open_issuances, telegram_send_many)
+from library.views import LendingCreateApiView, LendingDestroyApiView
+from users.models import Users
+from users.permissions import LIBRARIAN_GROUP
+from users.serializer import UserTokenObtainPairSerializer
+
+BATCH_SIZE = 10_000
+# каждая сотая выдача синтетического журнала остается открытой (книга на руках)
+OPEN_LOANS_EVERY = 100
+DATED_JOURNAL_BATCH_SIZE = 1_000_000  # пар выдача/возврат в одном INSERT ... SELECT
+# пары выдача/возврат с датами выдачи за последние days дней, каждая сотая выдача остается открытой
+DATED_JOURNAL_SQL = """
+INSERT INTO library_lending (id, user_id, book_id, operation, date_event, id_return, is_return,
+    is_loss, is_write_off, arrival_quantity, issued_quantity, archived)
+SELECT p.id + k.n, p.user_id, p.book_id,
+    CASE k.n WHEN 0 THEN 'issuance' ELSE 'return' END,
+    CASE k.n WHEN 0 THEN p.day ELSE least(p.day + 14, current_date) END,
+    CASE WHEN k.n = 0 AND NOT p.open THEN p.id + 1 ELSE 0 END,
+    k.n = 0 AND NOT p.open, false, false, 0, 0, false
+FROM (
+    SELECT %(first_id)s + 2 * g AS id,
+        (%(readers)s::bigint[])[1 + floor(random() * %(readers_count)s)::int] AS user_id,
+        (%(books)s::bigint[])[1 + floor(random() * %(books_count)s)::int] AS book_id,
+        current_date - floor(random() * %(days)s)::int AS day,
+        g %% 100 = 0 AS open
+    FROM generate_series(0, %(pairs)s - 1) g
+) p CROSS JOIN (VALUES (0), (1)) k(n)
+WHERE NOT (k.n = 1 AND p.open)
+"""
+# слова для названий и аннотаций синтетического каталога
+SEARCH_WORDS = (
+    "любовь жизнь море остров капитан дорога север зима лето город степь лес река "
+    "тайна война мир путешествие звезда ветер дом сад ночь утро письмо время память "
+    "золото охотник странник корабль маяк сердце огонь тишина граница пустыня"
+).split()
+
+
+class Command(BaseCommand):
+    help = "Замеры производительности на синтетических данных (только для тестовой БД)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenario",
+            choices=(
+                "open_loans",
+                "telegram",
+                "email",
+                "serializers",
+                "search",
+                "contention",
+                "asgi",
+                "connections",
+                "partitions",
+            ),
+        )
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[100_000, 1_000_000, 10_000_000],
+            help="размеры журнала операций, на которых выполняются замеры",
+        )
+        parser.add_argument(
+            "--page-sizes",
+            nargs="+",
+            type=int,
+            default=[10, 100, 1000],
+            help="размеры страниц для замера сериализаторов",
+        )
+        parser.add_argument("--probes", type=int, default=1000)
+        parser.add_argument(
+            "--titles",
+            type=int,
+            default=1_000_000,
+            help="размер синтетического каталога для замера поиска",
+        )
+        parser.add_argument(
+            "--workers",
+            nargs="+",
+            type=int,
+            default=[1, 4, 16],
+            help="количество одновременно работающих библиотекарей для замера конкуренции за книги",
+        )
+        parser.add_argument(
+            "--hot-books",
+            type=int,
+            default=3,
+            help="количество популярных книг, с которыми работают все библиотекари",
+        )
+        parser.add_argument(
+            "--operations",
+            type=int,
+            default=2000,
+            help="количество операций в замере конкуренции за книги",
+        )
+        parser.add_argument(
+            "--concurrency",
+            nargs="+",
+            type=int,
+            default=[100, 300, 1000],
+            help="количество одновременно работающих читателей для замера ASGI и WSGI",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=32,
+            help="количество потоков WSGI-сервера (одновременно обрабатываемых запросов) для замера ASGI и WSGI",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=5000,
+            help="количество запросов в каждом замере ASGI и WSGI",
+        )
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=0,
+            help="задержка каждого SQL-запроса (мс) в замере ASGI и WSGI, имитирующая сеть до удаленной БД",
+        )
+        parser.add_argument(
+            "--years",
+            type=int,
+            default=10,
+            help="за сколько лет распределены даты операций в замере секций журнала",
+        )
+        parser.add_argument("--books", type=int, default=1000)
+        parser.add_argument("--readers", type=int, default=1000)
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=1000,
+            help="количество сообщений для замера отправки в Телеграм и на почту",
+        )
+
+    def handle(self, *args, **options):
+        if options["scenario"] in ("telegram", "email"):
+            # замеры отправки уведомлений не используют БД
+            return getattr(self, f"scenario_{options['scenario']}")(options)
+        self.books = self.bench_books(options["books"])
+        self.readers = self.bench_readers(options["readers"])
+        getattr(self, f"scenario_{options['scenario']}")(options)
+
+    def scenario_open_loans(self, options):
+        """Поиск открытой выдачи (возврат, утеря, повторная выдача) при росте журнала операций. Количество открытых
+        выдач растет вместе с журналом (OPEN_LOANS_EVERY), поиск замеряется отдельно для пар читатель/книга
+        с открытой выдачей (hit) и без нее (miss)."""
+        for size in sorted(options["sizes"]):
+            self.grow_journal(size)
+            open_loans = list(
+                Lending.objects.filter(operation="issuance", id_return=0).values_list(
+                    "user_id", "book_id"
+                )
+            )
+            open_pairs = set(open_loans)
+            timings = {"hit": [], "miss": []}
+            for _ in range(options["probes"]):
+                for kind, timing in timings.items():
+                    if kind == "hit":
+                        user_pk, book_pk = random.choice(open_loans)
+                    else:
+                        user_pk, book_pk = open_loans[0]
+                        while (user_pk, book_pk) in open_pairs:
+                            user_pk = random.choice(self.readers)
+                            book_pk = random.choice(self.books)
+                    started = time.perf_counter()
+                    open_issuances(user_pk, book_pk).first()
+                    timing.append((time.perf_counter() - started) * 1000)
+            rows = Lending.objects.count()
+            for kind, timing in timings.items():
+                self.report(
+                    f"open_loans {kind} rows={rows} open={len(open_loans)}", timing
+                )
+        self.stdout.write(open_issuances(*open_loans[0]).explain())
+
+    def scenario_partitions(self, options):
+        """Поиск открытой выдачи и чтение журнала за текущий год на секционированном журнале (library.partitions)
+        до и после переноса закрытых операций в архив. Журнал заполняется парами выдача/возврат за --years лет
+        запросами INSERT ... SELECT, поэтому замер на 50 млн строк (--sizes 50000000) занимает минуты.
+        """
+        if connection.vendor != "postgresql":
+            raise CommandError("Замер секций журнала выполняется только на PostgreSQL.")
+        today = date.today()
+        year_start = date(today.year, 1, 1)
+        current_year = Lending.objects.filter(date_event__gte=year_start)
+        # секции всех лет журнала, как после миграции рабочей БД, а не одна секция по умолчанию
+        ensure_partitions(
+            LIVE_TABLE, range(today.year - options["years"], today.year + 1)
+        )
+        for size in sorted(options["sizes"]):
+            rows = self.grow_dated_journal(size, options["years"])
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM (ANALYZE) library_lending")
+            for stage in ("before", "after"):
+                if stage == "after":
+                    started = time.perf_counter()
+                    result = maintain_partitions()
+                    self.stdout.write(
+                        f"archive rows={rows}: archived={result['archived']} "
+                        f"dropped={len(result['dropped'])} "
+                        f"{time.perf_counter() - started:.1f} s"
+                    )
+                timings = {"open_loans": [], "current_year_page": []}
+                for _ in range(options["probes"]):
+                    user_pk = random.choice(self.readers)
+                    book_pk = random.choice(self.books)
+                    started = time.perf_counter()
+                    open_issuances(user_pk, book_pk).first()
+                    timings["open_loans"].append((time.perf_counter() - started) * 1000)
+                    started = time.perf_counter()
+                    list(current_year.order_by("-date_event", "-id")[:100])
+                    timings["current_year_page"].append(
+                        (time.perf_counter() - started) * 1000
+                    )
+                for name, name_timings in timings.items():
+                    self.report(f"{name} rows={rows} {stage} archive", name_timings)
+                started = time.perf_counter()
+                count = current_year.count()
+                self.stdout.write(
+                    f"current_year_count rows={rows} {stage} archive: {count} "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms"
+                )
+        for name, rows, size in partitions_info():
+            self.stdout.write(f"{name}: ~{rows} rows {size // 2**20} MB")
+        self.stdout.write(open_issuances(self.readers[0], self.books[0]).explain())
+        self.stdout.write(current_year.explain())
+
+    def scenario_serializers(self, options):
+        """Скорость сериализации журнала операций и каталога книг (строк в секунду): модели через поля DRF
+        и словари queryset.values() через быстрый путь сериализаторов только для чтения.
+        """
+        self.grow_journal(max(options["page_sizes"]))
+        cases = (
+            ("lending", LendingSerializerReadOnly, Lending.objects.order_by("-id")),
+            ("books", BooksSerializerReadOnly, Books.objects.order_by("id")),
+        )
+        for name, serializer, queryset in cases:
+            for page_size in sorted(options["page_sizes"]):
+                probes = max(1, options["probes"] // page_size)
+                for path, page in (
+                    ("models", queryset),
+                    ("values", serializer.values(queryset)),
+                ):
+                    started = time.perf_counter()
+                    for _ in range(probes):
+                        serializer(list(page[:page_size]), many=True).data
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{name} page_size={page_size} {path}: "
+                        f"{probes * page_size / elapsed:.0f} rows/s"
+                    )
+
+    def scenario_search(self, options):
+        """Время поиска по каталогу (library.search) на синтетическом каталоге: точные слова и слова с опечаткой."""
+        self.grow_catalogue(options["titles"])
+        timings = {"exact": [], "typo": []}
+        for _ in range(options["probes"]):
+            word = random.choice(SEARCH_WORDS)
+            position = random.randrange(1, len(word) - 1)
+            for kind, term in (
+                ("exact", word),
+                ("typo", word[:position] + word[position + 1 :]),
+            ):
+                started = time.perf_counter()
+                list(catalogue_search(Books.objects.all(), term)[:10])
+                timings[kind].append((time.perf_counter() - started) * 1000)
+        for kind, kind_timings in timings.items():
+            self.report(f"search {kind} books={Books.objects.count()}", kind_timings)
+        self.stdout.write(
+            catalogue_search(Books.objects.all(), SEARCH_WORDS[0])[:10].explain()
+        )
+
+    def scenario_contention(self, options):
+        """Пропускная способность выдачи, возврата и удаления операций через представления API, когда несколько
+        библиотекарей одновременно работают с несколькими популярными книгами: операций в секунду, ответы,
+        повторы транзакций (lending_atomic) и расхождение счетчиков книг с журналом после замера.
+        """
+        hot_books = self.books[: options["hot_books"]]
+        librarian, _ = Users.objects.get_or_create(
+            email="benchmark-librarian@example.com", reader_name="benchmark"
+        )
+        Group.objects.get_or_create(name=LIBRARIAN_GROUP)[0].user_set.add(librarian)
+        for workers in sorted(options["workers"]):
+            # свободных экземпляров меньше, чем читателей, чтобы часть выдач упиралась в остаток книги
+            Books.objects.filter(pk__in=hot_books).update(
+                quantity_all=F("quantity_lending") + workers * 2
+            )
+            drift = counters_drift()
+            retries = lending_retries()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                statuses = sum(
+                    executor.map(
+                        lambda worker: self.contention_worker(
+                            worker,
+                            workers,
+                            hot_books,
+                            librarian,
+                            options["operations"] // workers,
+                        ),
+                        range(workers),
+                    ),
+                    Counter(),
+                )
+            elapsed = time.perf_counter() - started
+            # расхождения, появившиеся за время замера (до него: после замера)
+            drift_after = counters_drift()
+            changed = {
+                pk: (drift.get(pk), drift_after.get(pk))
+                for pk in hot_books
+                if drift.get(pk) != drift_after.get(pk)
+            }
+            self.stdout.write(
+                f"contention workers={workers} books={len(hot_books)}: "
+                f"{sum(statuses.values()) / elapsed:.0f} ops/s "
+                f"retries={lending_retries() - retries} drift={changed or 0} "
+                + " ".join(
+                    f"{name}={count}" for name, count in sorted(statuses.items())
+                )
+            )
+
+    def contention_worker(self, worker, workers, hot_books, librarian, operations):
+        """Библиотекарь выдает популярные книги своим читателям, принимает их обратно и удаляет часть выдач
+        и возвратов. Возвращает количество ответов по операциям и кодам ответа."""
+        factory = APIRequestFactory()
+        create = LendingCreateApiView.as_view()
+        destroy = LendingDestroyApiView.as_view()
+        readers = self.readers[worker::workers]
+        loans = []  # открытые выдачи потока (читатель, книга, id выдачи)
+        returns = []  # возвраты потока (читатель, книга, id выдачи, id возврата)
+        statuses = Counter()
+
+        def request(name, view, method, path, data=None, **kwargs):
+            api_request = getattr(factory, method)(path, data, format="json")
+            force_authenticate(api_request, user=librarian)
+            try:
+                response = view(api_request, **kwargs)
+            except Exception:
+                statuses[f"{name}:error"] += 1
+                return None
+            statuses[f"{name}:{response.status_code}"] += 1
+            return response
+
+        try:
+            for _ in range(operations):
+                action = random.choice(("issuance", "issuance", "return", "delete"))
+                if action == "return" and loans:
+                    reader, book, issuance = loans.pop(random.randrange(len(loans)))
+                    data = {"user": reader, "book": book, "operation": "return"}
+                    response = request(
+                        "return", create, "post", "/lending/create/", data
+                    )
+                    if response is not None and response.status_code == 201:
+                        returns.append((reader, book, issuance, response.data["id"]))
+                elif action == "delete" and returns and random.random() < 0.5:
+                    reader, book, issuance, pk = returns.pop()
+                    response = request(
+                        "delete_return", destroy, "delete", "/lending/delete/", pk=pk
+                    )
+                    if response is not None and response.status_code == 204:
+                        loans.append((reader, book, issuance))
+                elif action == "delete" and loans:
+                    *_, pk = loans.pop(random.randrange(len(loans)))
+                    request(
+                        "delete_issuance", destroy, "delete", "/lending/delete/", pk=pk
+                    )
+                else:
+                    reader, book = random.choice(readers), random.choice(hot_books)
+                    data = {"user": reader, "book": book, "operation": "issuance"}
+                    response = request(
+                        "issuance", create, "post", "/lending/create/", data
+                    )
+                    if response is not None and response.status_code == 201:
+                        loans.append((reader, book, response.data["id"]))
+        finally:
+            connection.close()  # каждый поток работает со своим соединением
+        return statuses
+
+    def scenario_asgi(self, options):
+        """Чтение каталога и журнала операций читателями: синхронные представления через WSGI-обработчик Django,
+        который, как WSGI-сервер, обрабатывает одновременно не больше --threads запросов (по потоку на запрос),
+        и асинхронные представления (library.async_views) через ASGI-обработчик в одном цикле событий.
+        Запросы передаются обработчикам без сети, поэтому сравнивается только обработка запросов приложением:
+        запросов в секунду, p50 и p99 времени ответа (мс, с ожиданием свободного потока) и коды ответов.
+        """
+        self.grow_journal(min(options["sizes"]))
+        logging.getLogger("config.instrumentation").setLevel(logging.ERROR)
+        if options["db_latency"]:
+            latency = options["db_latency"] / 1000
+
+            def delay(execute, sql, params, many, context):
+                time.sleep(latency)
+                return execute(sql, params, many, context)
+
+            connection_created.connect(
+                lambda connection, **kwargs: connection.execute_wrappers.insert(
+                    0, delay
+                ),
+                weak=False,
+            )
+        reader = Users.objects.get(pk=self.readers[0])
+        token = UserTokenObtainPairSerializer.get_token(reader).access_token
+        authorization = f"Bearer {token}"
+        paths = (
+            ("books/", ""),
+            ("books/", "genre=story"),
+            (f"books/{self.books[0]}/", ""),
+            ("lending/", ""),
+        )
+        for concurrency in sorted(options["concurrency"]):
+            for stack in ("wsgi", "asgi"):
+                requests = [
+                    ("/" if stack == "wsgi" else "/async/") + path + "?" + query
+                    for path, query in paths
+                ] * (options["requests"] // len(paths))
+                started = time.perf_counter()
+                if stack == "wsgi":
+                    results = self.wsgi_requests(
+                        requests, authorization, concurrency, options["threads"]
+                    )
+                else:
+                    results = asyncio.run(
+                        self.asgi_requests(requests, authorization, concurrency)
+                    )
+                elapsed = time.perf_counter() - started
+                timings = sorted(timing for timing, _ in results)
+                statuses = Counter(status_code for _, status_code in results)
+                self.stdout.write(
+                    f"{stack} concurrency={concurrency}: {len(results) / elapsed:.0f} req/s "
+                    f"p50={timings[len(timings) // 2]:.1f} ms "
+                    f"p99={timings[int(len(timings) * 0.99) - 1]:.1f} ms "
+                    + " ".join(
+                        f"{code}={count}" for code, count in sorted(statuses.items())
+                    )
+                )
+
+    def scenario_connections(self, options):
+        """Накладные расходы на установку соединения с БД: время открытия соединения с первым запросом и запроса
+        в открытом соединении, затем чтение каталога читателями через WSGI-обработчик (--threads потоков)
+        с новым соединением на каждый запрос (CONN_MAX_AGE=0) и с постоянными соединениями потоков.
+        Для замера через pgbouncer команда запускается с DB_HOST=pgbouncer.
+        """
+        logging.getLogger("config.instrumentation").setLevel(logging.ERROR)
+        timings = {"connect": [], "query": []}
+        for _ in range(options["probes"]):
+            connection.close()
+            for name in ("connect", "query"):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                timings[name].append((time.perf_counter() - started) * 1000)
+        self.report("connect + SELECT 1", timings["connect"])
+        self.report("SELECT 1", timings["query"])
+        setup = statistics.mean(timings["connect"]) - statistics.mean(timings["query"])
+
+        reader = Users.objects.get(pk=self.readers[0])
+        token = UserTokenObtainPairSerializer.get_token(reader).access_token
+        requests = ["/books/?", f"/books/{self.books[0]}/?"] * (
+            options["requests"] // 2
+        )
+        opened = Counter()
+        connection_created.connect(
+            lambda **kwargs: opened.update(["connections"]), weak=False
+        )
+        settings_dict = connections.settings["default"]
+        conn_max_age = settings_dict["CONN_MAX_AGE"]
+        for max_age in (0, 600):
+            # потоки пула создают соединения по этим же настройкам
+            settings_dict["CONN_MAX_AGE"] = max_age
+            opened.clear()
+            started = time.perf_counter()
+            results = self.wsgi_requests(
+                requests, f"Bearer {token}", options["threads"], options["threads"]
+            )
+            elapsed = time.perf_counter() - started
+            rate = len(results) / elapsed
+            self.stdout.write(
+                f"wsgi CONN_MAX_AGE={max_age} threads={options['threads']}: {rate:.0f} req/s "
+                f"connections={opened['connections']} "
+                f"setup={setup * opened['connections'] / elapsed:.0f} ms/s"
+            )
+        settings_dict["CONN_MAX_AGE"] = conn_max_age
+
+    @staticmethod
+    def wsgi_requests(requests, authorization, concurrency, threads):
+        """Запросы concurrency читателей к WSGI-обработчику. Возвращает (время ответа, код ответа)."""
+        handler = WSGIHandler()
+        server_threads = threading.BoundedSemaphore(threads)
+
+        def request(url):
+            path, query = url.split("?")
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "QUERY_STRING": query,
+                "SERVER_NAME": "testserver",
+                "SERVER_PORT": "80",
+                "HTTP_AUTHORIZATION": authorization,
+                "wsgi.input": io.BytesIO(),
+                "wsgi.url_scheme": "http",
+            }
+            started = time.perf_counter()
+            with server_threads:
+                response_status = []
+                response = handler(
+                    environ, lambda status, headers: response_status.append(status)
+                )
+                b"".join(response)
+                response.close()  # request_finished: закрытие соединения с БД, как у WSGI-сервера
+            return (time.perf_counter() - started) * 1000, int(
+                response_status[0].split()[0]
+            )
+
+        def reader(number):
+            return [request(url) for url in requests[number::concurrency]]
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return [
+                result
+                for results in executor.map(reader, range(concurrency))
+                for result in results
+            ]
+
+    @staticmethod
+    async def asgi_requests(requests, authorization, concurrency):
+        """Запросы concurrency читателей к ASGI-обработчику. Возвращает (время ответа, код ответа)."""
+        handler = ASGIHandler()
+
+        async def request(url):
+            path, query = url.split("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": query.encode(),
+                "headers": [
+                    (b"host", b"testserver"),
+                    (b"authorization", authorization.encode()),
+                ],
+                "client": ("127.0.0.1", 0),
+                "server": ("testserver", 80),
+            }
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+            response_status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()  # клиент не отключается до конца ответа
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response_status.append(message["status"])
+
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            return (time.perf_counter() - started) * 1000, response_status[0]
+
+        async def reader(number):
+            return [await request(url) for url in requests[number::concurrency]]
+
+        return [
+            result
+            for results in await asyncio.gather(
+                *(reader(number) for number in range(concurrency))
+            )
+            for result in results
+        ]
+
+    def grow_catalogue(self, size):
+        """Дополняет каталог до size книг со случайными названиями из SEARCH_WORDS."""
+        Authors.objects.bulk_create(
+            [Authors(author=f"{word.title()} benchmark") for word in SEARCH_WORDS],
+            ignore_conflicts=True,
+        )
+        authors = list(
+            Authors.objects.filter(author__endswith=" benchmark").values_list(
+                "pk", flat=True
+            )
+        )
+        missing = size - Books.objects.count()
+        while missing > 0:
+            batch = min(BATCH_SIZE, missing)
+            number = Books.objects.count()
+            Books.objects.bulk_create(
+                [
+                    Books(
+                        name=f"{' '.join(random.sample(SEARCH_WORDS, 3))} {number + index}",
+                        author_id=random.choice(authors),
+                        annotation=" ".join(random.sample(SEARCH_WORDS, 8)),
+                    )
+                    for index in range(batch)
+                ]
+            )
+            missing -= batch
+
+    def scenario_telegram(self, options):
+        """Пропускная способность отправки сообщений в Телеграм через локальную заглушку Bot API."""
+        messages = [(number, "Возврат книги") for number in range(options["messages"])]
+        with FakeTelegramServer() as server:
+            settings.TELEGRAM_URL, settings.TELEGRAM_BOT_TOKEN = server.url, "benchmark"
+            # замеряется скорость без ограничения NOTIFICATIONS_TELEGRAM_RATE_LIMIT
+            settings.NOTIFICATIONS_TELEGRAM_RATE_LIMIT = "0"
+            started = time.perf_counter()
+            sent = telegram_send_many(messages)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"telegram sent={sent} connections={server.connections} "
+            f"{sent / elapsed:.0f} msg/s"
+        )
+
+    def scenario_email(self, options):
+        """Пропускная способность отправки писем через локальную заглушку SMTP: по соединению на письмо (send_mail)
+        и через переиспользуемое соединение (email_send_many)."""
+        messages = [
+            (f"reader{number}@example.com", "Возврат книги")
+            for number in range(options["messages"])
+        ]
+        with FakeSMTPServer() as server, override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST=server.host,
+            EMAIL_PORT=server.port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+        ):
+            started = time.perf_counter()
+            for to_email, message in messages:
+                send_mail("Возврат книги", message, None, [to_email])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"email send_mail connections={server.connections} "
+                f"{len(messages) / elapsed:.0f} msg/s"
+            )
+            connections = server.connections
+            settings.NOTIFICATIONS_EMAIL_RATE_LIMIT = "0"  # скорость без ограничения
+            started = time.perf_counter()
+            sent = email_send_many(messages, "Возврат книги")
+            email_connection_close()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"email email_send_many sent={sent} "
+                f"connections={server.connections - connections} {sent / elapsed:.0f} msg/s"
+            )
+
+    def report(self, title, timings):
+        timings.sort()
+        self.stdout.write(
+            f"{title}: avg={statistics.mean(timings):.3f} ms "
+            f"p50={timings[len(timings) // 2]:.3f} ms "
+            f"p99={timings[int(len(timings) * 0.99) - 1]:.3f} ms"
+        )
+
+    @staticmethod
+    def bench_books(count):
+        author, _ = Authors.objects.get_or_create(author="benchmark")
+        Books.objects.bulk_create(
+            [
+                Books(name=f"benchmark-{number}", author=author, quantity_all=10)
+                for number in range(count)
+            ],
+            ignore_conflicts=True,
+        )
+        return list(
+            Books.objects.filter(author=author).values_list("pk", flat=True)[:count]
+        )
+
+    @staticmethod
+    def bench_readers(count):
+        Users.objects.bulk_create(
+            [
+                Users(email=f"benchmark-{number}@example.com", reader_name="benchmark")
+                for number in range(count)
+            ],
+            ignore_conflicts=True,
+        )
+        return list(
+            Users.objects.filter(reader_name="benchmark").values_list("pk", flat=True)[
+                :count
+            ]
+        )
+
+    def grow_dated_journal(self, size, years):
+        """Дополняет журнал до size строк парами выдача/возврат с датами за последние years лет (DATED_JOURNAL_SQL).
+        Возвращает количество строк журнала."""
+        rows = Lending.objects.count()
+        while rows < size:
+            pairs = min(DATED_JOURNAL_BATCH_SIZE, (size - rows + 1) // 2)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval('library_lending_id_seq')")
+                (first_id,) = cursor.fetchone()
+                cursor.execute(
+                    "SELECT setval('library_lending_id_seq', %s)",
+                    [first_id + 2 * pairs - 1],
+                )
+                cursor.execute(
+                    DATED_JOURNAL_SQL,
+                    {
+                        "first_id": first_id,
+                        "readers": self.readers,
+                        "readers_count": len(self.readers),
+                        "books": self.books,
+                        "books_count": len(self.books),
+                        "days": years * 365,
+                        "pairs": pairs,
+                    },
+                )
+                rows += cursor.rowcount
+        return rows
+
+    def grow_journal(self, size):
+        """Дополняет журнал до size строк парами выдача/возврат. Каждая OPEN_LOANS_EVERY-я выдача остается
+        открытой, без возврата, поэтому частичный индекс lending_open_loan_idx растет вместе с журналом.
+        """
+        rows = Lending.objects.count()
+        while rows < size:
+            pairs = min(BATCH_SIZE, (size - rows + 1) // 2)
+            issuances = Lending.objects.bulk_create(
+                [
+                    Lending(
+                        user_id=random.choice(self.readers),
+                        book_id=random.choice(self.books),
+                        operation="issuance",
+                        is_return=number % OPEN_LOANS_EVERY != 0,
+                    )
+                    for number in range(pairs)
+                ]
+            )
+            closed = [issuance for issuance in issuances if issuance.is_return]
+            returns = Lending.objects.bulk_create(
+                [
+                    Lending(
+                        user_id=issuance.user_id,
+                        book_id=issuance.book_id,
+                        operation="return",
+                    )
+                    for issuance in closed
+                ]
+            )
+            for issuance, lending_return in zip(closed, returns):
+                issuance.id_return = lending_return.pk
+            Lending.objects.bulk_update(closed, ["id_return"], batch_size=BATCH_SIZE)
+            rows += len(issuances) + len(returns)
@@ -0,0 +1,51 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+from library.partitions import maintain_partitions, partitions_info
+
+
+class Command(BaseCommand):
+    help = (
+        "Обслуживание секций журнала операций: секции на следующие годы, перенос закрытых операций "
+        "в архив и удаление опустевших секций."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--archive-years",
+            type=int,
+            help="переносить в архив закрытые операции старше стольких лет (LENDING_ARCHIVE_YEARS)",
+        )
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            help="на сколько лет вперед создавать секции (LENDING_PARTITIONS_AHEAD)",
+        )
+        parser.add_argument(
+            "--no-vacuum",
+            action="store_true",
+            help="не выполнять VACUUM ANALYZE после переноса в архив",
+        )
+        parser.add_argument(
+            "--list", action="store_true", help="только показать секции журнала"
+        )
+
+    def handle(self, *args, **options):
+        if not options["list"]:
+            result = maintain_partitions(
+                years=options["archive_years"],
+                ahead=options["ahead"],
+                vacuum=not options["no_vacuum"],
+            )
+            for name in result["created"]:
+                self.stdout.write(f"создана секция {name}")
+            for name in result["dropped"]:
+                self.stdout.write(f"удалена секция {name}")
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Перенесено в архив операций: {result['archived']}."
+                )
+            )
+        if connection.vendor == "postgresql":
+            for name, rows, size in partitions_info():
+                self.stdout.write(f"{name}: ~{rows} строк, {size // 1024} КБ")
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand, CommandError
+
+from library.stats import stats_check, stats_rebuild
+
+
+class Command(BaseCommand):
+    help = "Проверка (--check) и перестроение (--rebuild) сводных таблиц операций по журналу."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true")
+        parser.add_argument("--check", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            stats_rebuild()
+            self.stdout.write(self.style.SUCCESS("Сводки перестроены по журналу."))
+        if options["check"] or not options["rebuild"]:
+            mismatches = stats_check()
+            for table, key, expected, actual in mismatches[:20]:
+                self.stdout.write(
+                    f"{table} {key}: по журналу {expected}, в сводке {actual}"
+                )
+            if mismatches:
+                raise CommandError(f"Расхождений в сводках: {len(mismatches)}.")
+            self.stdout.write(self.style.SUCCESS("Сводки совпадают с журналом."))
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from library.reconcile import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Сверка счетчиков книг с журналом операций и исправление расхождений."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="сверить все книги, а не только изменившиеся после прошлой сверки",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="только показать расхождения"
+        )
+
+    def handle(self, *args, **options):
+        drift = reconcile_counters(full=options["full"], repair=not options["dry_run"])
+        for book_pk, deltas in list(drift.items())[:20]:
+            self.stdout.write(f"книга {book_pk}: {deltas}")
+        action = "найдено" if options["dry_run"] else "исправлено"
+        self.stdout.write(
+            self.style.SUCCESS(f"Книг с расхождениями {action}: {len(drift)}.")
+        )
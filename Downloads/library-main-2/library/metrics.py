@@ -0,0 +1,73 @@
+# Метрики конвейера уведомлений читателей и повторов транзакций операций по библиотеке. Счетчики хранятся в общем
+# кеше (Redis), поэтому их видят и воркеры Celery всех очередей, и веб-приложение, которое отдает их библиотекарю.
+
+import time
+
+from django.core.cache import cache
+
+CHANNELS = ("email", "telegram")
+THROUGHPUT_WINDOW = (
+    60  # окно (сек.), за которое считается пропускная способность канала
+)
+
+
+def _incr(key, delta=1, timeout=None):
+    cache.add(key, 0, timeout)
+    return cache.incr(key, delta)
+
+
+def notifications_queued(channel, count):
+    """Учет уведомлений, поставленных в очередь канала."""
+    _incr(f"notifications:{channel}:queued", count)
+
+
+def notifications_processed(channel, sent, failed, queued_at):
+    """Учет обработанной воркером порции уведомлений: отправлено, ошибок и задержка от постановки в очередь."""
+    now = time.time()
+    window = int(now // THROUGHPUT_WINDOW)
+    _incr(f"notifications:{channel}:sent", sent)
+    _incr(f"notifications:{channel}:failed", failed)
+    _incr(f"notifications:{channel}:sent:{window}", sent, THROUGHPUT_WINDOW * 2)
+    cache.set(f"notifications:{channel}:lag", round(now - queued_at, 3), None)
+    cache.set(f"notifications:{channel}:processed_at", now, None)
+
+
+def lending_retried():
+    """Учет повтора транзакции операции по библиотеке после взаимной блокировки или ошибки сериализации."""
+    _incr("lending:retries")
+
+
+def lending_retries():
+    return cache.get("lending:retries", 0)
+
+
+def notifications_metrics():
+    """Метрики по каждому каналу: всего в очереди, отправлено, ошибок, остаток очереди,
+    отправлено за последнее окно (в секунду) и задержка последней обработанной порции (сек.).
+    """
+    window = (
+        int(time.time() // THROUGHPUT_WINDOW) - 1
+    )  # последнее полностью завершенное окно
+    metrics = {}
+    for channel in CHANNELS:
+        values = cache.get_many(
+            [
+                f"notifications:{channel}:{name}"
+                for name in ("queued", "sent", "failed", "lag", "processed_at")
+            ]
+            + [f"notifications:{channel}:sent:{window}"]
+        )
+
+        def value(name, default=0):
+            return values.get(f"notifications:{channel}:{name}", default)
+
+        metrics[channel] = {
+            "queued": value("queued"),
+            "sent": value("sent"),
+            "failed": value("failed"),
+            "backlog": max(value("queued") - value("sent") - value("failed"), 0),
+            "throughput": round(value(f"sent:{window}") / THROUGHPUT_WINDOW, 3),
+            "lag": value("lag", None),
+            "processed_at": value("processed_at", None),
+        }
+    return metrics
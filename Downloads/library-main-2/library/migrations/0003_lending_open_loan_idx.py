@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0002_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="lending",
+            index=models.Index(
+                condition=models.Q(("id_return", 0), ("operation", "issuance")),
+                fields=["user", "book"],
+                name="lending_open_loan_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lending",
+            index=models.Index(
+                condition=models.Q(("id_return__gt", 0)),
+                fields=["id_return"],
+                name="lending_id_return_idx",
+            ),
+        ),
+    ]
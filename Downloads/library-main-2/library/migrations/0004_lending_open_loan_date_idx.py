@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0003_lending_open_loan_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="lending",
+            index=models.Index(
+                condition=models.Q(("id_return", 0), ("operation", "issuance")),
+                fields=["date_event"],
+                name="lending_open_loan_date_idx",
+            ),
+        ),
+    ]
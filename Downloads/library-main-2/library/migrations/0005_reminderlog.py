@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0004_lending_open_loan_date_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReminderLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "reminder",
+                    models.CharField(
+                        choices=[
+                            ("soon", "скоро срок возврата"),
+                            ("today", "срок возврата сегодня"),
+                            ("overdue", "срок возврата прошел"),
+                        ],
+                        max_length=10,
+                        verbose_name="вид напоминания",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="дата напоминания")),
+                (
+                    "lending",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reminder_log",
+                        to="library.lending",
+                        verbose_name="выдача",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "напоминание",
+                "verbose_name_plural": "напоминания",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("lending", "reminder", "date"),
+                        name="reminder_log_unique",
+                    )
+                ],
+            },
+        ),
+    ]
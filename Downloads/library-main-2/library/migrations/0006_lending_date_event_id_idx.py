@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0005_reminderlog"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="lending",
+            index=models.Index(
+                fields=["date_event", "id"], name="lending_date_event_id_idx"
+            ),
+        ),
+    ]
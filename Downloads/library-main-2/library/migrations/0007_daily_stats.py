@@ -0,0 +1,130 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0006_lending_date_event_id_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date_event", models.DateField(verbose_name="дата")),
+                (
+                    "operation",
+                    models.CharField(
+                        choices=[
+                            ("inventory", "инвентаризация"),
+                            ("arrival", "поступление"),
+                            ("issuance", "выдача"),
+                            ("return", "возврат"),
+                            ("loss", "утеря"),
+                            ("write_off", "списание"),
+                        ],
+                        max_length=20,
+                        verbose_name="операция",
+                    ),
+                ),
+                (
+                    "operations",
+                    models.IntegerField(default=0, verbose_name="количество операций"),
+                ),
+                (
+                    "books",
+                    models.IntegerField(default=0, verbose_name="количество книг"),
+                ),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stat",
+                        to="library.books",
+                        verbose_name="книга",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сводка по книге",
+                "verbose_name_plural": "сводки по книгам",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date_event", "book", "operation"),
+                        name="book_daily_stat_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ReaderDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date_event", models.DateField(verbose_name="дата")),
+                (
+                    "operation",
+                    models.CharField(
+                        choices=[
+                            ("inventory", "инвентаризация"),
+                            ("arrival", "поступление"),
+                            ("issuance", "выдача"),
+                            ("return", "возврат"),
+                            ("loss", "утеря"),
+                            ("write_off", "списание"),
+                        ],
+                        max_length=20,
+                        verbose_name="операция",
+                    ),
+                ),
+                (
+                    "operations",
+                    models.IntegerField(default=0, verbose_name="количество операций"),
+                ),
+                (
+                    "books",
+                    models.IntegerField(default=0, verbose_name="количество книг"),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stat",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="читатель",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сводка по читателю",
+                "verbose_name_plural": "сводки по читателям",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date_event", "user", "operation"),
+                        name="reader_daily_stat_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:55
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Поисковый вектор книги собирается из названия (вес A), имени автора (вес B) и аннотации (вес C).
+# Автор хранится в другой таблице, поэтому вместо генерируемого столбца вектор заполняют триггеры:
+# при изменении книги и при переименовании автора (пересчитываются все его книги).
+SEARCH_SQL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION library_books_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(
+            (SELECT author FROM library_authors WHERE id = NEW.author_id), ''
+        )), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.annotation, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER library_books_search_vector
+    BEFORE INSERT OR UPDATE OF name, annotation, author_id ON library_books
+    FOR EACH ROW EXECUTE FUNCTION library_books_search_vector();
+
+CREATE OR REPLACE FUNCTION library_authors_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE library_books SET name = name WHERE author_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER library_authors_search_vector
+    AFTER UPDATE OF author ON library_authors
+    FOR EACH ROW WHEN (OLD.author IS DISTINCT FROM NEW.author)
+    EXECUTE FUNCTION library_authors_search_vector();
+
+UPDATE library_books SET name = name;
+
+CREATE INDEX library_books_search_idx ON library_books USING gin (search_vector);
+CREATE INDEX library_books_name_trgm_idx ON library_books USING gin (name gin_trgm_ops);
+CREATE INDEX library_authors_author_trgm_idx ON library_authors USING gin (author gin_trgm_ops);
+"""
+
+REVERSE_SEARCH_SQL = """
+DROP INDEX IF EXISTS library_authors_author_trgm_idx;
+DROP INDEX IF EXISTS library_books_name_trgm_idx;
+DROP INDEX IF EXISTS library_books_search_idx;
+DROP TRIGGER IF EXISTS library_authors_search_vector ON library_authors;
+DROP FUNCTION IF EXISTS library_authors_search_vector();
+DROP TRIGGER IF EXISTS library_books_search_vector ON library_books;
+DROP FUNCTION IF EXISTS library_books_search_vector();
+"""
+
+
+def create_search(apps, schema_editor):
+    """Триггеры и индексы поиска создаются только в PostgreSQL (library.search)."""
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(SEARCH_SQL)
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(REVERSE_SEARCH_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0007_daily_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="books",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, null=True, verbose_name="поисковый вектор"
+            ),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0008_books_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CounterReconciliation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(verbose_name="начало")),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="окончание"
+                    ),
+                ),
+                (
+                    "full",
+                    models.BooleanField(default=False, verbose_name="полная сверка"),
+                ),
+                (
+                    "books_repaired",
+                    models.IntegerField(default=0, verbose_name="исправлено книг"),
+                ),
+            ],
+            options={
+                "verbose_name": "сверка счетчиков",
+                "verbose_name_plural": "сверки счетчиков",
+            },
+        ),
+        migrations.AddField(
+            model_name="books",
+            name="counters_changed_at",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="изменение счетчиков",
+            ),
+        ),
+    ]
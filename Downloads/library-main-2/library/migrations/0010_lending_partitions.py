@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:54
+
+from datetime import date
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Журнал операций в PostgreSQL секционируется (library.partitions): library_lending разбит по пометке archived
+# на секции library_lending_live и library_lending_archive, а каждая из них - по годам date_event.
+# Первичный ключ секционированной таблицы должен включать ключи секционирования: (id, archived, date_event).
+# id по-прежнему выдается последовательностью и уникален, ORM работает с ним как с первичным ключом.
+# Таблица пересоздается, а строки переносятся одним INSERT ... SELECT, поэтому на время миграции журнал блокируется.
+PARTITION_SQL = """
+ALTER TABLE library_lending RENAME TO library_lending_unpartitioned;
+ALTER TABLE library_lending_unpartitioned ALTER COLUMN id DROP IDENTITY IF EXISTS;
+ALTER TABLE library_lending_unpartitioned ALTER COLUMN id DROP DEFAULT;
+DROP SEQUENCE IF EXISTS library_lending_id_seq;
+
+CREATE TABLE library_lending (LIKE library_lending_unpartitioned) PARTITION BY LIST (archived);
+CREATE SEQUENCE library_lending_id_seq OWNED BY library_lending.id;
+ALTER TABLE library_lending ALTER COLUMN id SET DEFAULT nextval('library_lending_id_seq');
+
+CREATE TABLE library_lending_live PARTITION OF library_lending
+    FOR VALUES IN (false) PARTITION BY RANGE (date_event);
+CREATE TABLE library_lending_live_default PARTITION OF library_lending_live DEFAULT;
+CREATE TABLE library_lending_archive PARTITION OF library_lending
+    FOR VALUES IN (true) PARTITION BY RANGE (date_event);
+"""
+
+COPY_SQL = """
+INSERT INTO library_lending SELECT * FROM library_lending_unpartitioned;
+SELECT setval('library_lending_id_seq', coalesce(max(id), 0) + 1, false) FROM library_lending;
+DROP TABLE library_lending_unpartitioned;
+"""
+
+UNPARTITION_SQL = """
+CREATE TABLE library_lending_unpartitioned (LIKE library_lending);
+INSERT INTO library_lending_unpartitioned SELECT * FROM library_lending;
+ALTER SEQUENCE library_lending_id_seq OWNED BY NONE;
+DROP TABLE library_lending;
+ALTER TABLE library_lending_unpartitioned RENAME TO library_lending;
+ALTER SEQUENCE library_lending_id_seq OWNED BY library_lending.id;
+ALTER TABLE library_lending ALTER COLUMN id SET DEFAULT nextval('library_lending_id_seq');
+"""
+
+
+def create_keys(schema_editor, Lending, primary_key):
+    """Первичный ключ, внешние ключи и индексы журнала (после переноса строк)."""
+    users_table = Lending._meta.get_field("user").related_model._meta.db_table
+    schema_editor.execute(
+        f"ALTER TABLE library_lending ADD PRIMARY KEY ({primary_key});"
+        f"ALTER TABLE library_lending ADD CONSTRAINT library_lending_book_id_fk "
+        f"FOREIGN KEY (book_id) REFERENCES library_books (id) DEFERRABLE INITIALLY DEFERRED;"
+        f"ALTER TABLE library_lending ADD CONSTRAINT library_lending_user_id_fk "
+        f"FOREIGN KEY (user_id) REFERENCES {schema_editor.quote_name(users_table)} (id) "
+        f"DEFERRABLE INITIALLY DEFERRED;"
+        f"CREATE INDEX library_lending_book_id_idx ON library_lending (book_id);"
+        f"CREATE INDEX library_lending_user_id_idx ON library_lending (user_id);"
+    )
+    for index in Lending._meta.indexes:
+        schema_editor.add_index(Lending, index)
+
+
+def partition_lending(apps, schema_editor):
+    """Секции создаются только в PostgreSQL: по году для каждого года журнала, текущего и следующего."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT extract(year FROM date_event)::int FROM library_lending"
+        )
+        years = {year for (year,) in cursor.fetchall()}
+    today = date.today()
+    years |= {today.year, today.year + 1}
+    schema_editor.execute(PARTITION_SQL)
+    for year in sorted(years):
+        schema_editor.execute(
+            f"CREATE TABLE library_lending_live_y{year} PARTITION OF library_lending_live "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    schema_editor.execute(COPY_SQL)
+    create_keys(
+        schema_editor, apps.get_model("library", "Lending"), "id, archived, date_event"
+    )
+
+
+def unpartition_lending(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(UNPARTITION_SQL)
+    create_keys(schema_editor, apps.get_model("library", "Lending"), "id")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0009_counter_reconciliation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lending",
+            name="archived",
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name="в архиве"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reminderlog",
+            name="lending",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reminder_log",
+                to="library.lending",
+                verbose_name="выдача",
+            ),
+        ),
+        migrations.RunPython(partition_lending, unpartition_lending),
+    ]
@@ -8,6 +8,7 @@
 
 from datetime import date
 
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 from config import settings
@@ -55,6 +56,10 @@ class Books(models.Model):
     )
     annotation = models.TextField(verbose_name="аннотация", **NULLABLE)
     barcode = models.PositiveIntegerField(verbose_name="штрихкод", **NULLABLE)
+    # заполняется триггером PostgreSQL по названию, автору и аннотации (library.search)
+    search_vector = SearchVectorField(
+        verbose_name="поисковый вектор", editable=False, **NULLABLE
+    )
     quantity_all = models.PositiveIntegerField(
         verbose_name="всего в библиотеке", default=0
     )
@@ -64,6 +69,10 @@ class Books(models.Model):
     amount_lending = models.PositiveIntegerField(
         verbose_name="количество выдачи", default=0
     )
+    # время последнего изменения счетчиков, по нему сверка счетчиков отбирает книги (library.reconcile)
+    counters_changed_at = models.DateTimeField(
+        verbose_name="изменение счетчиков", editable=False, **NULLABLE
+    )
     image = models.ImageField(
         upload_to="books/media",
         verbose_name="обложка",
@@ -113,7 +122,11 @@ class Lending(models.Model):
     arrival_quantity = models.IntegerField(
         verbose_name="Количество поступивших книг.", default=0
     )
-    issued_quantity = models.IntegerField(verbose_name="выдано читателям",default=0)
+    issued_quantity = models.IntegerField(verbose_name="выдано читателям", default=0)
+    # закрытые давние операции переносятся в архивные секции журнала (library.partitions)
+    archived = models.BooleanField(
+        verbose_name="в архиве", default=False, editable=False
+    )
 
     def __str__(self):
         return f"{self.user} : {self.book} - {self.operation}"
@@ -121,3 +134,142 @@ class Lending(models.Model):
     class Meta:
         verbose_name = "выдача"
         verbose_name_plural = "выдачи"
+        indexes = [
+            # частичный индекс открытых выдач (книга на руках у читателя): проверки выдачи, возврата и утери
+            # выполняются одним поиском по индексу, размер которого не зависит от истории журнала
+            models.Index(
+                fields=["user", "book"],
+                condition=models.Q(operation="issuance", id_return=0),
+                name="lending_open_loan_idx",
+            ),
+            # постраничный вывод журнала операций по курсору (date_event, id)
+            models.Index(fields=["date_event", "id"], name="lending_date_event_id_idx"),
+            # отбор невозвращенных книг по дате выдачи для напоминаний о возврате
+            models.Index(
+                fields=["date_event"],
+                condition=models.Q(operation="issuance", id_return=0),
+                name="lending_open_loan_date_idx",
+            ),
+            # поиск выдачи по id ее возврата или утери при отмене этих операций
+            models.Index(
+                fields=["id_return"],
+                condition=models.Q(id_return__gt=0),
+                name="lending_id_return_idx",
+            ),
+        ]
+
+
+class ReminderLog(models.Model):
+    """Журнал отправленных напоминаний о возврате книги. Напоминание каждого вида по выдаче отправляется
+    не чаще одного раза в день, поэтому повторные запуски задачи в течение дня не отправляют их снова.
+    """
+
+    REMINDER = [
+        ("soon", "скоро срок возврата"),
+        ("today", "срок возврата сегодня"),
+        ("overdue", "срок возврата прошел"),
+    ]
+
+    # в PostgreSQL журнал операций секционирован, а внешний ключ может ссылаться только на уникальный ключ
+    # всей секционированной таблицы (id, archived, date_event), поэтому ограничение в БД не создается
+    lending = models.ForeignKey(
+        Lending,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        verbose_name="выдача",
+        related_name="reminder_log",
+    )
+    reminder = models.CharField(
+        max_length=10, choices=REMINDER, verbose_name="вид напоминания"
+    )
+    date = models.DateField(verbose_name="дата напоминания")
+
+    def __str__(self):
+        return f"{self.lending_id} : {self.reminder} - {self.date}"
+
+    class Meta:
+        verbose_name = "напоминание"
+        verbose_name_plural = "напоминания"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lending", "reminder", "date"], name="reminder_log_unique"
+            ),
+        ]
+
+
+class BookDailyStat(models.Model):
+    """Сводка операций по книге за день. Поддерживается при проведении и отмене операций и позволяет строить
+    отчеты по книгам, жанрам, авторам и месяцам без чтения журнала операций (Lending)."""
+
+    date_event = models.DateField(verbose_name="дата")
+    book = models.ForeignKey(
+        Books,
+        on_delete=models.CASCADE,
+        verbose_name="книга",
+        related_name="daily_stat",
+    )
+    operation = models.CharField(
+        max_length=20, choices=Lending.OPERATION, verbose_name="операция"
+    )
+    operations = models.IntegerField(verbose_name="количество операций", default=0)
+    books = models.IntegerField(verbose_name="количество книг", default=0)
+
+    def __str__(self):
+        return f"{self.date_event} : {self.book_id} - {self.operation}"
+
+    class Meta:
+        verbose_name = "сводка по книге"
+        verbose_name_plural = "сводки по книгам"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date_event", "book", "operation"],
+                name="book_daily_stat_unique",
+            ),
+        ]
+
+
+class ReaderDailyStat(models.Model):
+    """Сводка операций по читателю за день для отчетов по читателям."""
+
+    date_event = models.DateField(verbose_name="дата")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="читатель",
+        related_name="daily_stat",
+    )
+    operation = models.CharField(
+        max_length=20, choices=Lending.OPERATION, verbose_name="операция"
+    )
+    operations = models.IntegerField(verbose_name="количество операций", default=0)
+    books = models.IntegerField(verbose_name="количество книг", default=0)
+
+    def __str__(self):
+        return f"{self.date_event} : {self.user_id} - {self.operation}"
+
+    class Meta:
+        verbose_name = "сводка по читателю"
+        verbose_name_plural = "сводки по читателям"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date_event", "user", "operation"],
+                name="reader_daily_stat_unique",
+            ),
+        ]
+
+
+class CounterReconciliation(models.Model):
+    """Запуск сверки счетчиков книг с журналом операций. Время начала последней завершенной сверки служит
+    отметкой, с которой следующая (инкрементальная) сверка отбирает книги с изменившимися счетчиками."""
+
+    started_at = models.DateTimeField(verbose_name="начало")
+    finished_at = models.DateTimeField(verbose_name="окончание", **NULLABLE)
+    full = models.BooleanField(verbose_name="полная сверка", default=False)
+    books_repaired = models.IntegerField(verbose_name="исправлено книг", default=0)
+
+    def __str__(self):
+        return f"{self.started_at} : {self.books_repaired}"
+
+    class Meta:
+        verbose_name = "сверка счетчиков"
+        verbose_name_plural = "сверки счетчиков"
@@ -1,4 +1,12 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+from datetime import date
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class AuthorsPaginator(PageNumberPagination):
@@ -7,13 +15,122 @@ class AuthorsPaginator(PageNumberPagination):
     max_page_size = 10
 
 
-class BooksPaginator(PageNumberPagination):
+class AsyncPageNumberMixin:
+    """Выборка страницы асинхронным ORM для асинхронных представлений (library.async_views).
+    Количество строк запрашивается заранее, поэтому Paginator не выполняет COUNT(*) синхронно.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        self.page.object_list = [row async for row in self.page.object_list]
+        self.request = request
+        return list(self.page)
+
+
+class BooksPaginator(AsyncPageNumberMixin, PageNumberPagination):
     page_size = 5
     page_query_param = "page_size"
     max_page_size = 10
 
 
-class LendingPaginator(PageNumberPagination):
+class LendingCursorPaginator(BasePagination):
+    """Постраничный вывод журнала операций по ключу (date_event, id), от новых операций к старым.
+    Следующая страница выбирается условием (date_event, id) < (дата, id последней операции страницы) по индексу
+    lending_date_event_id_idx, без COUNT(*) и OFFSET, поэтому время выборки страницы не зависит от ее номера.
+    """
+
     page_size = 5
-    page_query_param = "page_size"
-    max_page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+    ordering = ("-date_event", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.page_rows(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.page_rows([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        """Запрос строк страницы и еще одной строки, по которой определяется наличие следующей страницы."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            date_event, pk = position
+            # условие date_event <= даты курсора - граница поиска по индексу, без него PostgreSQL читает индекс
+            # от самой новой операции и отбрасывает все строки до курсора
+            queryset = queryset.filter(date_event__lte=date_event).filter(
+                Q(date_event__lt=date_event) | Q(date_event=date_event, id__lt=pk)
+            )
+        return queryset[: self.page_size + 1]
+
+    def page_rows(self, page):
+        self.has_next = len(page) > self.page_size
+        page = page[: self.page_size]
+        self.last_position = self.position(page[-1]) if page else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    @staticmethod
+    def position(row):
+        if isinstance(row, dict):
+            return row["date_event"], row["id"]
+        return row.date_event, row.pk
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            date_event, pk = (
+                base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+            )
+            return date.fromisoformat(date_event), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound("Неверный курсор.")
+
+    def encode_cursor(self, position):
+        date_event, pk = position
+        return base64.urlsafe_b64encode(
+            f"{date_event.isoformat()}:{pk}".encode()
+        ).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.last_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,200 @@
+# Секционирование и архивирование журнала операций (Lending).
+# В PostgreSQL журнал - секционированная таблица (миграция 0010_lending_partitions): library_lending разбит
+# по пометке archived на library_lending_live и library_lending_archive, а каждая из них - по годам date_event
+# (library_lending_live_y2026, library_lending_archive_y2019). Строки с датами, для которых еще нет секции,
+# попадают в library_lending_live_default.
+# Закрытые операции старше LENDING_ARCHIVE_YEARS лет переносятся в архивные секции: выдачи вместе с их возвратом
+# или утерей, а также поступления, инвентаризации и списания. Открытые выдачи (книга на руках) в архив не переносятся,
+# поэтому поиск открытых выдач с условием archived=False (library.services) не читает архивные секции, а отчеты
+# и выгрузки за период читают только секции лет этого периода. Опустевшие секции прошлых лет удаляются.
+# В других БД (например, SQLite в локальной разработке) секций нет и архивирование только ставит пометку archived.
+
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Exists, Min, OuterRef, Q
+
+from config import settings
+from library.models import Lending
+
+LIVE_TABLE = "library_lending_live"
+ARCHIVE_TABLE = "library_lending_archive"
+
+
+def partition_name(table, year):
+    return f"{table}_y{year}"
+
+
+def archive_cutoff(today, years):
+    """Дата, раньше которой закрытые операции переносятся в архив: начало года years лет назад."""
+    return date(today.year - years, 1, 1)
+
+
+def year_partitions(table):
+    """Секции по годам таблицы table (live или archive): {год: имя секции}."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+    prefix = f"{table}_y"
+    return {int(name[len(prefix) :]): name for name in names if name.startswith(prefix)}
+
+
+def create_partition(table, year):
+    """Функция создает секцию года year. Строки этого года, уже попавшие в секцию по умолчанию, переносятся
+    в новую секцию (PostgreSQL не создает секцию, пока такие строки есть в секции по умолчанию).
+    Архивные секции заполняются один раз и почти не изменяются, поэтому строки в них хранятся плотно
+    (fillfactor 100) и при LENDING_ARCHIVE_TABLESPACE - в отдельном табличном пространстве
+    (например, на дешевом или сжимающем данные хранилище)."""
+    name = partition_name(table, year)
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    options = ""
+    if table == ARCHIVE_TABLE:
+        options = " WITH (fillfactor = 100)"
+        if settings.LENDING_ARCHIVE_TABLESPACE:
+            tablespace = connection.ops.quote_name(settings.LENDING_ARCHIVE_TABLESPACE)
+            options += f" TABLESPACE {tablespace}"
+    default = f"{LIVE_TABLE}_default"
+    with transaction.atomic(), connection.cursor() as cursor:
+        moved = False
+        if table == LIVE_TABLE:
+            cursor.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {default} "
+                f"WHERE date_event >= %s AND date_event < %s)",
+                [start, end],
+            )
+            moved = cursor.fetchone()[0]
+        if moved:
+            cursor.execute(f"ALTER TABLE {LIVE_TABLE} DETACH PARTITION {default}")
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}'){options}"
+        )
+        if moved:
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {default} "
+                f"WHERE date_event >= %s AND date_event < %s RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                [start, end],
+            )
+            cursor.execute(
+                f"ALTER TABLE {LIVE_TABLE} ATTACH PARTITION {default} DEFAULT"
+            )
+    return name
+
+
+def default_years():
+    """Годы строк, попавших в секцию по умолчанию (для них еще не было секции)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT extract(year FROM date_event)::int FROM {LIVE_TABLE}_default"
+        )
+        return {year for (year,) in cursor.fetchall()}
+
+
+def ensure_partitions(table, years):
+    """Функция создает недостающие секции лет years. Возвращает имена созданных секций."""
+    existing = year_partitions(table)
+    return [
+        create_partition(table, year) for year in sorted(set(years) - set(existing))
+    ]
+
+
+def archivable(start, end, cutoff):
+    """Операции журнала за [start, end), которые можно перенести в архив: все, кроме открытых выдач
+    и выдач, возврат или утеря которых проведены не раньше cutoff (пара переносится целиком).
+    """
+    returned_late = Exists(
+        Lending.objects.filter(
+            archived=False, pk=OuterRef("id_return"), date_event__gte=cutoff
+        )
+    )
+    return Lending.objects.filter(
+        archived=False, date_event__gte=start, date_event__lt=end
+    ).exclude(Q(operation="issuance") & (Q(id_return=0) | returned_late))
+
+
+def month_ranges(start, end):
+    """Интервалы [начало месяца, начало следующего месяца) от месяца start до end."""
+    month = date(start.year, start.month, 1)
+    while month < end:
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        yield month, min(following, end)
+        month = following
+
+
+def archive_closed_lendings(cutoff):
+    """Функция переносит в архив закрытые операции раньше cutoff. Перенос идет помесячно, каждый месяц
+    в своей транзакции: UPDATE пометки archived перемещает строки в архивную секцию их года.
+    Возвращает количество перенесенных операций."""
+    first = Lending.objects.filter(archived=False, date_event__lt=cutoff).aggregate(
+        first=Min("date_event")
+    )["first"]
+    if first is None:
+        return 0
+    if connection.vendor == "postgresql":
+        ensure_partitions(ARCHIVE_TABLE, range(first.year, cutoff.year))
+    archived = 0
+    for start, end in month_ranges(first, cutoff):
+        with transaction.atomic():
+            archived += archivable(start, end, cutoff).update(archived=True)
+    return archived
+
+
+def drop_empty_partitions(cutoff):
+    """Функция удаляет опустевшие после архивирования секции лет раньше cutoff.
+    Секции с открытыми выдачами остаются. Возвращает имена удаленных секций."""
+    dropped = []
+    for year, name in sorted(year_partitions(LIVE_TABLE).items()):
+        if year >= cutoff.year:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"ALTER TABLE {LIVE_TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
+
+
+def maintain_partitions(today=None, years=None, ahead=None, vacuum=True):
+    """Обслуживание журнала операций (команда lending_partitions, ежемесячная задача Celery):
+    секции текущего и ahead следующих лет и лет строк из секции по умолчанию, перенос в архив закрытых операций старше years лет,
+    удаление опустевших секций и сбор статистики (VACUUM ANALYZE, только вне транзакции).
+    Возвращает словарь с созданными и удаленными секциями и количеством перенесенных операций.
+    """
+    today = today or date.today()
+    years = settings.LENDING_ARCHIVE_YEARS if years is None else years
+    ahead = settings.LENDING_PARTITIONS_AHEAD if ahead is None else ahead
+    cutoff = archive_cutoff(today, years)
+    postgresql = connection.vendor == "postgresql"
+    result = {"created": [], "archived": 0, "dropped": []}
+    if postgresql:
+        # строки давних лет остаются в секции по умолчанию до переноса в архив
+        years_ahead = range(today.year, today.year + ahead + 1)
+        years_default = {year for year in default_years() if year >= cutoff.year}
+        result["created"] = ensure_partitions(
+            LIVE_TABLE, set(years_ahead) | years_default
+        )
+    result["archived"] = archive_closed_lendings(cutoff)
+    if postgresql:
+        result["dropped"] = drop_empty_partitions(cutoff)
+        if vacuum and result["archived"]:
+            with connection.cursor() as cursor:
+                cursor.execute(f"VACUUM (ANALYZE) {LIVE_TABLE}, {ARCHIVE_TABLE}")
+    return result
+
+
+def partitions_info():
+    """Секции журнала с оценкой количества строк и размером на диске: (имя, строк, байт)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, greatest(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid) "
+            "FROM pg_partition_tree('library_lending') t JOIN pg_class c ON c.oid = t.relid "
+            "WHERE t.isleaf ORDER BY c.relname"
+        )
+        return cursor.fetchall()
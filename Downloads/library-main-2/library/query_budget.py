@@ -0,0 +1,34 @@
+# Проверка бюджета запросов к БД для тестов API.
+# Число запросов эндпоинта списка или просмотра не должно расти вместе с количеством строк в ответе,
+# иначе в представлении или сериализаторе появилась ленивая загрузка связей (N+1).
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Примесь к APITestCase. assertQueryBudget выполняет GET-запрос дважды: на исходных данных и после grow(),
+    который добавляет строки в ответ. Оба раза число запросов к БД должно быть одинаковым и не больше budget.
+    """
+
+    def captured_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [query["sql"] for query in context.captured_queries]
+
+    def assertQueryBudget(self, budget, url, grow, params=None):
+        before = self.captured_queries(url, params)
+        grow()
+        after = self.captured_queries(url, params)
+        queries = "\n".join(after)
+        self.assertLessEqual(
+            len(after),
+            budget,
+            f"{url}: {len(after)} запросов к БД при бюджете {budget}:\n{queries}",
+        )
+        self.assertEqual(
+            len(before),
+            len(after),
+            f"{url}: число запросов к БД растет вместе с количеством строк (N+1):\n{queries}",
+        )
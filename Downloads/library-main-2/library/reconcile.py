@@ -0,0 +1,120 @@
+# Сверка счетчиков книг (quantity_all, quantity_lending, amount_lending) с журналом операций (Lending).
+# Счетчики пересчитываются одним сгруппированным по книгам запросом к журналу, который в той же выборке читает
+# сохраненные счетчики, поэтому расхождения считаются по одному снимку данных. Исправления применяются
+# изменениями (delta) сгруппированным UPDATE, что не теряет операций, проведенных во время сверки.
+# Инкрементальная сверка проверяет только книги, счетчики которых менялись после предыдущей сверки.
+
+from datetime import timedelta
+
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from library.models import Books, CounterReconciliation, Lending
+from library.services import update_books_counters
+
+# вклад операций журнала в счетчики книги (как при проведении операции)
+COUNTER_DELTAS = {
+    "quantity_all": {
+        "inventory": F("arrival_quantity"),
+        "arrival": F("arrival_quantity"),
+        "write_off": Value(-1),
+        "loss": Value(-1),
+    },
+    "quantity_lending": {
+        "inventory": F("issued_quantity"),
+        "issuance": Value(1),
+        "return": Value(-1),
+    },
+    "amount_lending": {
+        "issuance": Value(1),
+        "loss": Value(-1),
+    },
+}
+CHUNK_SIZE = 5000
+REPAIR_BATCH_SIZE = 1000
+# запас к отметке предыдущей сверки на транзакции, начатые до нее, но завершенные позже
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+
+def journal_counters():
+    """Выражения счетчиков книги по журналу операций."""
+    return {
+        f"journal_{counter}": Coalesce(
+            Sum(
+                Case(
+                    *[
+                        When(operation=operation, then=delta)
+                        for operation, delta in deltas.items()
+                    ],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            ),
+            0,
+        )
+        for counter, deltas in COUNTER_DELTAS.items()
+    }
+
+
+def counters_drift(since=None):
+    """Функция возвращает расхождения счетчиков с журналом {pk книги: {счетчик: исправление}}.
+    При заданном since проверяются только книги, счетчики которых изменялись начиная с этого времени.
+    """
+    books = Books.objects.all()
+    journal = Lending.objects.all()
+    if since is not None:
+        books = books.filter(counters_changed_at__gte=since)
+        journal = journal.filter(book__in=books)
+    rows = (
+        journal.values("book_id", *[f"book__{counter}" for counter in COUNTER_DELTAS])
+        .annotate(**journal_counters())
+        .order_by()
+    )
+    drift = {}
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        deltas = {
+            counter: row[f"journal_{counter}"] - row[f"book__{counter}"]
+            for counter in COUNTER_DELTAS
+            if row[f"journal_{counter}"] != row[f"book__{counter}"]
+        }
+        if deltas:
+            drift[row["book_id"]] = deltas
+    # у книг без операций в журнале все счетчики нулевые
+    empty = (
+        books.filter(~Exists(Lending.objects.filter(book=OuterRef("pk"))))
+        .exclude(quantity_all=0, quantity_lending=0, amount_lending=0)
+        .values("pk", *COUNTER_DELTAS)
+    )
+    for book in empty.iterator(chunk_size=CHUNK_SIZE):
+        drift[book["pk"]] = {
+            counter: -book[counter] for counter in COUNTER_DELTAS if book[counter]
+        }
+    return drift
+
+
+def reconcile_counters(full=False, repair=True):
+    """Функция сверяет счетчики книг с журналом и исправляет расхождения (repair=True).
+    Без full сверяются только книги, счетчики которых менялись после предыдущей завершенной сверки.
+    """
+    last = (
+        CounterReconciliation.objects.filter(finished_at__isnull=False)
+        .order_by("-started_at")
+        .first()
+    )
+    since = None if full or last is None else last.started_at - WATERMARK_OVERLAP
+    run = CounterReconciliation.objects.create(started_at=Now(), full=since is None)
+    drift = counters_drift(since)
+    if repair:
+        books_deltas = list(drift.items())
+        for start in range(0, len(books_deltas), REPAIR_BATCH_SIZE):
+            update_books_counters(dict(books_deltas[start : start + REPAIR_BATCH_SIZE]))
+        # отметка сверки - время ее начала по часам БД, как и время изменения счетчиков
+        run.refresh_from_db(fields=["started_at"])
+        run.finished_at = timezone.now()
+        run.books_repaired = len(drift)
+        run.save(update_fields=["finished_at", "books_repaired"])
+    else:
+        run.delete()  # проверка без исправления не сдвигает отметку
+    return drift
@@ -0,0 +1,58 @@
+# Поиск по каталогу книг (название, автор, аннотация).
+# В PostgreSQL используется полнотекстовый поиск по столбцу search_vector (индекс GIN), который заполняет триггер
+# БД (миграция 0008_books_search_vector), и поиск по триграммам названия и автора (индексы GIN gin_trgm_ops),
+# находящий книги и при опечатках в запросе. Результаты упорядочиваются по релевантности.
+# В других БД (например, SQLite в локальной разработке) поиск выполняется по вхождению подстроки.
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramWordSimilarity)
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework.filters import SearchFilter
+
+from library.models import Authors
+
+# конфигурация полнотекстового поиска, совпадает с триггером в миграции
+SEARCH_CONFIG = "russian"
+SIMILAR_AUTHORS_LIMIT = 100
+
+
+def catalogue_search(queryset, term):
+    """Функция отбирает книги по поисковой строке и упорядочивает их по релевантности."""
+    if connection.vendor != "postgresql":
+        return queryset.filter(
+            Q(name__icontains=term)
+            | Q(author__author__icontains=term)
+            | Q(annotation__icontains=term)
+        )
+    query = SearchQuery(term, config=SEARCH_CONFIG, search_type="websearch")
+    # авторы с похожим именем отбираются отдельным запросом по небольшой таблице авторов, чтобы все условия
+    # отбора книг выполнялись по индексам library_books (GIN поиска и триграмм, индекс author_id)
+    author_ids = list(
+        Authors.objects.filter(author__trigram_word_similar=term).values_list(
+            "id", flat=True
+        )[:SIMILAR_AUTHORS_LIMIT]
+    )
+    return (
+        queryset.filter(
+            Q(search_vector=query)
+            | Q(name__trigram_word_similar=term)
+            | Q(author_id__in=author_ids)
+        )
+        .annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+            + TrigramWordSimilarity(term, "name")
+            + TrigramWordSimilarity(term, "author__author")
+        )
+        .order_by("-search_rank", "id")
+    )
+
+
+class CatalogueSearchFilter(SearchFilter):
+    """Поиск книг по параметру ?search= через catalogue_search."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return catalogue_search(queryset, " ".join(terms))
@@ -1,28 +1,50 @@
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
+from config.instrumentation import TimedSerializerMixin
 from library.models import Authors, Books, Lending
+from library.stats import READER_GROUPS, REPORT_GROUPS
 from library.validators import LibraryValidators
 from users.serializer import UserSerializerReadOnly
 
+# поле для вывода дат в формате REST_FRAMEWORK["DATE_FORMAT"] в быстром пути сериализаторов
+DATE_FIELD = serializers.DateField()
+
+
+class ValuesSerializerMixin(TimedSerializerMixin):
+    """Быстрый путь сериализаторов только для чтения. Строки выбираются одним запросом
+    queryset.values(*values_fields) с JOIN связанных таблиц, а ответ собирается из словарей в values_representation
+    без создания моделей, ленивой загрузки связей и обхода полей DRF для каждой строки.
+    Модели по-прежнему сериализуются обычным путем, форма ответа в обоих случаях одинакова.
+    """
+
+    values_fields = ()
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.values_fields)
+
+    def to_representation(self, instance):
+        if isinstance(instance, dict):
+            return self.values_representation(instance)
+        return super().to_representation(instance)
+
 
 class AuthorsSerializerReadOnly(ModelSerializer):
 
     class Meta:
         model = Authors
-        fields = (
-            "author",
-        )
+        fields = ("author",)
 
 
-class AuthorsSerializer(ModelSerializer):
+class AuthorsSerializer(TimedSerializerMixin, ModelSerializer):
 
     class Meta:
         model = Authors
         fields = "__all__"
 
 
-class BooksSerializerReadOnly(serializers.ModelSerializer):
+class BooksSerializerReadOnly(ValuesSerializerMixin, serializers.ModelSerializer):
     author = AuthorsSerializerReadOnly(read_only=True)
 
     class Meta:
@@ -37,8 +59,30 @@ class BooksSerializerReadOnly(serializers.ModelSerializer):
             "amount_lending",
         )
 
-
-class BooksSerializer(ModelSerializer):
+    values_fields = (
+        "id",
+        "author__author",
+        "name",
+        "genre",
+        "quantity_all",
+        "quantity_lending",
+        "amount_lending",
+    )
+
+    @staticmethod
+    def values_representation(row):
+        return {
+            "id": row["id"],
+            "author": {"author": row["author__author"]},
+            "name": row["name"],
+            "genre": row["genre"],
+            "quantity_all": row["quantity_all"],
+            "quantity_lending": row["quantity_lending"],
+            "amount_lending": row["amount_lending"],
+        }
+
+
+class BooksSerializer(TimedSerializerMixin, ModelSerializer):
     class Meta:
         model = Books
         fields = (
@@ -48,22 +92,95 @@ class BooksSerializer(ModelSerializer):
         )
 
 
-class LendingSerializerReadOnly(ModelSerializer):
+class LendingSerializerReadOnly(ValuesSerializerMixin, ModelSerializer):
     user = UserSerializerReadOnly(read_only=True)
 
     class Meta:
         model = Lending
-        fields = "__all__"
-
-
-class LendingSerializer(ModelSerializer):
+        exclude = ("archived",)
+
+    values_fields = (
+        "id",
+        "user__reader_name",
+        "user__phone",
+        "operation",
+        "date_event",
+        "id_return",
+        "is_return",
+        "is_loss",
+        "is_write_off",
+        "arrival_quantity",
+        "issued_quantity",
+        "book_id",
+    )
+
+    @staticmethod
+    def values_representation(row):
+        return {
+            "id": row["id"],
+            "user": {
+                "reader_name": row["user__reader_name"],
+                "phone": row["user__phone"],
+            },
+            "operation": row["operation"],
+            "date_event": DATE_FIELD.to_representation(row["date_event"]),
+            "id_return": row["id_return"],
+            "is_return": row["is_return"],
+            "is_loss": row["is_loss"],
+            "is_write_off": row["is_write_off"],
+            "arrival_quantity": row["arrival_quantity"],
+            "issued_quantity": row["issued_quantity"],
+            "book": row["book_id"],
+        }
+
+
+class LendingSerializer(TimedSerializerMixin, ModelSerializer):
 
     class Meta:
         model = Lending
-        fields = "__all__"
+        exclude = ("archived",)
         validators = [LibraryValidators()]
 
 
+class LendingBulkItemSerializer(serializers.Serializer):
+    """Одна операция пакета. Книга и читатель передаются как id и проверяются сразу для всего пакета."""
+
+    user = serializers.IntegerField()
+    book = serializers.IntegerField()
+    operation = serializers.ChoiceField(choices=Lending.OPERATION)
+    date_event = serializers.DateField(required=False)
+    arrival_quantity = serializers.IntegerField(min_value=0, default=0)
+    issued_quantity = serializers.IntegerField(min_value=0, default=0)
+
+
+class LendingBulkSerializer(serializers.Serializer):
+    """Данный сериализатор предназначен для пакетного проведения операций по библиотеке."""
+
+    operations = LendingBulkItemSerializer(many=True, allow_empty=False, max_length=500)
+
+
+class LendingReportSerializer(serializers.Serializer):
+    """Параметры отчета по операциям: группировки через запятую (book, genre, author, reader, month, date)
+    и период."""
+
+    group_by = serializers.CharField(default="book")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate_group_by(self, value):
+        group_by = [group.strip() for group in value.split(",") if group.strip()]
+        unknown = [group for group in group_by if group not in REPORT_GROUPS]
+        if not group_by or unknown:
+            raise serializers.ValidationError(
+                f"Допустимые группировки: {', '.join(REPORT_GROUPS)}."
+            )
+        if "reader" in group_by and not set(group_by) <= READER_GROUPS:
+            raise serializers.ValidationError(
+                f"Отчет по читателям группируется только по: {', '.join(sorted(READER_GROUPS))}."
+            )
+        return list(dict.fromkeys(group_by))
+
+
 class LendingSerializerWriteOff(ModelSerializer):
     """Данный сериализатор предназначен для списания утерянной книги."""
 
@@ -1,15 +1,477 @@
+import logging
+import random
+import smtplib
+import time
+from collections import defaultdict
+from datetime import timedelta
+
 import requests
+from celery.utils.time import rate
+from django.core.mail import EmailMessage, get_connection
+from django.db import OperationalError, transaction
+from django.db.models import (Case, CharField, Exists, F, IntegerField,
+                              OuterRef, Q, Value, When)
+from django.db.models.functions import Now
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from config import settings
+from library.cache import catalogue_invalidate
+from library.metrics import lending_retried
+from library.models import Books, Lending, ReminderLog
+from library.stats import stats_apply
+from users.models import Users
+
+# операции, пользователем (хозяином) которых автоматически является библиотекарь
+LIBRARIAN_OPERATIONS = ("inventory", "arrival", "write_off", "loss")
+
+# коды ошибок PostgreSQL, после которых транзакцию можно повторить: взаимная блокировка и ошибка сериализации
+RETRYABLE_SQLSTATES = ("40P01", "40001")
+# ошибки SQLite при одновременной записи: база занята другим соединением, таблица занята в общем кеше (тестовая БД)
+SQLITE_LOCKED_MESSAGES = ("database is locked", "database table is locked")
+
+logger = logging.getLogger(__name__)
+
+RETURN_PERIOD_DAYS = 10  # срок, на который выдается книга
+# за сколько дней до срока возврата отправляется первое напоминание
+REMINDER_BEFORE_DAYS = 3
+
+_telegram_session = None
+# канал уведомлений: когда процесс может отправить следующее сообщение (time.monotonic)
+_throttle_next = {}
+_email_connection = None
+_email_connection_messages = (
+    0  # сколько писем уже отправлено через текущее SMTP-соединение
+)
+
+
+def telegram_session():
+    """Функция возвращает общий для процесса HTTP-сеанс к Bot API Телеграма. Соединения в нем переиспользуются
+    (keep-alive), поэтому TCP+TLS рукопожатие выполняется один раз, а не для каждого сообщения.
+    С нарастающей задержкой повторяются только ошибки установки соединения, когда запрос еще не отправлен.
+    sendMessage не идемпотентен: после ошибки чтения ответа или ответа 5xx Телеграм мог уже принять сообщение,
+    и повтор доставил бы его читателю дважды, поэтому такие запросы не повторяются."""
+    global _telegram_session
+    if _telegram_session is None:
+        retries = Retry(
+            total=settings.TELEGRAM_MAX_RETRIES,
+            connect=settings.TELEGRAM_MAX_RETRIES,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=0.5,
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.TELEGRAM_POOL_SIZE,
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _telegram_session = session
+    return _telegram_session
 
 
 def telegram_message(chat_id, message):
-    """Функция предназначена для отправки сообщений в Телеграм."""
+    """Функция предназначена для отправки сообщений в Телеграм.
+    При превышении лимита Телеграма (429) сообщение повторяется через указанное в ответе retry_after время.
+    Возвращает True, если сообщение принято Телеграмом."""
     params = {
         "text": message,
         "chat_id": chat_id,
     }
-    requests.get(
-        f"{settings.TELEGRAM_URL}{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
-        params=params,
+    url = f"{settings.TELEGRAM_URL}{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+    for _ in range(settings.TELEGRAM_MAX_RETRIES + 1):
+        try:
+            response = telegram_session().post(
+                url, json=params, timeout=settings.TELEGRAM_TIMEOUT
+            )
+        except requests.RequestException:
+            return False
+        if response.status_code != 429:
+            return response.ok
+        try:
+            retry_after = response.json()["parameters"]["retry_after"]
+        except (ValueError, KeyError, TypeError):
+            retry_after = int(response.headers.get("Retry-After", 1))
+        time.sleep(min(retry_after, settings.TELEGRAM_MAX_RETRY_AFTER))
+    return False
+
+
+def throttle(channel, limit):
+    """Функция выдерживает паузу перед отправкой сообщения, чтобы процесс отправлял по каналу не больше limit
+    сообщений (формат Celery rate_limit: "10/s", "600/m", "0" - без ограничения). Ограничение действует на каждое
+    сообщение, а не на порцию уведомлений, и отдельно в каждом процессе воркера."""
+    per_second = rate(limit)
+    if not per_second:  # "0" или пустое значение
+        return
+    now = time.monotonic()
+    send_at = max(_throttle_next.get(channel, now), now)
+    if send_at > now:
+        time.sleep(send_at - now)
+    _throttle_next[channel] = send_at + 1 / per_second
+
+
+def telegram_send_many(messages):
+    """Функция отправляет пачку сообщений (chat_id, текст) через одно переиспользуемое соединение
+    не быстрее NOTIFICATIONS_TELEGRAM_RATE_LIMIT. Возвращает количество доставленных сообщений.
+    """
+    sent = 0
+    for chat_id, message in messages:
+        throttle("telegram", settings.NOTIFICATIONS_TELEGRAM_RATE_LIMIT)
+        sent += telegram_message(chat_id, message)
+    return sent
+
+
+def email_connection():
+    """Функция возвращает открытое SMTP-соединение процесса. Соединение переиспользуется между порциями писем
+    и заменяется новым, когда через него отправлено EMAIL_MAX_MESSAGES_PER_CONNECTION писем (ограничение
+    почтовых провайдеров)."""
+    global _email_connection, _email_connection_messages
+    if (
+        _email_connection is not None
+        and _email_connection_messages >= settings.EMAIL_MAX_MESSAGES_PER_CONNECTION
+    ):
+        email_connection_close()
+    if _email_connection is None:
+        _email_connection = get_connection()
+        _email_connection.open()
+        _email_connection_messages = 0
+    return _email_connection
+
+
+def email_connection_close():
+    """Функция закрывает SMTP-соединение процесса, следующая отправка откроет новое."""
+    global _email_connection
+    if _email_connection is not None:
+        try:
+            _email_connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _email_connection = None
+
+
+def email_send_many(messages, subject):
+    """Функция отправляет пачку писем (адрес, текст) через одно SMTP-соединение, а не открывает соединение
+    на каждое письмо, как send_mail. Письма передаются в открытое соединение по одному, поэтому после ошибки
+    соединения (сервер недоступен или разорвал соединение) известно, какие письма уже отправлены: повторяется
+    через новое соединение только неотправленный остаток, и уже отправленные письма не дублируются. Если и повтор
+    не удался, остаток порции не отправляется. Отказ сервера принять конкретное письмо (адрес получателя
+    отклонен, ответ 5xx) соединение не разрывает: письмо считается неотправленным, и отправка продолжается
+    со следующего. Письма отправляются не быстрее NOTIFICATIONS_EMAIL_RATE_LIMIT.
+    Возвращает количество отправленных писем."""
+    global _email_connection_messages
+    sent = 0
+    position = 0
+    failures = 0
+    while position < len(messages) and failures < 2:
+        to_email, message = messages[position]
+        throttle("email", settings.NOTIFICATIONS_EMAIL_RATE_LIMIT)
+        try:
+            connection = email_connection()
+            email = EmailMessage(
+                subject=subject,
+                body=message,
+                from_email=settings.EMAIL_HOST_USER,
+                to=[to_email],
+                connection=connection,
+            )
+            sent += connection.send_messages([email]) or 0
+        # SMTPException наследует OSError, поэтому ошибки соединения перехватываются раньше отказов в письме
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+            email_connection_close()
+            failures += 1
+            continue
+        except smtplib.SMTPException:
+            logger.warning("SMTP-сервер отклонил письмо на %s", to_email, exc_info=True)
+        except OSError:
+            email_connection_close()
+            failures += 1
+            continue
+        failures = 0
+        _email_connection_messages += 1
+        position += 1
+    return sent
+
+
+def lending_atomic(func, *args, **kwargs):
+    """Функция выполняет операцию по библиотеке func(*args, **kwargs) в одной короткой транзакции.
+    Операции блокируют строки в одном порядке - сначала книги (по возрастанию pk), затем строки журнала,
+    поэтому друг с другом они взаимно не блокируются. Если транзакцию все же прервала взаимная блокировка
+    или ошибка сериализации, она повторяется до LENDING_MAX_RETRIES раз со случайной нарастающей задержкой
+    (каждый повтор учитывается в метриках). Внутри внешней транзакции повтор невозможен, ошибка передается дальше.
+    """
+    retry = not transaction.get_connection().in_atomic_block
+    attempt = 0
+    while True:
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as error:
+            if not (
+                retry and attempt < settings.LENDING_MAX_RETRIES and retryable(error)
+            ):
+                raise
+            logger.warning("Повтор операции по библиотеке после ошибки: %s", error)
+        lending_retried()
+        time.sleep(random.uniform(0, settings.LENDING_RETRY_DELAY * 2**attempt))
+        attempt += 1
+
+
+def retryable(error):
+    """Ошибку можно повторить: взаимная блокировка или ошибка сериализации PostgreSQL, а в SQLite - занятая
+    другой транзакцией база или таблица (аналог при одновременной записи; таблица блокируется в общей
+    памяти, например в тестовой БД)."""
+    cause = error.__cause__
+    sqlstate = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    return sqlstate in RETRYABLE_SQLSTATES or any(
+        message in str(error) for message in SQLITE_LOCKED_MESSAGES
     )
+
+
+def lock_book(book_pk):
+    """Функция блокирует строку книги до конца транзакции (SELECT ... FOR UPDATE). Вызывается первой в операциях
+    с одной книгой, до блокировки строк журнала."""
+    list(
+        Books.objects.select_for_update()
+        .filter(pk=book_pk)
+        .values_list("pk", flat=True)
+    )
+
+
+def open_issuances(user_pk, book_pk):
+    """Функция возвращает открытые выдачи книги читателю (книга на руках). Запрос совпадает с условием
+    частичного индекса lending_open_loan_idx и выполняется одним поиском по индексу. Открытые выдачи не переносятся
+    в архив, поэтому условие archived=False исключает архивные секции журнала из поиска (library.partitions).
+    """
+    return Lending.objects.filter(
+        user_id=user_pk,
+        book_id=book_pk,
+        operation="issuance",
+        id_return=0,
+        archived=False,
+    )
+
+
+def update_book_counters(book_pk, condition=None, **deltas):
+    """Функция атомарно изменяет счетчики книги (quantity_all, quantity_lending, amount_lending) одним запросом
+    UPDATE ... SET поле = поле + delta [WHERE condition] без чтения строки в Python.
+    Возвращает True, если строка книги изменена, и False, если условие condition не выполнено.
+    """
+    queryset = Books.objects.filter(pk=book_pk)
+    if condition is not None:
+        queryset = queryset.filter(condition)
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not changes:
+        return queryset.exists()
+    changes["counters_changed_at"] = Now()
+    updated = queryset.update(**changes) == 1
+    if updated:
+        catalogue_invalidate("books")  # счетчики книги показываются в каталоге
+    return updated
+
+
+def update_books_counters(books_deltas):
+    """Функция применяет изменения счетчиков сразу для нескольких книг одним сгруппированным UPDATE.
+    books_deltas - словарь {pk книги: {поле: изменение}}."""
+    fields = {
+        field
+        for deltas in books_deltas.values()
+        for field, delta in deltas.items()
+        if delta
+    }
+    if not fields:
+        return 0
+    changes = {
+        field: F(field)
+        + Case(
+            *[
+                When(pk=book_pk, then=Value(deltas[field]))
+                for book_pk, deltas in books_deltas.items()
+                if deltas.get(field)
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        for field in fields
+    }
+    changes["counters_changed_at"] = Now()
+    updated = Books.objects.filter(pk__in=books_deltas).update(**changes)
+    catalogue_invalidate("books")  # счетчики книг показываются в каталоге
+    return updated
+
+
+def lending_bulk_create(operations, librarian):
+    """Функция проводит пакет операций по библиотеке (например, тележку книг, отсканированную на выдаче) в одной
+    транзакции и за постоянное число запросов: книги, читатели и открытые выдачи проверяются по одному запросу
+    на таблицу, операции записываются одним bulk_create, пометки о возврате/утере - одним bulk_update,
+    а счетчики книг - одним сгруппированным UPDATE.
+    Возвращает список результатов по каждой операции в порядке их следования."""
+    book_ids = {item["book"] for item in operations}
+    user_ids = {item["user"] for item in operations}
+    results = [None] * len(operations)
+    # при вызове из lending_atomic пакет проводится в ее транзакции без отдельной точки сохранения
+    with transaction.atomic(savepoint=False):
+        # книги блокируются в порядке pk, чтобы параллельные пакеты не блокировали друг друга крест-накрест
+        books = {
+            book.pk: book
+            for book in Books.objects.select_for_update()
+            .filter(pk__in=book_ids)
+            .order_by("pk")
+        }
+        users = set(Users.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+        open_loans = {
+            (user_pk, book_pk): lending_pk
+            for lending_pk, user_pk, book_pk in Lending.objects.filter(
+                operation="issuance",
+                id_return=0,
+                archived=False,
+                user_id__in=user_ids,
+                book_id__in=book_ids,
+            ).values_list("pk", "user_id", "book_id")
+        }  # открытые выдачи (читатель, книга) -> id выдачи или еще не сохраненная выдача из пакета
+        available = {
+            pk: book.quantity_all - book.quantity_lending for pk, book in books.items()
+        }
+        quantity_all = {pk: book.quantity_all for pk, book in books.items()}
+        books_deltas = defaultdict(lambda: defaultdict(int))
+        lendings = []  # (номер операции в пакете, новая операция)
+        marks = []  # (выдача, операция возврата/утери, поле пометки)
+
+        for index, item in enumerate(operations):
+            operation = item["operation"]
+            book = books.get(item["book"])
+            if book is None:
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "errors": ["Такой книги нет в библиотеке !"],
+                }
+                continue
+            if item["user"] not in users:
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "errors": ["Такой читатель не зарегистрирован в библиотеке !"],
+                }
+                continue
+            loan_key = (item["user"], book.pk)
+            error = None
+            deltas = {}
+            if operation in ("issuance", "write_off"):
+                if operation == "issuance" and loan_key in open_loans:
+                    error = "Вы уже получили эту книгу в библиотеке !"
+                elif quantity_all[book.pk] == 0:
+                    error = f"Книги '{book.name}' еще не поступили в библиотеку !"
+                elif available[book.pk] <= 0:
+                    error = f"Все книги '{book.name}' выданы читателям !"
+            elif operation == "return" and loan_key not in open_loans:
+                error = f"Книга '{book.name}' уже возвращена !"
+            elif operation == "loss" and loan_key not in open_loans:
+                error = f"Книга '{book.name}' возвращена !"
+            if error:
+                results[index] = {"index": index, "status": "error", "errors": [error]}
+                continue
+
+            lending = Lending(
+                user_id=(
+                    librarian.pk if operation in LIBRARIAN_OPERATIONS else item["user"]
+                ),
+                book_id=book.pk,
+                operation=operation,
+                arrival_quantity=item.get("arrival_quantity", 0),
+                issued_quantity=item.get("issued_quantity", 0),
+            )
+            if "date_event" in item:
+                lending.date_event = item["date_event"]
+            if operation == "inventory":
+                deltas = {
+                    "quantity_all": lending.arrival_quantity,
+                    "quantity_lending": lending.issued_quantity,
+                }
+            elif operation == "arrival":
+                deltas = {"quantity_all": lending.arrival_quantity}
+            elif operation == "issuance":
+                deltas = {"quantity_lending": 1, "amount_lending": 1}
+                open_loans[loan_key] = lending
+            elif operation == "return":
+                deltas = {"quantity_lending": -1}
+                marks.append((open_loans.pop(loan_key), lending, "is_return"))
+            elif operation == "write_off":
+                deltas = {"quantity_all": -1}
+            elif operation == "loss":
+                deltas = {"quantity_all": -1, "amount_lending": -1}
+                marks.append((open_loans.pop(loan_key), lending, "is_loss"))
+            # состояние книги внутри пакета, чтобы следующие операции проверялись с учетом предыдущих
+            quantity_all[book.pk] += deltas.get("quantity_all", 0)
+            available[book.pk] += deltas.get("quantity_all", 0) - deltas.get(
+                "quantity_lending", 0
+            )
+            for field, delta in deltas.items():
+                books_deltas[book.pk][field] += delta
+            lendings.append((index, lending))
+
+        Lending.objects.bulk_create([lending for _, lending in lendings])
+        stats_apply([lending for _, lending in lendings])
+        issuances = []
+        for issuance, lending, flag in marks:
+            if not isinstance(issuance, Lending):
+                issuance = Lending(pk=issuance)  # выдача, сохраненная до пакета
+            issuance.id_return = lending.pk
+            setattr(issuance, flag, True)
+            issuances.append(issuance)
+        if issuances:
+            Lending.objects.bulk_update(
+                issuances, ["id_return", "is_return", "is_loss"]
+            )
+        update_books_counters(books_deltas)
+
+    for index, lending in lendings:
+        results[index] = {"index": index, "status": "created", "id": lending.pk}
+    return results
+
+
+def return_reminders(today):
+    """Функция возвращает невозвращенные книги, по которым сегодня нужно напомнить читателю, с видом напоминания
+    в поле reminder: overdue - срок возврата прошел, today - срок возврата сегодня, soon - срок возврата через
+    REMINDER_BEFORE_DAYS дня. Отбор и разбиение по видам выполняются в БД одним запросом вместе с книгой и читателем.
+    Выдачи, по которым напоминание этого вида сегодня уже отправлено (есть запись в ReminderLog), исключаются.
+    """
+    deadline = today - timedelta(
+        days=RETURN_PERIOD_DAYS
+    )  # дата выдачи, для которой срок возврата сегодня
+    soon = deadline + timedelta(days=REMINDER_BEFORE_DAYS)
+    return (
+        Lending.objects.filter(operation="issuance", id_return=0, archived=False)
+        .filter(Q(date_event__lte=deadline) | Q(date_event=soon))
+        .annotate(
+            reminder=Case(
+                When(date_event__lt=deadline, then=Value("overdue")),
+                When(date_event=deadline, then=Value("today")),
+                default=Value("soon"),
+                output_field=CharField(),
+            )
+        )
+        .exclude(
+            Exists(
+                ReminderLog.objects.filter(
+                    lending=OuterRef("pk"), reminder=OuterRef("reminder"), date=today
+                )
+            )
+        )
+        .select_related("book", "user")
+        .only("date_event", "book__name", "user__email", "user__tg_chat_id")
+        .order_by("pk")
+    )
+
+
+def reminder_message(lending):
+    """Функция формирует текст напоминания о возврате книги по виду напоминания."""
+    if lending.reminder == "overdue":
+        return f"Вы должны немедленно вернуть книгу {lending.book.name}"
+    elif lending.reminder == "today":
+        return f"Вы сегодня должны вернуть книгу {lending.book.name}"
+    return_date = lending.date_event + timedelta(days=RETURN_PERIOD_DAYS)
+    return f"Вы должны вернуть книгу {lending.book.name} {return_date}"
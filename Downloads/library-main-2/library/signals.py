@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from library.cache import catalogue_invalidate
+from library.models import Authors, Books
+
+
+@receiver([post_save, post_delete], sender=Authors)
+def authors_changed(sender, **kwargs):
+    """Изменение автора сбрасывает кеш авторов и книг (в книгах показывается автор)."""
+    catalogue_invalidate("authors")
+
+
+@receiver([post_save, post_delete], sender=Books)
+def books_changed(sender, **kwargs):
+    """Изменение книги сбрасывает кеш книг."""
+    catalogue_invalidate("books")
@@ -0,0 +1,156 @@
+# Сводные таблицы операций по дням (BookDailyStat - по книгам, ReaderDailyStat - по читателям).
+# Сводки изменяются при проведении и отмене операций, поэтому отчеты по книгам, жанрам, авторам, читателям
+# и месяцам строятся по небольшим сводным таблицам, а не по всему журналу операций. Для восстановления
+# и проверки сводок по журналу предназначены stats_rebuild и stats_check (команда lending_stats).
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncMonth
+
+from library.models import BookDailyStat, Lending, ReaderDailyStat
+
+# сводные таблицы и поле журнала, по которому ведется сводка
+STATS = ((BookDailyStat, "book_id"), (ReaderDailyStat, "user_id"))
+# операции с партией книг, для остальных операций в движении участвует одна книга
+BATCH_OPERATIONS = ("arrival", "inventory")
+LENDING_BOOKS = Case(
+    When(operation__in=BATCH_OPERATIONS, then=F("arrival_quantity")),
+    default=Value(1),
+    output_field=IntegerField(),
+)
+UPSERT_BATCH_SIZE = 1000
+REBUILD_BATCH_SIZE = 5000
+
+# группировки отчета: поля сводки, которые выводятся для каждой группы
+REPORT_GROUPS = {
+    "book": ("book_id", "book__name"),
+    "genre": ("book__genre",),
+    "author": ("book__author_id", "book__author__author"),
+    "reader": ("user_id", "user__reader_name"),
+    "month": ("month",),
+    "date": ("date_event",),
+}
+READER_GROUPS = {"reader", "month", "date"}
+
+
+def lending_books(lending):
+    """Количество книг, участвующих в операции."""
+    if lending.operation in BATCH_OPERATIONS:
+        return lending.arrival_quantity
+    return 1
+
+
+def stats_apply(lendings, sign=1):
+    """Функция учитывает в сводках проведенные (sign=1) или отмененные (sign=-1) операции.
+    Изменения группируются и записываются одним запросом INSERT ... ON CONFLICT DO UPDATE на таблицу.
+    Строки сводок записываются по возрастанию ключа, поэтому параллельные транзакции (lending_atomic)
+    блокируют их в одном порядке и не блокируют друг друга взаимно.
+    """
+    for model, key_field in STATS:
+        deltas = defaultdict(lambda: [0, 0])
+        for lending in lendings:
+            key = (lending.date_event, getattr(lending, key_field), lending.operation)
+            deltas[key][0] += sign
+            deltas[key][1] += sign * lending_books(lending)
+        stats_upsert(model, key_field, sorted(deltas.items()))
+
+
+def stats_upsert(model, key_field, deltas):
+    table = connection.ops.quote_name(model._meta.db_table)
+    for start in range(0, len(deltas), UPSERT_BATCH_SIZE):
+        batch = deltas[start : start + UPSERT_BATCH_SIZE]
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+        params = [
+            value
+            for (date_event, key, operation), (operations, books) in batch
+            for value in (date_event, key, operation, operations, books)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (date_event, {key_field}, operation, operations, books) "
+                f"VALUES {values} "
+                f"ON CONFLICT (date_event, {key_field}, operation) DO UPDATE SET "
+                f"operations = {table}.operations + EXCLUDED.operations, "
+                f"books = {table}.books + EXCLUDED.books",
+                params,
+            )
+
+
+def journal_stats(key_field):
+    """Сводка, рассчитанная по журналу операций одним сгруппированным запросом."""
+    return (
+        Lending.objects.values("date_event", key_field, "operation")
+        .annotate(operations=Count("id"), books=Sum(LENDING_BOOKS))
+        .order_by()
+    )
+
+
+def stats_rebuild():
+    """Функция заново строит сводки по всему журналу операций."""
+    with transaction.atomic():
+        for model, key_field in STATS:
+            model.objects.all().delete()
+            batch = []
+            for row in journal_stats(key_field).iterator(chunk_size=REBUILD_BATCH_SIZE):
+                batch.append(model(**row))
+                if len(batch) == REBUILD_BATCH_SIZE:
+                    model.objects.bulk_create(batch)
+                    batch = []
+            model.objects.bulk_create(batch)
+
+
+def stats_check():
+    """Функция сверяет сводки с журналом операций и возвращает расхождения
+    (таблица, (дата, книга или читатель, операция), по журналу, в сводке)."""
+    mismatches = []
+    for model, key_field in STATS:
+        expected = {
+            (row["date_event"], row[key_field], row["operation"]): (
+                row["operations"],
+                row["books"],
+            )
+            for row in journal_stats(key_field).iterator()
+        }
+        actual = {
+            (row["date_event"], row[key_field], row["operation"]): (
+                row["operations"],
+                row["books"],
+            )
+            for row in model.objects.exclude(operations=0, books=0)
+            .values("date_event", key_field, "operation", "operations", "books")
+            .iterator()
+        }
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                mismatches.append(
+                    (model._meta.model_name, key, expected.get(key), actual.get(key))
+                )
+    return mismatches
+
+
+def stats_report(group_by, date_from=None, date_to=None):
+    """Функция возвращает отчет за период: количество выдач, возвратов, утерь и списаний, а также количество
+    поступивших книг в разрезе групп group_by (книга, жанр, автор, читатель, месяц, дата).
+    """
+    model = ReaderDailyStat if "reader" in group_by else BookDailyStat
+    queryset = model.objects.all()
+    if date_from:
+        queryset = queryset.filter(date_event__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date_event__lte=date_to)
+    if "month" in group_by:
+        queryset = queryset.annotate(month=TruncMonth("date_event"))
+    fields = [field for group in group_by for field in REPORT_GROUPS[group]]
+    totals = {
+        operation: Coalesce(Sum("operations", filter=Q(operation=operation)), 0)
+        for operation in ("issuance", "return", "loss", "write_off")
+    }
+    totals.update(
+        {
+            operation: Coalesce(Sum("books", filter=Q(operation=operation)), 0)
+            for operation in BATCH_OPERATIONS
+        }
+    )
+    return queryset.values(*fields).annotate(**totals).order_by(*fields)
@@ -1,56 +1,111 @@
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 
 import pytz
 from celery import shared_task
-from django.core.mail import send_mail
 from django.utils import timezone
 
 from config import settings
-from config.settings import EMAIL_HOST_USER
-from library.models import Lending
-from library.services import telegram_message
+from library.metrics import notifications_processed, notifications_queued
+from library.models import ReminderLog
+from library.partitions import maintain_partitions
+from library.reconcile import reconcile_counters
+from library.services import (email_send_many, reminder_message,
+                              return_reminders, telegram_send_many)
+from library.stats import stats_check, stats_rebuild
+
+REMINDERS_CHUNK_SIZE = 2000  # сколько выдач читается из БД за один раз
 
 
 @shared_task
 def send_mail_return_books():
     """Функция отправки уведомлений читателям о небходимости возвата книг. Сообщение отправляется на электронну почту и,
     если есть telegram chat_bot, соотвественно и туда. Сообщения отправляеются один раз в день. Первое сообщение
-    отправляется за три дня, а по достижению срока возврата каждый день."""
+    отправляется за три дня, а по достижению срока возврата каждый день.
+    Книги для напоминаний отбираются одним запросом и читаются порциями, поэтому память воркера не зависит
+    от количества выданных книг. Сами уведомления не отправляются здесь, а порциями ставятся в очереди
+    каналов (email, telegram), которые обрабатываются отдельными воркерами."""
     timezone.activate(pytz.timezone(settings.CELERY_TIMEZONE))
     zone = pytz.timezone(settings.CELERY_TIMEZONE)
     today = datetime.now(zone).date()  # текущее дата_время
-    # books_for_return - список книг не возвращненых читателями
-    books_for_return = Lending.objects.filter(operation="issuance", id_return=0)
-    if books_for_return:
-        for book_for_return in books_for_return:
-            if today > book_for_return.date_event + timedelta(days=10):
-                message = (
-                    f"Вы должны немедленно вернуть книгу {book_for_return.book.name}"
-                )
-                print(message)
-            elif today == book_for_return.date_event + timedelta(days=10):
-                message = f"Вы сегодня должны вернуть книгу {book_for_return.book.name}"
-                print(message)
-            else:
-                if today == book_for_return.date_event + timedelta(days=7):
-                    message = f"Вы должны вернуть книгу {book_for_return.book.name} {book_for_return.date_event + timedelta(days=10)}"
-                print(message)
-
-            if message:
-                user_tg = (
-                    book_for_return.user.tg_chat_id
-                )  # telegram chat_bott_id читателя
-                if user_tg:
-                    telegram_message(user_tg, message)
-
-                to_email = (
-                    book_for_return.user.email
-                )  # адрес электронной почты читателя
-                subject = "Возврат книги"
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    recipient_list=[to_email],
-                    from_email=EMAIL_HOST_USER,
-                    fail_silently=True,
-                )
+    chunk_size = settings.NOTIFICATIONS_CHUNK_SIZE
+    emails, telegrams, reminders = [], [], []
+    # books_for_return - невозвращенные читателями книги, по которым сегодня есть напоминание
+    books_for_return = return_reminders(today)
+    for book_for_return in books_for_return.iterator(chunk_size=REMINDERS_CHUNK_SIZE):
+        message = reminder_message(book_for_return)
+        reminders.append(
+            ReminderLog(
+                lending_id=book_for_return.pk,
+                reminder=book_for_return.reminder,
+                date=today,
+            )
+        )
+
+        user_tg = book_for_return.user.tg_chat_id  # telegram chat_bott_id читателя
+        if user_tg:
+            telegrams.append((user_tg, message))
+
+        to_email = book_for_return.user.email  # адрес электронной почты читателя
+        emails.append((to_email, message))
+        if len(emails) == chunk_size or len(telegrams) == chunk_size:
+            reminders, emails, telegrams = enqueue_reminders(
+                reminders, emails, telegrams
+            )
+    enqueue_reminders(reminders, emails, telegrams)
+
+
+def enqueue_reminders(reminders, emails, telegrams):
+    """Записывает порцию напоминаний в журнал ReminderLog и ставит уведомления в очереди каналов.
+    Запись в журнал идет до постановки в очереди, поэтому следующий запуск задачи эти напоминания
+    не повторит, даже если их отправка еще не закончена."""
+    if reminders:
+        ReminderLog.objects.bulk_create(reminders, ignore_conflicts=True)
+    if telegrams:
+        enqueue_notifications(send_telegram_notifications, "telegram", telegrams)
+    if emails:
+        enqueue_notifications(send_email_notifications, "email", emails)
+    return [], [], []
+
+
+def enqueue_notifications(task, channel, notifications):
+    """Ставит порцию уведомлений (адресат, текст) в очередь канала вместе со временем постановки."""
+    notifications_queued(channel, len(notifications))
+    task.delay(notifications, time.time())
+
+
+@shared_task
+def send_email_notifications(notifications, queued_at):
+    """Отправка порции напоминаний о возврате книг на электронную почту (очередь email).
+    Скорость отправки ограничивается на каждое письмо (NOTIFICATIONS_EMAIL_RATE_LIMIT), а не на порцию."""
+    sent = email_send_many(notifications, "Возврат книги")
+    notifications_processed("email", sent, len(notifications) - sent, queued_at)
+
+
+@shared_task
+def send_telegram_notifications(notifications, queued_at):
+    """Отправка порции напоминаний о возврате книг в Телеграм (очередь telegram).
+    Скорость отправки ограничивается на каждое сообщение (NOTIFICATIONS_TELEGRAM_RATE_LIMIT), а не на порцию."""
+    sent = telegram_send_many(notifications)
+    notifications_processed("telegram", sent, len(notifications) - sent, queued_at)
+
+
+@shared_task
+def check_lending_stats():
+    """Ночная сверка сводных таблиц с журналом операций. При расхождениях сводки перестраиваются."""
+    mismatches = stats_check()
+    if mismatches:
+        stats_rebuild()
+    return len(mismatches)
+
+
+@shared_task
+def reconcile_book_counters(full=False):
+    """Сверка счетчиков книг с журналом операций: ночью по изменившимся книгам, раз в неделю - полная."""
+    return len(reconcile_counters(full=full))
+
+
+@shared_task
+def maintain_lending_partitions():
+    """Ежемесячное обслуживание журнала операций: секции на следующий год и перенос закрытых операций в архив."""
+    return maintain_partitions()
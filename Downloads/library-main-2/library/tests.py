@@ -1,10 +1,46 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+
+import pytz
+from celery import current_app
 from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.db.models import F, Q
+from django.db.models.functions import Now
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 
-from library.models import Authors, Books, Lending
+from config import settings
+from config.celery import close_old_db_connections
+from config.instrumentation import registry
+from library import views
+from library.fake_smtp import FakeSMTPServer
+from library.fake_telegram import FakeTelegramServer
+from library.metrics import lending_retries, notifications_metrics
+from library.models import Authors, BookDailyStat, Books, Lending, ReminderLog
+from library.partitions import archive_cutoff, maintain_partitions
+from library.query_budget import QueryBudgetMixin
+from library.reconcile import reconcile_counters
+from library.serializer import (BooksSerializerReadOnly,
+                                LendingSerializerReadOnly)
+from library.services import (email_connection_close, email_send_many,
+                              lending_atomic, open_issuances, return_reminders,
+                              telegram_send_many, throttle,
+                              update_book_counters)
+from library.stats import stats_check, stats_rebuild
+from library.tasks import send_email_notifications, send_mail_return_books
 from users.models import Users
+from users.serializer import UserTokenObtainPairSerializer
 
 
 class AuthorsTestCase(APITestCase):
@@ -268,6 +304,32 @@ class LibraryCreateTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Lending.objects.all().count(), 3)
 
+    def test_open_issuances(self):
+        """Открытая выдача находится одним запросом и пропадает после возврата."""
+        url = reverse("library:lending_create")
+        data = {
+            "user": self.user.pk,
+            "book": self.book.pk,
+            "operation": "arrival",
+            "arrival_quantity": 1,
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = {
+            "user": self.user.pk,
+            "book": self.book.pk,
+            "operation": "issuance",
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            issuance = open_issuances(self.user.pk, self.book.pk).first()
+        self.assertEqual(issuance.pk, response.json()["id"])
+        data["operation"] = "return"
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(open_issuances(self.user.pk, self.book.pk).exists())
+
     class LibraryDeleteTestCase(APITestCase):
         """Тестирование работы библиотеки (отмена операций)."""
 
@@ -414,3 +476,1258 @@ class LibraryCreateTestCase(APITestCase):
             response = self.client.patch(url, data)
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(data.get("is_write_off"), "true")
+
+
+class LendingBulkCreateTestCase(APITestCase):
+    """Тестирование пакетного проведения операций."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru",
+            password="123qwe",
+            is_superuser=True,
+        )
+        self.reader = Users.objects.create(email="reader@yandex.ru", password="123qwe")
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        self.author = Authors.objects.create(author="Джек Лондон")
+        self.books = [
+            Books.objects.create(name=f"Книга {number}", author=self.author)
+            for number in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("library:lending_bulk_create")
+
+    def test_lending_bulk_create(self):
+        """Поступление, выдача и возврат в одном пакете."""
+        operations = [
+            {
+                "user": self.user.pk,
+                "book": book.pk,
+                "operation": "arrival",
+                "arrival_quantity": 1,
+            }
+            for book in self.books
+        ]
+        operations += [
+            {"user": self.reader.pk, "book": book.pk, "operation": "issuance"}
+            for book in self.books
+        ]
+        operations.append(
+            {"user": self.reader.pk, "book": self.books[0].pk, "operation": "return"}
+        )
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Lending.objects.count(), 7)
+        issuance = Lending.objects.get(operation="issuance", book=self.books[0])
+        self.assertTrue(issuance.is_return)
+        self.assertEqual(issuance.id_return, response.json()["results"][6]["id"])
+        book = Books.objects.get(pk=self.books[0].pk)
+        self.assertEqual(
+            (book.quantity_all, book.quantity_lending, book.amount_lending), (1, 0, 1)
+        )
+
+    def test_lending_bulk_create_errors(self):
+        """Ошибочные операции пакета не проводятся, остальные проводятся."""
+        operations = [
+            {
+                "user": self.user.pk,
+                "book": self.books[0].pk,
+                "operation": "arrival",
+                "arrival_quantity": 1,
+            },
+            {"user": self.reader.pk, "book": self.books[0].pk, "operation": "issuance"},
+            {"user": self.user.pk, "book": self.books[0].pk, "operation": "issuance"},
+            {"user": self.reader.pk, "book": self.books[1].pk, "operation": "return"},
+        ]
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        statuses = [result["status"] for result in response.json()["results"]]
+        self.assertEqual(statuses, ["created", "created", "error", "error"])
+        self.assertEqual(Lending.objects.count(), 2)
+
+    def test_lending_bulk_create_queries(self):
+        """Число запросов к БД не зависит от размера пакета."""
+        operations = [
+            {
+                "user": self.user.pk,
+                "book": book.pk,
+                "operation": "arrival",
+                "arrival_quantity": 2,
+            }
+            for book in self.books
+        ]
+        self.client.post(self.url, {"operations": operations}, format="json")
+        operations = [
+            {"user": self.reader.pk, "book": book.pk, "operation": operation}
+            for operation in ("issuance", "return")
+            for book in self.books
+        ]
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                self.url, {"operations": operations}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class BookCountersConcurrencyTestCase(TransactionTestCase):
+    """Нагрузочный тест атомарных счетчиков книги: много потоков одновременно выдают одну книгу."""
+
+    threads = 16
+    attempts = 40
+
+    def setUp(self):
+        self.author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни",
+            genre="story",
+            author=self.author,
+            quantity_all=25,
+        )
+
+    def issue_book(self, _):
+        try:
+            return update_book_counters(
+                self.book.pk,
+                Q(quantity_all__gt=F("quantity_lending")),
+                quantity_lending=1,
+                amount_lending=1,
+            )
+        finally:
+            connection.close()  # каждый поток работает со своим соединением
+
+    def test_concurrent_issuance(self):
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            results = list(executor.map(self.issue_book, range(self.attempts)))
+        self.book.refresh_from_db()
+        self.assertEqual(results.count(True), 25)
+        self.assertEqual(self.book.quantity_lending, 25)
+        self.assertEqual(self.book.amount_lending, 25)
+
+
+class ReturnRemindersTestCase(TestCase):
+    """Тестирование напоминаний о возврате книг."""
+
+    def setUp(self):
+        self.reader = Users.objects.create(
+            email="reader@yandex.ru", password="123qwe", tg_chat_id="743470706"
+        )
+        self.author = Authors.objects.create(author="Джек Лондон")
+        self.today = datetime.now(pytz.timezone(settings.CELERY_TIMEZONE)).date()
+        for days, name in ((15, "overdue"), (10, "today"), (7, "soon"), (3, "none")):
+            book = Books.objects.create(name=name, author=self.author, quantity_all=1)
+            Lending.objects.create(
+                user=self.reader,
+                book=book,
+                operation="issuance",
+                date_event=self.today - timedelta(days=days),
+            )
+
+    def test_return_reminders(self):
+        with self.assertNumQueries(1):
+            lendings = list(return_reminders(self.today))
+            reminders = {lending.book.name: lending.reminder for lending in lendings}
+            emails = {lending.user.email for lending in lendings}
+        self.assertEqual(
+            reminders, {"overdue": "overdue", "today": "today", "soon": "soon"}
+        )
+        self.assertEqual(emails, {self.reader.email})
+
+    @patch("library.services.telegram_message", return_value=True)
+    def test_send_mail_return_books(self, telegram_message):
+        current_app.conf.task_always_eager = (
+            True  # задачи очередей выполняются сразу, без брокера
+        )
+        self.addCleanup(setattr, current_app.conf, "task_always_eager", False)
+        send_mail_return_books()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(telegram_message.call_count, 3)
+        with self.assertNumQueries(1):
+            send_mail_return_books()  # повторный запуск в тот же день ничего не отправляет
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(ReminderLog.objects.count(), 3)
+        metrics = notifications_metrics()
+        self.assertEqual(metrics["email"]["sent"] - metrics["email"]["queued"], 0)
+        self.assertEqual(metrics["telegram"]["backlog"], 0)
+        self.assertTrue(
+            all(message.to == [self.reader.email] for message in mail.outbox)
+        )
+
+
+@patch.object(settings, "NOTIFICATIONS_TELEGRAM_RATE_LIMIT", "0")
+class TelegramMessageTestCase(TestCase):
+    """Тестирование отправки сообщений в Телеграм через заглушку Bot API."""
+
+    def send_many(self, server, messages):
+        with patch.object(settings, "TELEGRAM_URL", server.url), patch.object(
+            settings, "TELEGRAM_BOT_TOKEN", "token"
+        ):
+            return telegram_send_many(messages)
+
+    def test_send_many(self):
+        with FakeTelegramServer() as server:
+            sent = self.send_many(
+                server, [(chat_id, "Возврат") for chat_id in range(20)]
+            )
+        self.assertEqual(sent, 20)
+        self.assertEqual(len(server.messages), 20)
+        self.assertEqual(server.connections, 1)  # соединение переиспользуется
+
+    @patch("library.services.time.sleep")
+    def test_retry_after(self, sleep):
+        with FakeTelegramServer(rate_limited=2, retry_after=5) as server:
+            sent = self.send_many(server, [(1, "Возврат")])
+        self.assertEqual(sent, 1)
+        self.assertEqual(sleep.call_count, 2)
+        sleep.assert_called_with(5)
+
+    def test_server_error_not_repeated(self):
+        """Ответ 5xx не повторяется: сообщение могло быть уже принято, повтор доставил бы его дважды."""
+        with FakeTelegramServer(server_errors=1) as server:
+            sent = self.send_many(server, [(1, "Возврат")])
+        self.assertEqual(sent, 0)
+        self.assertEqual(len(server.messages), 1)
+
+    def test_throttle(self):
+        """Ограничение скорости действует на каждое сообщение: 5 сообщений при 10/s занимают 0.4 с."""
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        with patch("library.services.time.monotonic", lambda: clock[0]), patch(
+            "library.services.time.sleep", side_effect=sleep
+        ):
+            for _ in range(5):
+                throttle("test", "10/s")
+            throttle("test_unlimited", "0")
+        self.assertAlmostEqual(clock[0], 0.4)
+
+
+@patch.object(settings, "NOTIFICATIONS_EMAIL_RATE_LIMIT", "0")
+class EmailSendManyTestCase(TestCase):
+    """Тестирование отправки пачки писем через одно SMTP-соединение."""
+
+    def setUp(self):
+        email_connection_close()
+        self.addCleanup(email_connection_close)
+
+    @patch.object(settings, "EMAIL_MAX_MESSAGES_PER_CONNECTION", 4)
+    def test_email_send_many(self):
+        messages = [(f"reader{number}@yandex.ru", "Возврат") for number in range(10)]
+        with FakeSMTPServer() as server, override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST=server.host,
+            EMAIL_PORT=server.port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+        ):
+            sent = email_send_many(messages[:6], "Возврат книги")
+            sent += email_send_many(messages[6:], "Возврат книги")
+            email_connection_close()
+        self.assertEqual(sent, 10)
+        self.assertEqual(server.messages, 10)
+        self.assertEqual(server.connections, 3)  # по 4 письма на соединение
+
+    def smtp_settings(self, host, port):
+        return override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST=host,
+            EMAIL_PORT=port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            EMAIL_TIMEOUT=5,
+        )
+
+    def test_email_send_many_dropped_connection(self):
+        """После разрыва соединения повторяются только неотправленные письма."""
+        messages = [(f"reader{number}@yandex.ru", "Возврат") for number in range(6)]
+        with FakeSMTPServer(drop_after=3) as server, self.smtp_settings(
+            server.host, server.port
+        ):
+            sent = email_send_many(messages, "Возврат книги")
+            email_connection_close()
+        self.assertEqual(sent, 6)
+        self.assertEqual(server.messages, 6)
+        self.assertEqual(server.connections, 2)
+
+    def test_email_recipient_refused(self):
+        """Отклоненный адрес в середине порции не прерывает отправку остальных писем и не открывает новое соединение."""
+        messages = [(f"reader{number}@yandex.ru", "Возврат") for number in range(7)]
+        with FakeSMTPServer(refuse=["reader1@yandex.ru"]) as server, self.smtp_settings(
+            server.host, server.port
+        ):
+            sent = email_send_many(messages, "Возврат книги")
+            email_connection_close()
+        self.assertEqual(sent, 6)
+        self.assertEqual(server.messages, 6)
+        self.assertEqual(server.connections, 1)
+
+    def test_email_server_unavailable(self):
+        """Недоступный SMTP-сервер не прерывает задачу: порция учитывается в метриках как неотправленная."""
+        with FakeSMTPServer() as server:
+            host, port = server.host, server.port
+        with self.smtp_settings(host, port), patch(
+            "library.tasks.notifications_processed"
+        ) as processed:
+            send_email_notifications([("reader@yandex.ru", "Возврат")], 0)
+        processed.assert_called_once_with("email", 0, 1, 0)
+
+
+@patch.object(settings, "CACHE_ENABLED", True)
+class CatalogueCacheTestCase(APITestCase):
+    """Тестирование кеширования ответов каталога."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create(email="reader@yandex.ru", password="123qwe")
+        self.author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(name="Любовь к жизни", author=self.author)
+        self.client.force_authenticate(user=self.user)
+
+    def test_books_list_cache(self):
+        url = reverse("books-list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):  # роль пользователя тоже берется из кеша
+            cached = self.client.get(url)
+        self.assertEqual(cached.json(), response.json())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_book_counters(self.book.pk, quantity_all=3)  # операция по библиотеке
+            # до фиксации транзакции кеш не сбрасывается
+            self.assertEqual(self.client.get(url).json(), cached.json())
+        response = self.client.get(url)
+        self.assertEqual(response.json()["results"][0]["quantity_all"], 3)
+
+        self.author.author = "Марк Твен"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()["results"][0]["author"]["author"], "Марк Твен")
+
+    def test_book_retrieve_etag(self):
+        url = reverse("books-detail", args=(self.book.pk,))
+        response = self.client.get(url)
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.book.name = "Костер"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class LendingCursorPaginationTestCase(APITestCase):
+    """Тестирование постраничного вывода журнала операций по курсору."""
+
+    def setUp(self):
+        self.user = Users.objects.create(email="ivc@yandex.ru", password="123qwe")
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        book = Books.objects.create(name="Любовь к жизни", author=author)
+        today = datetime.now().date()
+        Lending.objects.bulk_create(
+            [
+                Lending(
+                    user=self.user,
+                    book=book,
+                    operation="arrival",
+                    date_event=today - timedelta(days=number % 4),
+                )
+                for number in range(12)
+            ]
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_lending_list_cursor(self):
+        expected = list(
+            Lending.objects.order_by("-date_event", "-id").values_list("id", flat=True)
+        )
+        url = reverse("library:lending_list") + "?page_size=5"
+        received = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(
+                any("COUNT(" in query["sql"] for query in queries.captured_queries)
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            received += [lending["id"] for lending in response.json()["results"]]
+            url = response.json()["next"]
+        self.assertEqual(received, expected)
+
+    def test_lending_list_bad_cursor(self):
+        url = reverse("library:lending_list") + "?cursor=bad"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LendingExportTestCase(APITestCase):
+    """Тестирование выгрузки журнала операций."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        book = Books.objects.create(name="Любовь к жизни", author=author)
+        for operation in ("arrival", "issuance", "return"):
+            Lending.objects.create(user=self.user, book=book, operation=operation)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("library:lending_export")
+
+    def test_lending_export_csv(self):
+        response = self.client.get(self.url, {"operation": "issuance"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("id,date_event,operation"))
+        self.assertIn("Любовь к жизни", lines[1])
+
+    def test_lending_export_ndjson(self):
+        response = self.client.get(self.url, {"file_format": "ndjson"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        operations = [json.loads(line)["operation"] for line in lines]
+        self.assertEqual(operations, ["arrival", "issuance", "return"])
+
+
+class LendingStatsTestCase(APITestCase):
+    """Тестирование сводных таблиц и отчетов по операциям."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        self.reader = Users.objects.create(
+            email="reader@yandex.ru", password="123qwe", reader_name="Петров П.П."
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни", author=author, genre="adventures"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.client.post(
+            reverse("library:lending_create"),
+            {
+                "user": self.user.pk,
+                "book": self.book.pk,
+                "operation": "arrival",
+                "arrival_quantity": 5,
+            },
+        )
+        self.client.post(
+            reverse("library:lending_bulk_create"),
+            {
+                "operations": [
+                    {"user": self.reader.pk, "book": self.book.pk, "operation": op}
+                    for op in ("issuance", "return", "issuance")
+                ]
+            },
+            format="json",
+        )
+        self.url = reverse("library:lending_report")
+
+    def test_stats_apply(self):
+        """Сводки изменяются при проведении и удалении операций."""
+        self.assertEqual(stats_check(), [])
+        issuance = Lending.objects.filter(operation="issuance").last()
+        self.client.delete(reverse("library:lending_delete", args=[issuance.pk]))
+        self.assertEqual(stats_check(), [])
+        self.assertEqual(BookDailyStat.objects.get(operation="issuance").operations, 1)
+
+    def test_stats_rebuild(self):
+        BookDailyStat.objects.all().delete()
+        self.assertNotEqual(stats_check(), [])
+        stats_rebuild()
+        self.assertEqual(stats_check(), [])
+
+    def test_lending_report(self):
+        response = self.client.get(self.url, {"group_by": "genre,month"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        (row,) = response.json()["results"]
+        self.assertEqual(row["book__genre"], "adventures")
+        self.assertEqual(row["arrival"], 5)
+        self.assertEqual(row["issuance"], 2)
+        self.assertEqual(row["return"], 1)
+
+        response = self.client.get(self.url, {"group_by": "reader"})
+        readers = {row["user__reader_name"]: row for row in response.json()["results"]}
+        self.assertEqual(readers["Петров П.П."]["issuance"], 2)
+
+    def test_lending_report_bad_group(self):
+        response = self.client.get(self.url, {"group_by": "reader,genre"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ValuesSerializerTestCase(APITestCase):
+    """Тестирование быстрого пути сериализаторов только для чтения."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru",
+            password="123qwe",
+            reader_name="Иванов И.И.",
+            phone="+79990000000",
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        for number in range(5):
+            book = Books.objects.create(name=f"Книга {number}", author=author)
+            Lending.objects.create(user=self.user, book=book, operation="issuance")
+        self.client.force_authenticate(user=self.user)
+
+    def test_same_representation(self):
+        """Ответ из словарей совпадает с ответом из моделей."""
+        for serializer, queryset in (
+            (LendingSerializerReadOnly, Lending.objects.order_by("id")),
+            (BooksSerializerReadOnly, Books.objects.order_by("id")),
+        ):
+            self.assertEqual(
+                serializer(serializer.values(queryset), many=True).data,
+                serializer(queryset, many=True).data,
+            )
+
+    def test_lending_list_queries(self):
+        """Число запросов к БД не зависит от количества операций на странице."""
+        url = reverse("library:lending_list")
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url, {"page_size": 1})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url, {"page_size": 5})
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    """Число запросов к БД эндпоинтов списка и просмотра не зависит от количества строк."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        self.grow()
+        self.book = Books.objects.first()
+        self.lending = Lending.objects.first()
+
+    def grow(self):
+        """Добавляет авторов, книги и операции с разными читателями."""
+        for _ in range(5):
+            number = Authors.objects.count()
+            author = Authors.objects.create(author=f"Автор {number}")
+            book = Books.objects.create(name=f"Книга {number}", author=author)
+            reader = Users.objects.create(email=f"reader{number}@yandex.ru")
+            Lending.objects.create(user=reader, book=book, operation="issuance")
+
+    def test_library_lists(self):
+        for budget, name, params in (
+            (2, "authors-list", None),
+            (2, "books-list", None),
+            (2, "library:lending_list", {"page_size": 100}),
+            (2, "library:lending_report", {"group_by": "book"}),
+        ):
+            with self.subTest(name):
+                self.assertQueryBudget(budget, reverse(name), self.grow, params)
+
+    def test_library_retrieves(self):
+        for budget, url in (
+            (1, reverse("books-detail", args=[self.book.pk])),
+            (2, reverse("library:lending_retrieve", args=[self.lending.pk])),
+        ):
+            with self.subTest(url):
+                self.assertQueryBudget(budget, url, self.grow)
+
+
+class CatalogueSearchTestCase(APITestCase):
+    """Тестирование поиска по каталогу книг."""
+
+    def setUp(self):
+        self.user = Users.objects.create(email="reader@yandex.ru", password="123qwe")
+        london = Authors.objects.create(author="Джек Лондон")
+        Books.objects.create(
+            name="Любовь к жизни",
+            author=london,
+            annotation="Рассказ о выживании на севере",
+        )
+        Books.objects.create(
+            name="Мартин Иден", author=Authors.objects.create(author="Другой автор")
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("books-list")
+
+    def search(self, term):
+        response = self.client.get(self.url, {"search": term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book["name"] for book in response.json()["results"]]
+
+    def test_search(self):
+        self.assertEqual(self.search("Лондон"), ["Любовь к жизни"])  # по автору
+        self.assertEqual(self.search("севере"), ["Любовь к жизни"])  # по аннотации
+        self.assertEqual(self.search("Иден"), ["Мартин Иден"])
+
+    @skipUnless(connection.vendor == "postgresql", "поиск PostgreSQL")
+    def test_search_ranked(self):
+        self.assertEqual(self.search("жизнь выживание"), ["Любовь к жизни"])
+        self.assertEqual(self.search("Лондонн"), ["Любовь к жизни"])  # опечатка
+
+
+class ReconcileCountersTestCase(APITestCase):
+    """Тестирование сверки счетчиков книг с журналом операций."""
+
+    def setUp(self):
+        self.user = Users.objects.create(email="ivc@yandex.ru", password="123qwe")
+        self.reader = Users.objects.create(email="reader@yandex.ru", password="123qwe")
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(name="Любовь к жизни", author=author)
+        self.client.force_authenticate(user=self.user)
+        operations = [
+            {
+                "user": self.user.pk,
+                "book": self.book.pk,
+                "operation": "arrival",
+                "arrival_quantity": 3,
+            }
+        ] + [
+            {"user": self.reader.pk, "book": self.book.pk, "operation": operation}
+            for operation in ("issuance", "return", "issuance", "loss")
+        ]
+        self.client.post(
+            reverse("library:lending_bulk_create"),
+            {"operations": operations},
+            format="json",
+        )
+
+    def counters(self):
+        self.book.refresh_from_db()
+        return (
+            self.book.quantity_all,
+            self.book.quantity_lending,
+            self.book.amount_lending,
+        )
+
+    def test_reconcile_counters(self):
+        self.assertEqual(self.counters(), (2, 1, 1))
+        self.assertEqual(reconcile_counters(), {})
+
+        Books.objects.filter(pk=self.book.pk).update(
+            quantity_all=10, amount_lending=0, counters_changed_at=Now()
+        )
+        drift = reconcile_counters()  # инкрементальная сверка
+        self.assertEqual(
+            drift, {self.book.pk: {"quantity_all": -8, "amount_lending": 1}}
+        )
+        self.assertEqual(self.counters(), (2, 1, 1))
+
+    def test_reconcile_counters_full(self):
+        reconcile_counters()
+        # счетчики изменены в обход приложения: инкрементальная сверка их не видит
+        Books.objects.filter(pk=self.book.pk).update(
+            quantity_lending=5, counters_changed_at=Now() - timedelta(days=1)
+        )
+        empty = Books.objects.create(
+            name="Мартин Иден", author=self.book.author, quantity_all=1
+        )
+        self.assertEqual(reconcile_counters(), {})
+        drift = reconcile_counters(full=True)
+        self.assertEqual(
+            drift,
+            {
+                self.book.pk: {"quantity_lending": -4},
+                empty.pk: {"quantity_all": -1},
+            },
+        )
+        self.assertEqual(self.counters(), (2, 1, 1))
+
+    def test_loss_delete_counters(self):
+        """Удаление утери восстанавливает счетчики без расхождений с журналом."""
+        loss = Lending.objects.get(operation="loss")
+        response = self.client.delete(reverse("library:lending_delete", args=[loss.pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.counters(), (3, 1, 2))
+        self.assertEqual(reconcile_counters(full=True, repair=False), {})
+
+
+class RequestMetricsTestCase(APITestCase):
+    """Метрики запросов: заголовок Server-Timing, журнал медленных запросов и эндпоинт /metrics/."""
+
+    def setUp(self):
+        self.user = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        author = Authors.objects.create(author="Грин А.")
+        Books.objects.create(name="Алые паруса", author=author)
+        registry.views.clear()
+
+    def server_timing(self, response):
+        return dict(
+            entry.split(";", 1) for entry in response["Server-Timing"].split(", ")
+        )
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("books-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = self.server_timing(response)
+        self.assertIn(f'desc="{len(queries)} queries"', timing["db"])
+        self.assertEqual(set(timing), {"db", "cache", "serializer", "render", "total"})
+
+    def test_cache_hits(self):
+        cache.clear()
+        with patch.object(settings, "CACHE_ENABLED", True):
+            first = self.client.get(reverse("library:lending_list"))
+            second = self.client.get(reverse("library:lending_list"))
+        self.assertIn("misses=1", self.server_timing(first)["cache"])
+        self.assertIn("hits=1", self.server_timing(second)["cache"])
+
+    def test_slow_request_log(self):
+        with patch.object(settings, "INSTRUMENTATION_SLOW_MS", 0), self.assertLogs(
+            "config.instrumentation", "WARNING"
+        ) as logs:
+            self.client.get(reverse("books-list"))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "books-list")
+        self.assertEqual(record["status"], status.HTTP_200_OK)
+
+    def test_request_log_disabled(self):
+        """Запись журнала не собирается, если ее уровень отключен."""
+        logger = logging.getLogger("config.instrumentation")
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+        with patch("config.instrumentation.json") as instrumentation_json:
+            response = self.client.get(reverse("books-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        instrumentation_json.dumps.assert_not_called()
+
+    @patch.object(settings, "METRICS_TOKEN", "secret")
+    def test_metrics(self):
+        url = reverse("metrics")
+        authorization = {"HTTP_AUTHORIZATION": "Bearer secret"}
+        response = self.client.get(url, **authorization)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with patch.object(settings, "METRICS_SAMPLE_RATE", 1):
+            self.client.get(reverse("books-list"))
+            # адрес клиента не дает доступа (за обратным прокси все запросы приходят с 127.0.0.1)
+            response = self.client.get(url, REMOTE_ADDR="127.0.0.1")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.get(url, **authorization)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'http_request_duration_seconds_count{view="books-list",method="GET"} 1',
+            response.content.decode(),
+        )
+
+
+class LendingTransactionTestCase(TransactionTestCase):
+    """Операции по библиотеке в транзакции: блокировки, откат и повтор после взаимной блокировки."""
+
+    def setUp(self):
+        self.librarian = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.librarian)
+        self.reader = Users.objects.create(email="reader@yandex.ru")
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни", author=author, quantity_all=5
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.librarian)
+        self.issuance = self.lending("issuance").data["id"]
+
+    def lending(self, operation, client=None, user=None):
+        return (client or self.client).post(
+            reverse("library:lending_create"),
+            {
+                "user": (user or self.reader).pk,
+                "book": self.book.pk,
+                "operation": operation,
+            },
+        )
+
+    def concurrent_lending(self, operation, user=None):
+        client = APIClient()
+        client.force_authenticate(user=self.librarian)
+        try:
+            return self.lending(operation, client, user).status_code
+        finally:
+            connection.close()  # каждый поток работает со своим соединением
+
+    # в тестовой БД SQLite (общий кеш в памяти) параллельное чтение вне транзакции, например проверка книги
+    # сериализатором, тоже завершается ошибкой "database table is locked", которую нельзя повторить
+    @skipUnless(connection.vendor == "postgresql", "блокировки строк PostgreSQL")
+    def test_concurrent_return(self):
+        with patch.object(settings, "LENDING_RETRY_DELAY", 0.01), patch.object(
+            settings, "LENDING_MAX_RETRIES", 20
+        ), ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.concurrent_lending, ["return"] * 8))
+        self.assertEqual(results.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(results.count(status.HTTP_400_BAD_REQUEST), 7)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity_lending, 0)
+        self.assertEqual(Lending.objects.filter(operation="return").count(), 1)
+
+    @skipUnless(connection.vendor == "postgresql", "блокировки строк PostgreSQL")
+    def test_concurrent_issuance(self):
+        """Одновременные выдачи книги одному читателю проходят валидацию, но выдается только одна."""
+        reader = Users.objects.create(email="reader2@yandex.ru")
+        with patch.object(settings, "LENDING_RETRY_DELAY", 0.01), patch.object(
+            settings, "LENDING_MAX_RETRIES", 20
+        ), ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(
+                    lambda _: self.concurrent_lending("issuance", reader), range(8)
+                )
+            )
+        self.assertEqual(results.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(results.count(status.HTTP_400_BAD_REQUEST), 7)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity_lending, 2)
+        self.assertEqual(open_issuances(reader.pk, self.book.pk).count(), 1)
+
+    def test_destroy_rollback(self):
+        lending_return = self.lending("return").data["id"]
+        with patch("library.views.update_book_counters", return_value=False):
+            response = self.client.delete(
+                reverse("library:lending_delete", args=[lending_return])
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        issuance = Lending.objects.get(pk=self.issuance)
+        self.assertEqual(issuance.id_return, lending_return)
+        self.assertTrue(issuance.is_return)
+        self.assertTrue(Lending.objects.filter(pk=lending_return).exists())
+
+    def test_write_off_keeps_concurrent_changes(self):
+        """Списание записывается в заблокированную строку и не затирает изменения, сделанные до блокировки."""
+        self.lending("loss")
+        lock_book = views.lock_book
+        losses = []
+
+        def concurrent_loss(book_pk):
+            # параллельно утеря отменена и проведена заново
+            losses.append(
+                Lending.objects.create(
+                    user=self.reader, book=self.book, operation="loss"
+                ).pk
+            )
+            Lending.objects.filter(pk=self.issuance).update(id_return=losses[0])
+            lock_book(book_pk)
+
+        with patch("library.views.lock_book", side_effect=concurrent_loss):
+            response = self.client.patch(
+                reverse("library:lending_update", args=[self.issuance]),
+                {"is_write_off": True},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["is_write_off"])
+        issuance = Lending.objects.get(pk=self.issuance)
+        self.assertTrue(issuance.is_write_off)
+        self.assertEqual(issuance.id_return, losses[0])
+
+    def test_retry(self):
+        calls = []
+
+        def deadlock():
+            calls.append(1)
+            if len(calls) == 1:
+                error = OperationalError("deadlock detected")
+                error.__cause__ = type(
+                    "DeadlockDetected", (Exception,), {"pgcode": "40P01"}
+                )()
+                raise error
+            return "ok"
+
+        retries = lending_retries()
+        with patch.object(settings, "LENDING_RETRY_DELAY", 0), self.assertLogs(
+            "library.services", "WARNING"
+        ):
+            self.assertEqual(lending_atomic(deadlock), "ok")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(lending_retries(), retries + 1)
+
+    def test_no_retry(self):
+        calls = []
+
+        def failure():
+            calls.append(1)
+            raise OperationalError("no such table")
+
+        with self.assertRaises(OperationalError):
+            lending_atomic(failure)
+        self.assertEqual(len(calls), 1)
+
+
+class AsyncReadApiTestCase(TestCase):
+    """Асинхронные представления чтения (library.async_views): ответы совпадают с синхронными представлениями."""
+
+    def setUp(self):
+        cache.clear()
+        self.librarian = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        Group.objects.create(name="librarian").user_set.add(self.librarian)
+        self.reader = Users.objects.create(
+            email="reader@yandex.ru", reader_name="Петров П.П."
+        )
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни", author=author, quantity_all=3
+        )
+        Books.objects.create(name="Белый клык", author=author, genre="novel")
+        self.headers = {}
+        for user in (self.librarian, self.reader):
+            Lending.objects.create(user=user, book=self.book, operation="issuance")
+            token = UserTokenObtainPairSerializer.get_token(user).access_token
+            self.headers[user] = {"Authorization": f"Bearer {token}"}
+
+    async def assertSameResponse(self, path, user, query=""):
+        headers = self.headers[user]
+        expected = await self.async_client.get(f"/{path}{query}", headers=headers)
+        response = await self.async_client.get(f"/async/{path}{query}", headers=headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(
+            response.content.decode().replace("/async/", "/"),
+            expected.content.decode(),
+        )
+        return response
+
+    async def test_books(self):
+        response = await self.assertSameResponse("books/", self.reader)
+        self.assertEqual(response.json()["count"], 2)
+        await self.assertSameResponse("books/", self.reader, "?genre=novel")
+        await self.assertSameResponse("books/", self.reader, "?page_size=5")
+        await self.assertSameResponse(f"books/{self.book.pk}/", self.reader)
+        await self.assertSameResponse("books/0/", self.reader)
+
+    async def test_lending(self):
+        response = await self.assertSameResponse("lending/", self.reader)
+        self.assertEqual(len(response.json()["results"]), 1)
+        response = await self.assertSameResponse("lending/", self.librarian)
+        self.assertEqual(len(response.json()["results"]), 2)
+        await self.assertSameResponse("lending/", self.librarian, "?page_size=1")
+        await self.assertSameResponse("lending/", self.librarian, "?cursor=bad")
+        lending = await Lending.objects.filter(user=self.librarian).afirst()
+        # читатель не видит чужие операции
+        await self.assertSameResponse(f"lending/{lending.pk}/", self.reader)
+        await self.assertSameResponse(f"lending/{lending.pk}/", self.librarian)
+
+    async def test_not_authenticated(self):
+        response = await self.async_client.get("/async/books/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("Bearer", response["WWW-Authenticate"])
+        response = await self.async_client.get(
+            "/async/books/", headers={"Authorization": "Bearer bad"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.post(
+            "/async/books/", headers=self.headers[self.reader]
+        )
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_catalogue_cache(self):
+        # синхронные и асинхронные представления используют одни и те же записи кеша
+        headers = self.headers[self.reader]
+        with patch.object(settings, "CACHE_ENABLED", True):
+            response = await self.async_client.get("/books/", headers=headers)
+            cached = await self.async_client.get(
+                "/async/books/",
+                headers={**headers, "If-None-Match": response["ETag"]},
+            )
+            self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+            cached = await self.async_client.get("/async/books/", headers=headers)
+        self.assertEqual(cached.json(), response.json())
+        # из БД читается только пользователь токена
+        self.assertIn('desc="1 queries"', cached["Server-Timing"])
+
+    async def test_server_timing(self):
+        response = await self.async_client.get(
+            "/async/lending/", headers=self.headers[self.reader]
+        )
+        # пользователь, роль и страница журнала
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+
+
+class CeleryConnectionsTestCase(TransactionTestCase):
+    """Соединения с БД в задачах Celery: устаревшие закрываются, постоянные (CONN_MAX_AGE) переиспользуются."""
+
+    @staticmethod
+    def task(is_eager=False):
+        return SimpleNamespace(request=SimpleNamespace(is_eager=is_eager))
+
+    def connect(self, conn_max_age):
+        connection.close()
+        with patch.dict(connection.settings_dict, CONN_MAX_AGE=conn_max_age):
+            connection.ensure_connection()
+        return connection.connection
+
+    def test_obsolete_connection_closed(self):
+        self.connect(0)
+        close_old_db_connections(task=self.task(is_eager=True))
+        self.assertIsNotNone(connection.connection)
+        close_old_db_connections(task=self.task())
+        self.assertIsNone(connection.connection)
+
+    def test_persistent_connection_reused(self):
+        raw = self.connect(60)
+        close_old_db_connections(task=self.task())
+        close_old_db_connections(task=self.task())
+        self.assertIs(connection.connection, raw)
+
+
+@patch.object(settings, "REPLICA_ENABLED", True)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Чтение с реплики (config.db_router). В тестах реплика - второе соединение с той же БД (TEST MIRROR)."""
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.librarian = Users.objects.create(
+            email="ivc@yandex.ru", password="123qwe", reader_name="Иванов И.И."
+        )
+        Group.objects.create(name="librarian").user_set.add(self.librarian)
+        self.reader = Users.objects.create(email="reader@yandex.ru")
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни", author=author, quantity_all=5
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.librarian)
+        self.lending = Lending.objects.get(
+            pk=self.client.post(
+                reverse("library:lending_create"),
+                {"user": self.reader.pk, "book": self.book.pk, "operation": "issuance"},
+            ).data["id"]
+        )
+        self.reader_client = APIClient()
+        self.reader_client.force_authenticate(user=self.reader)
+
+    def request(self, client, method, url, data=None):
+        """Запрос и таблицы, которые он читал из основной БД и с реплики."""
+        with CaptureQueriesContext(
+            connections["default"]
+        ) as primary, CaptureQueriesContext(connections["replica"]) as replica:
+            response = getattr(client, method)(url, data)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return (
+            response,
+            " ".join(query["sql"] for query in primary),
+            " ".join(query["sql"] for query in replica),
+        )
+
+    def test_reads_from_replica(self):
+        for url, table in (
+            (reverse("library:lending_list"), Lending._meta.db_table),
+            (reverse("library:lending_export"), Lending._meta.db_table),
+            (
+                reverse("library:lending_retrieve", args=[self.lending.pk]),
+                Lending._meta.db_table,
+            ),
+            (reverse("books-list"), Books._meta.db_table),
+            (reverse("authors-list"), Authors._meta.db_table),
+            (reverse("library:lending_report"), BookDailyStat._meta.db_table),
+        ):
+            with self.subTest(url=url):
+                response, primary, replica = self.request(self.client, "get", url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn(table, replica)
+                self.assertNotIn(table, primary)
+
+    def test_read_your_writes(self):
+        """После записи библиотекарь читает из основной БД, остальные пользователи - с реплики."""
+        url = reverse("library:lending_list")
+        response, primary, replica = self.request(
+            self.client,
+            "post",
+            reverse("library:lending_create"),
+            {"user": self.reader.pk, "book": self.book.pk, "operation": "return"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replica, "")
+
+        book_return = response.data["id"]
+        response, primary, replica = self.request(self.client, "get", url)
+        self.assertEqual(response.json()["results"][0]["id"], book_return)
+        self.assertIn(Lending._meta.db_table, primary)
+        self.assertEqual(replica, "")
+
+        _, primary, replica = self.request(self.reader_client, "get", url)
+        self.assertIn(Lending._meta.db_table, replica)
+
+        cache.clear()  # окно закрепления истекло
+        _, primary, replica = self.request(self.client, "get", url)
+        self.assertIn(Lending._meta.db_table, replica)
+
+    def test_failed_write_not_pinned(self):
+        response, _, _ = self.request(
+            self.client, "post", reverse("library:lending_create"), {}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        _, primary, replica = self.request(
+            self.client, "get", reverse("library:lending_list")
+        )
+        self.assertIn(Lending._meta.db_table, replica)
+
+    def test_replica_object_saved_to_primary(self):
+        book = Books.objects.using("replica").get(pk=self.book.pk)
+        book.name = "Белый клык"
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            book.save()
+        self.assertEqual(len(replica), 0)
+        self.assertEqual(Books.objects.get(pk=self.book.pk).name, "Белый клык")
+
+    @patch.object(settings, "CACHE_ENABLED", True)
+    def test_catalogue_cache_filled_from_primary(self):
+        """Ответ каталога, сохраняемый в кеш сразу после изменения книги, строится по основной БД."""
+        url = reverse("books-list")
+        _, primary, replica = self.request(self.reader_client, "get", url)
+        self.assertIn(Books._meta.db_table, replica)
+
+        self.book.name = "Белый клык"
+        self.book.save()
+        response, primary, replica = self.request(self.reader_client, "get", url)
+        self.assertEqual(response.json()["results"][0]["name"], "Белый клык")
+        self.assertIn(Books._meta.db_table, primary)
+        self.assertNotIn(Books._meta.db_table, replica)
+
+
+class LendingPartitionsTestCase(APITestCase):
+    """Тестирование переноса закрытых операций в архив и секций журнала операций."""
+
+    def setUp(self):
+        self.user = Users.objects.create(email="ivc@yandex.ru", password="123qwe")
+        self.reader = Users.objects.create(email="reader@yandex.ru", password="123qwe")
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        author = Authors.objects.create(author="Джек Лондон")
+        self.book = Books.objects.create(
+            name="Любовь к жизни", author=author, quantity_all=5, quantity_lending=2
+        )
+        self.client.force_authenticate(user=self.user)
+        self.today = date.today()
+        self.cutoff = archive_cutoff(self.today, settings.LENDING_ARCHIVE_YEARS)
+        self.old = date(self.cutoff.year - 2, 3, 1)
+        self.arrival = self.lending("arrival", self.old, user=self.user)
+        self.issuance, self.returned = self.pair(
+            self.old, self.old + timedelta(days=10)
+        )
+        self.open = self.lending("issuance", self.old)  # книга до сих пор на руках
+        # возвращена после границы архива: пара остается в рабочих секциях
+        self.late_issuance, self.late_return = self.pair(
+            self.cutoff - timedelta(days=5), self.cutoff + timedelta(days=5)
+        )
+        self.recent = self.lending("issuance", self.today)
+
+    def lending(self, operation, date_event, user=None):
+        return Lending.objects.create(
+            user=user or self.reader,
+            book=self.book,
+            operation=operation,
+            date_event=date_event,
+        )
+
+    def pair(self, issued, returned):
+        issuance = self.lending("issuance", issued)
+        lending_return = self.lending("return", returned)
+        issuance.id_return = lending_return.pk
+        issuance.is_return = True
+        issuance.save(update_fields=["id_return", "is_return"])
+        return issuance, lending_return
+
+    def archived(self):
+        return set(Lending.objects.filter(archived=True).values_list("pk", flat=True))
+
+    def test_archive_closed_lendings(self):
+        result = maintain_partitions(today=self.today, vacuum=False)
+        self.assertEqual(result["archived"], 3)
+        self.assertEqual(
+            self.archived(), {self.arrival.pk, self.issuance.pk, self.returned.pk}
+        )
+        self.assertEqual(Lending.objects.count(), 7)
+        # открытая выдача остается в рабочих секциях и находится поиском открытых выдач
+        self.assertEqual(
+            list(open_issuances(self.reader.pk, self.book.pk).order_by("pk")),
+            [self.open, self.recent],
+        )
+        self.assertEqual(
+            maintain_partitions(today=self.today, vacuum=False)["archived"], 0
+        )
+
+    def test_delete_archived_return(self):
+        """Отмена архивного возврата возвращает выдачу из архива."""
+        maintain_partitions(today=self.today, vacuum=False)
+        url = reverse("library:lending_delete", args=(self.returned.pk,))
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.issuance.refresh_from_db()
+        self.assertFalse(self.issuance.archived)
+        self.assertEqual(self.issuance.id_return, 0)
+        self.assertIn(self.issuance, open_issuances(self.reader.pk, self.book.pk))
+
+    def test_lending_list_period(self):
+        response = self.client.get(
+            reverse("library:lending_list"),
+            {"date_event__gte": self.cutoff, "page_size": 10},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {lending["id"] for lending in response.json()["results"]},
+            {self.late_return.pk, self.recent.pk},
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "секции PostgreSQL")
+    def test_partitions(self):
+        result = maintain_partitions(today=self.today, vacuum=False)
+        # секции текущего и следующего года созданы миграцией, секция года возврата - из секции по умолчанию
+        self.assertEqual(
+            result["created"], [f"library_lending_live_y{self.cutoff.year}"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, tableoid::regclass::text FROM library_lending")
+            partitions = dict(cursor.fetchall())
+        self.assertEqual(
+            partitions[self.returned.pk], f"library_lending_archive_y{self.old.year}"
+        )
+        # давняя открытая выдача остается в секции по умолчанию, секция ее года не создается
+        self.assertEqual(partitions[self.open.pk], "library_lending_live_default")
+        self.assertEqual(
+            partitions[self.late_return.pk], f"library_lending_live_y{self.cutoff.year}"
+        )
+        self.assertEqual(
+            partitions[self.recent.pk], f"library_lending_live_y{self.today.year}"
+        )
+        # поиск открытых выдач не читает архив, отбор за текущий год - архив и прошлые годы
+        self.assertNotIn(
+            "library_lending_archive",
+            open_issuances(self.reader.pk, self.book.pk).explain(),
+        )
+        plan = Lending.objects.filter(
+            date_event__gte=date(self.today.year, 1, 1),
+            date_event__lt=date(self.today.year + 1, 1, 1),
+        ).explain()
+        self.assertNotIn("library_lending_archive", plan)
+        self.assertNotIn(f"live_y{self.today.year - 1}", plan)
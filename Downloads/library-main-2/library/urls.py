@@ -4,10 +4,14 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from rest_framework.routers import SimpleRouter
 
+from library import async_views
 from library.apps import LibraryConfig
-from library.views import (AuthorsViewSet, BooksViewSet, LendingCreateApiView,
-                           LendingDestroyApiView, LendingListApiView,
-                           LendingRetrieveApiView, LendingUpdateApiView)
+from library.views import (AuthorsViewSet, BooksViewSet,
+                           LendingBulkCreateApiView, LendingCreateApiView,
+                           LendingDestroyApiView, LendingExportApiView,
+                           LendingListApiView, LendingReportApiView,
+                           LendingRetrieveApiView, LendingUpdateApiView,
+                           NotificationMetricsApiView)
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -31,7 +35,11 @@ app_name = LibraryConfig.name
 
 urlpatterns = [
     path("lending/", LendingListApiView.as_view(), name="lending_list"),
+    path("lending/export/", LendingExportApiView.as_view(), name="lending_export"),
     path("lending/create/", LendingCreateApiView.as_view(), name="lending_create"),
+    path(
+        "lending/bulk/", LendingBulkCreateApiView.as_view(), name="lending_bulk_create"
+    ),
     path(
         "lending/<int:pk>/", LendingRetrieveApiView.as_view(), name="lending_retrieve"
     ),
@@ -45,6 +53,21 @@ urlpatterns = [
         LendingDestroyApiView.as_view(),
         name="lending_delete",
     ),
+    path(
+        "notifications/metrics/",
+        NotificationMetricsApiView.as_view(),
+        name="notifications_metrics",
+    ),
+    path("reports/", LendingReportApiView.as_view(), name="lending_report"),
+    # асинхронные представления чтения для развертывания через ASGI (library.async_views)
+    path("async/books/", async_views.books_list, name="async_books_list"),
+    path("async/books/<int:pk>/", async_views.book_detail, name="async_book_detail"),
+    path("async/lending/", async_views.lending_list, name="async_lending_list"),
+    path(
+        "async/lending/<int:pk>/",
+        async_views.lending_detail,
+        name="async_lending_retrieve",
+    ),
 ]
 # urlpatterns += router_books.urls
 # urlpatterns += router_authors.urls
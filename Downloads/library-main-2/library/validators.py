@@ -1,6 +1,7 @@
 from rest_framework.serializers import ValidationError
 
-from library.models import Books, Lending
+from library.models import Books
+from library.services import open_issuances
 
 
 class LibraryValidators:
@@ -10,12 +11,7 @@ class LibraryValidators:
         book_pk = lending_dict["book"].pk
         if lending_dict["operation"] == "issuance":
             # срабатывает при попытке повторно получить книгу с тем же названием если предыдущая не сдана.
-            lending_objects_list = list(
-                Lending.objects.filter(
-                    user_id=user_pk, operation="issuance", book_id=book_pk, id_return=0
-                )
-            )
-            if len(lending_objects_list) == 1:
+            if open_issuances(user_pk, book_pk).exists():
                 raise ValidationError("Вы уже получили эту книгу в библиотеке !")
 
         if (
@@ -10,26 +10,41 @@
 # (вышестоящие органы, в статистику и так далее)
 
 
+import csv
+import json
+
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets
-from rest_framework.exceptions import ValidationError
+from rest_framework import status, viewsets
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.generics import (CreateAPIView, DestroyAPIView,
                                      ListAPIView, RetrieveAPIView,
                                      UpdateAPIView)
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from config.db_router import ReplicaReadMixin, read_db
+from library.cache import CachedCatalogueMixin
+from library.metrics import notifications_metrics
 from library.models import Authors, Books, Lending
 from library.paginations import (AuthorsPaginator, BooksPaginator,
-                                 LendingPaginator)
+                                 LendingCursorPaginator)
+from library.search import CatalogueSearchFilter
 from library.serializer import (AuthorsSerializer, BooksSerializer,
-                                BooksSerializerReadOnly, LendingSerializer,
+                                BooksSerializerReadOnly, LendingBulkSerializer,
+                                LendingReportSerializer, LendingSerializer,
                                 LendingSerializerReadOnly,
                                 LendingSerializerWriteOff)
+from library.services import (lending_atomic, lending_bulk_create, lock_book,
+                              open_issuances, update_book_counters)
+from library.stats import stats_apply, stats_report
 from users.permissions import IsLibrarian
 
 
-class AuthorsViewSet(viewsets.ModelViewSet):
+class AuthorsViewSet(ReplicaReadMixin, CachedCatalogueMixin, viewsets.ModelViewSet):
     """Представление для авторов книг"""
 
     queryset = Authors.objects.all().order_by("id")
@@ -51,27 +66,36 @@ class AuthorsViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
 
-class BooksViewSet(viewsets.ModelViewSet):
+class BooksViewSet(ReplicaReadMixin, CachedCatalogueMixin, viewsets.ModelViewSet):
     """Представление для книг."""
 
-    queryset = Books.objects.all().order_by("id")
+    queryset = Books.objects.select_related("author").order_by("id")
     pagination_class = BooksPaginator
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            # книги выбираются словарями вместе с автором одним запросом (быстрый путь сериализатора)
+            return BooksSerializerReadOnly.values(queryset)
+        return queryset
+
     def get_serializer_class(self):
         if self.action in ("create", "update", "partial_update"):
             return BooksSerializer
         else:
             return BooksSerializerReadOnly
 
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # поиск по названию, автору и аннотации с упорядочиванием по релевантности (library.search)
+    filter_backends = [DjangoFilterBackend, CatalogueSearchFilter, OrderingFilter]
     ordering_fields = (
         "author",
         "genre",
         "name",
     )
     search_fields = (
-        "author",
         "name",
+        "author__author",
+        "annotation",
     )
     filterset_fields = ("author", "genre", "name", "barcode")
 
@@ -86,33 +110,102 @@ class BooksViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
 
-class LendingListApiView(ListAPIView):
+class LendingListApiView(ReplicaReadMixin, ListAPIView):
     def get_queryset(self):
         if IsLibrarian().has_permission(self.request, self):
-            return Lending.objects.all().order_by("id")
+            queryset = Lending.objects.all().order_by("id")
         else:
-            return Lending.objects.filter(user=self.request.user)
+            queryset = Lending.objects.filter(user=self.request.user.pk)
+        # операции выбираются словарями вместе с данными читателя одним запросом (быстрый путь сериализатора)
+        return LendingSerializerReadOnly.values(queryset)
 
     serializer_class = LendingSerializerReadOnly
-    pagination_class = LendingPaginator
+    # журнал выводится от новых операций к старым постранично по курсору (date_event, id),
+    # поэтому сортировка по произвольным полям не поддерживается
+    pagination_class = LendingCursorPaginator
 
     filter_backends = [
-        OrderingFilter,
         DjangoFilterBackend,
     ]
-    ordering_fields = ("book", "user", "date_event")
-    filterset_fields = (
-        "user",
-        "book",
+    # отбор за период (date_event__gte, date_event__lte) читает только секции журнала за годы этого периода
+    filterset_fields = {
+        "user": ["exact"],
+        "book": ["exact"],
+        "date_event": ["exact", "gte", "lte"],
+        "operation": ["exact"],
+        "is_return": ["exact"],
+        "is_loss": ["exact"],
+        "is_write_off": ["exact"],
+    }
+
+
+class LendingExportApiView(LendingListApiView):
+    """Потоковая выгрузка журнала операций в CSV (по умолчанию) или NDJSON (?file_format=ndjson) для отчетов.
+    Применяются те же фильтры, что и в списке операций. Строки читаются из БД порциями через курсор на стороне
+    сервера и сразу отправляются клиенту, поэтому память не зависит от объема выгрузки.
+    """
+
+    pagination_class = None
+    export_fields = (
+        "id",
         "date_event",
         "operation",
+        "user_id",
+        "user__reader_name",
+        "book_id",
+        "book__name",
+        "arrival_quantity",
+        "issued_quantity",
+        "id_return",
         "is_return",
         "is_loss",
         "is_write_off",
     )
+    export_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        file_format = request.query_params.get("file_format", "csv")
+        if file_format not in ("csv", "ndjson"):
+            raise ValidationError("Поддерживаются форматы выгрузки csv и ndjson.")
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .order_by("date_event", "id")
+            .values_list(*self.export_fields)
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        if file_format == "csv":
+            content = self.csv_lines(rows)
+            content_type = "text/csv; charset=utf-8"
+        else:
+            content = self.ndjson_lines(rows)
+            content_type = "application/x-ndjson; charset=utf-8"
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="lending.{file_format}"'
+        )
+        return response
+
+    def csv_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.export_fields)
+        for row in rows:
+            yield writer.writerow(row)
+
+    def ndjson_lines(self, rows):
+        for row in rows:
+            yield json.dumps(
+                dict(zip(self.export_fields, row)), ensure_ascii=False, default=str
+            ) + "\n"
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку вместо ее сохранения."""
 
+    def write(self, value):
+        return value
 
-class LendingCreateApiView(CreateAPIView):
+
+class LendingCreateApiView(ReplicaReadMixin, CreateAPIView):
     """Создавать операции в библиотеке могут только пользователи с правами библиоткаря.
     Результаты каждой операции по библиотеке, помимо модели Lendings, отражажаются в модели Books.
     """
@@ -121,54 +214,63 @@ class LendingCreateApiView(CreateAPIView):
     serializer_class = LendingSerializer
 
     def perform_create(self, serializer):
+        lending_atomic(self.create_lending, serializer)
+
+    def create_lending(self, serializer):
+        """Проведение операции в транзакции (lending_atomic): книга блокируется до поиска выдачи."""
+        # при повторе после отката транзакции операция создается заново
+        serializer.instance = None
         operation = serializer.validated_data["operation"]
         book_return_id = serializer.validated_data["book"].pk
         book_user_id = serializer.validated_data["user"].pk
         book_name = serializer.validated_data["book"].name
-        book_object = Books.objects.get(pk=book_return_id)
+        lock_book(book_return_id)
+        deltas = {}  # изменения счетчиков книги
+        condition = None  # условие, при котором счетчики книги можно изменить
+        error_message = ""  # сообщение, если условие не выполнено
         if operation == "inventory":
             # при поступлении партии книг увеличивается общее количество книг с таким названием (quantity_all)
             # пользователем (хозяином) операции в этом случае автоматически является библиотекарь
             serializer.validated_data["user"].pk = self.request.user.id
             quantity = serializer.validated_data["arrival_quantity"]
             issued = serializer.validated_data["issued_quantity"]
-            book_object.quantity_all += quantity
-            book_object.quantity_lending += issued
+            deltas = {"quantity_all": quantity, "quantity_lending": issued}
         if operation == "arrival":
             # при поступлении партии книг увеличивается общее количество книг с таким названием (quantity_all)
             # пользователем (хозяином) операции в этом случае автоматически является библиотекарь
             serializer.validated_data["user"].pk = self.request.user.id
             quantity = serializer.validated_data["arrival_quantity"]
-            book_object.quantity_all += quantity
+            deltas = {"quantity_all": quantity}
         elif operation == "issuance":
             # при получениии книг увеличивается количество выданных с данным названием книг (quantity_lending)
-            # и общее количество выдачи (amount_lending)
-            book_object.quantity_lending += 1
-            book_object.amount_lending += 1
+            # и общее количество выдачи (amount_lending). Выдача возможна, только если в библиотеке есть
+            # свободный экземпляр (quantity_all > quantity_lending), проверка выполняется в том же UPDATE.
+            # Проверка валидатора на повторную выдачу выполняется до блокировки книги, поэтому повторяется
+            # под блокировкой: одновременная выдача той же книги тому же читателю уже зафиксирована.
+            if open_issuances(book_user_id, book_return_id).exists():
+                raise ValidationError("Вы уже получили эту книгу в библиотеке !")
+            deltas = {"quantity_lending": 1, "amount_lending": 1}
+            condition = Q(quantity_all__gt=F("quantity_lending"))
+            error_message = f"Все книги '{book_name}' выданы читателям !"
         elif operation == "return":
             # при возврате книги уменьшается количество выданных с данным названием книг (quantity_lending)
             # далее в БД ищется операция выдачи книги пользователю и делается пометка о возврате (is_return = True)
             # при попытке повторного возврата появляется исключение
-            lending_object_list = list(
-                Lending.objects.filter(
-                    user_id=book_user_id,
-                    operation="issuance",
-                    book_id=book_return_id,
-                    id_return=0,
-                )
-            )  # поиск операции выдачи книги
-            if len(lending_object_list) == 0:
-                raise ValidationError(f"Книга '{book_object.name}' уже возвращена !")
-            lending_object_id = lending_object_list[0].pk  # id операции выдачи книги
-            lending_object = Lending.objects.get(
-                pk=lending_object_id
-            )  # найденная операция выдачи
-            book_object.quantity_lending -= 1
+            lending_object = (
+                open_issuances(book_user_id, book_return_id).select_for_update().first()
+            )  # поиск и блокировка операции выдачи книги
+            if lending_object is None:
+                raise ValidationError(f"Книга '{book_name}' уже возвращена !")
+            deltas = {"quantity_lending": -1}
+            condition = Q(quantity_lending__gt=0)
+            error_message = f"Книга '{book_name}' уже возвращена !"
         elif operation == "write_off":
             # при списании физически изношенной книги уменьшается общее количество данных книг (quantity_all)
             # пользователем (хозяином) операции в этом случае автоматически является библиотекарь
             serializer.validated_data["user"].pk = self.request.user.id
-            book_object.quantity_all -= 1
+            deltas = {"quantity_all": -1}
+            condition = Q(quantity_all__gt=F("quantity_lending"))
+            error_message = f"Все книги '{book_name}' выданы читателям !"
         elif operation == "loss":
             # при утере книги отправляется сообщение библиотекарю о необходимости списания книги
             # пользователем (хозяином) операции в этом случае автоматически является библиотекарь
@@ -176,60 +278,89 @@ class LendingCreateApiView(CreateAPIView):
             # Общее количество книги в библиотеке уменьшатеся на 1
             serializer.validated_data["user"].pk = self.request.user.id
             print(f"Книга {book_name} утеряна, необходимо провести списание книги.")
-            lending_object_list = list(
-                Lending.objects.filter(
-                    user_id=book_user_id,
-                    operation="issuance",
-                    book_id=book_return_id,
-                    id_return=0,
-                )
-            )  # поиск операции выдачи книги
-            if len(lending_object_list) == 0:
-                raise ValidationError(f"Книга '{book_object.name}' возвращена !")
-            lending_object_id = lending_object_list[0].pk  # id операции выдачи книги
-            lending_object = Lending.objects.get(
-                pk=lending_object_id
-            )  # найденная операция выдачи
-            book_object.quantity_all -= 1
-            book_object.amount_lending -= 1
-
+            lending_object = (
+                open_issuances(book_user_id, book_return_id).select_for_update().first()
+            )  # поиск и блокировка операции выдачи книги
+            if lending_object is None:
+                raise ValidationError(f"Книга '{book_name}' возвращена !")
+            deltas = {"quantity_all": -1, "amount_lending": -1}
+            condition = Q(quantity_all__gt=0, amount_lending__gt=0)
+            error_message = f"Книга '{book_name}' возвращена !"
+
+        # счетчики книги меняются одним условным UPDATE без чтения строки (read-modify-write),
+        # поэтому одновременные операции с одной книгой не теряют изменений друг друга
+        if not update_book_counters(book_return_id, condition, **deltas):
+            raise ValidationError(error_message)
         lending = serializer.save()
-        book_object.save()
-        lending.save()
+        stats_apply([lending])
         if operation == "return":
             # пометка о возврате книги в операции выдачи книги
             lending_object.id_return = lending.id
             lending_object.is_return = True
-            lending_object.save()
+            lending_object.save(update_fields=["id_return", "is_return"])
 
         if operation == "loss":
             # пометка об утере книги в операции выдачи книги
             lending_object.id_return = lending.id
             lending_object.is_loss = True
-            lending_object.save()
+            lending_object.save(update_fields=["id_return", "is_loss"])
 
     permission_classes = [IsLibrarian]
 
 
-class LendingDestroyApiView(DestroyAPIView):
-    """Удалять операции по библиотеке могут только пользователи с правами библиотекаря."""
+class LendingBulkCreateApiView(ReplicaReadMixin, CreateAPIView):
+    """Пакетное проведение операций (выдача, возврат, поступление и т.д.) для всей тележки книг одним запросом.
+    Операции проверяются и записываются за постоянное число запросов к БД в одной транзакции,
+    в ответе возвращается результат по каждой операции пакета."""
 
-    def get_queryset(self):
-        lending_object = Lending.objects.get(pk=self.kwargs["pk"])  # удаляемая операция
-        book_object = Books.objects.get(
-            pk=lending_object.book_id
-        )  # книга связанная с удаляемой операцией
+    serializer_class = LendingBulkSerializer
+    permission_classes = [IsLibrarian]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = lending_atomic(
+            lending_bulk_create, serializer.validated_data["operations"], request.user
+        )
+        created = sum(1 for result in results if result["status"] == "created")
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+
+class LendingDestroyApiView(ReplicaReadMixin, DestroyAPIView):
+    """Удалять операции по библиотеке могут только пользователи с правами библиотекаря.
+    Изменение счетчиков книги, снятие пометки с выдачи и удаление операции выполняются в одной транзакции.
+    """
+
+    queryset = Lending.objects.select_related("book")
+
+    def perform_destroy(self, instance):
+        lending_atomic(self.destroy_lending, instance.pk, instance.book)
+
+    def destroy_lending(self, pk, book_object):
+        lock_book(book_object.pk)
+        # удаляемая операция и выдача, в которой она отмечена как возврат или утеря, блокируются в порядке pk
+        rows = Lending.objects.select_for_update().filter(Q(pk=pk) | Q(id_return=pk))
+        rows = {row.pk: row for row in rows.order_by("pk")}
+        lending_object = rows.pop(pk, None)  # удаляемая операция
+        if lending_object is None:
+            raise NotFound("Операция уже удалена !")
+        lending_issuance_object = next(iter(rows.values()), None)
+        deltas = {}  # изменения счетчиков книги
+        condition = None  # условие, при котором счетчики книги можно изменить
         if lending_object.operation == "arrival":
             # удаление партии поступивших книг
-            if (
-                book_object.quantity_all - book_object.quantity_lending
-                < lending_object.arrival_quantity
-            ):
-                raise ValidationError(
-                    f"Количество выданных книг '{book_object.name}' превысит их общее количество в библиотеке!"
-                    f" Удаление поступления невозможно !"
-                )
-            book_object.quantity_all -= lending_object.arrival_quantity
+            # невозможно, если после удаления выданных книг станет больше, чем их общее количество
+            deltas = {"quantity_all": -lending_object.arrival_quantity}
+            condition = Q(
+                quantity_all__gte=F("quantity_lending")
+                + lending_object.arrival_quantity
+            )
         elif lending_object.operation == "issuance":
             # удаление выдачи книги удаление невозможно если операция помечена возвратом (id_return > 0).
             if lending_object.id_return > 0:
@@ -244,68 +375,112 @@ class LendingDestroyApiView(DestroyAPIView):
 
             # при возврате книг уменьшается количество выданных книг читателям (quantity_lending)
             # и общее количество выдачи (amount_lending)
-            book_object.quantity_lending -= 1
-            book_object.amount_lending -= 1
+            deltas = {"quantity_lending": -1, "amount_lending": -1}
         elif lending_object.operation == "write_off":
             # при удалении списании книг увеличивается общее количество книг с данным названием (quantity_all)
-            book_object.quantity_all += 1
+            deltas = {"quantity_all": 1}
         if lending_object.operation == "return":
             # при удалении возврата книги увеличивается общее количество выданных книг с данным названием (quantity_all)
             # далее в БД ищется операция выдачи книги и улаляется пометка о возврате (id_return = 0, is_return = False)
-            lending_issuance_object = Lending.objects.get(id_return=lending_object.pk)
+            # открытая выдача не может оставаться в архиве: снятие пометки archived возвращает строку
+            # в рабочую секцию журнала (library.partitions)
             lending_issuance_object.id_return = 0
             lending_issuance_object.is_return = False
-            lending_issuance_object.save()
-            book_object.quantity_lending += 1
+            lending_issuance_object.archived = False
+            lending_issuance_object.save(
+                update_fields=["id_return", "is_return", "archived"]
+            )
+            deltas = {"quantity_lending": 1}
         if lending_object.operation == "loss":
             # в БД ищется операция выдачи книги и удаляется пометка об утере (id_return = 0, is_loss = False)
             # невозможно выполнить эту операцию если книга после утери списана.
             # при удалении операции потери общее количество книги в библиотеке увеличивается на 1 (quantity_all += 1)
-            lending_issuance_object = Lending.objects.get(id_return=lending_object.pk)
             if lending_issuance_object.is_write_off:
                 raise ValidationError(
                     f"Невоможно удалить утерю - книга '{book_object.name}' списана !"
                 )
             lending_issuance_object.id_return = 0
             lending_issuance_object.is_loss = False
-            lending_issuance_object.save()
-            book_object.quantity_all += 1
-        book_object.save()
-        return Lending.objects.all()
+            lending_issuance_object.archived = False
+            lending_issuance_object.save(
+                update_fields=["id_return", "is_loss", "archived"]
+            )
+            # утеря уменьшила и общее количество, и общее количество выдачи (amount_lending)
+            deltas = {"quantity_all": 1, "amount_lending": 1}
+        if not update_book_counters(book_object.pk, condition, **deltas):
+            raise ValidationError(
+                f"Количество выданных книг '{book_object.name}' превысит их общее количество в библиотеке!"
+                f" Удаление поступления невозможно !"
+            )
+        stats_apply([lending_object], sign=-1)
+        lending_object.delete()
 
     permission_classes = [IsLibrarian]
     serializer_class = LendingSerializer
 
 
-class LendingRetrieveApiView(RetrieveAPIView):
+class LendingRetrieveApiView(ReplicaReadMixin, RetrieveAPIView):
     """Просматривать отдельную операцию могут только авторизованные пользователи или библиотекарь."""
 
     def get_queryset(self):
         if IsLibrarian().has_permission(self.request, self):
-            return Lending.objects.all()
+            queryset = Lending.objects.all()
         else:
-            return Lending.objects.filter(user=self.request.user)
+            queryset = Lending.objects.filter(user=self.request.user.pk)
+        return LendingSerializerReadOnly.values(queryset)
 
     queryset = Lending.objects.all()
     serializer_class = LendingSerializerReadOnly
 
 
-class LendingUpdateApiView(UpdateAPIView):
+class LendingUpdateApiView(ReplicaReadMixin, UpdateAPIView):
     """Изменения проводятся только для списания и отмены списания утерянной книги."""
 
     queryset = Lending.objects.all()
     serializer_class = LendingSerializerWriteOff
 
     def perform_update(self, serializer):
+        lending_atomic(self.update_lending, serializer)
+
+    def update_lending(self, serializer):
         """Перед сохраннием операции проверяем действительно ли она утеряна."""
-        lending_object = Lending.objects.get(
+        lock_book(serializer.instance.book_id)
+        lending_object = Lending.objects.select_for_update().get(
             pk=self.kwargs["pk"]
         )  # изменяемая операция
 
         if lending_object.operation == "issuance" and lending_object.is_loss:
-            lending = serializer.save()
-            lending.save()
+            # пометка записывается в заблокированную строку: serializer.instance прочитан до блокировки,
+            # и сохранение всей строки затерло бы изменения параллельных операций (id_return, archived)
+            lending_object.is_write_off = serializer.validated_data.get(
+                "is_write_off", lending_object.is_write_off
+            )
+            lending_object.save(update_fields=["is_write_off"])
+            serializer.instance = lending_object
         else:
             raise ValidationError(f"Можно списать только утерянную книгу.")
 
     permission_classes = [IsLibrarian]
+
+
+class NotificationMetricsApiView(APIView):
+    """Метрики очередей уведомлений читателей (email, telegram): пропускная способность, остаток и задержка."""
+
+    permission_classes = [IsLibrarian]
+
+    def get(self, request):
+        return Response(notifications_metrics())
+
+
+class LendingReportApiView(APIView):
+    """Отчет по операциям за период в разрезе книг, жанров, авторов, читателей, месяцев или дат.
+    Отчет строится по сводным таблицам (library.stats), а не по журналу операций, и читается с реплики.
+    """
+
+    permission_classes = [IsLibrarian]
+
+    def get(self, request):
+        serializer = LendingReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        report = stats_report(**serializer.validated_data).using(read_db(request))
+        return Response({"results": list(report)})
@@ -0,0 +1,118 @@
+# Нагрузочное тестирование API библиотеки (locust из dev-зависимостей проекта, устанавливается poetry install).
+# Сценарии обращаются к реальным эндпоинтам: получение токена, каталог книг с поиском, журнал операций читателя,
+# выдача и возврат книг библиотекарем. Перед запуском тестовая БД наполняется командой fill, которая в конце
+# выводит переменные окружения для этого файла:
+#   python manage.py fill --seed 1
+#   LOADTEST_TAG=... LOADTEST_READERS=... LOADTEST_BOOKS=... locust -f loadtest/locustfile.py \
+#       --host http://127.0.0.1:8000 --headless -u 100 -r 10 -t 5m --csv loadtest/results
+# По окончании теста для каждого эндпоинта выводятся p50, p99 и пропускная способность (запросов в секунду).
+
+import os
+import random
+
+from locust import HttpUser, between, events, task
+
+PASSWORD = "123qwe"  # пароль синтетических пользователей команды fill
+LIBRARIAN_EMAIL = "librarian@example.com"
+TAG = os.environ.get("LOADTEST_TAG", "")
+FIRST_READER, LAST_READER = map(
+    int, os.environ.get("LOADTEST_READERS", "1:1").split(":")
+)
+FIRST_BOOK, LAST_BOOK = map(int, os.environ.get("LOADTEST_BOOKS", "1:1").split(":"))
+SEARCH_WORDS = "любовь море капитан дорога зима город тайна звезда корабль".split()
+
+
+class LibraryUser(HttpUser):
+    abstract = True
+
+    def login(self, email):
+        response = self.client.post(
+            "/users/login/", {"email": email, "password": PASSWORD}, name="users/login/"
+        )
+        self.client.headers["Authorization"] = f"Bearer {response.json()['access']}"
+
+
+class Reader(LibraryUser):
+    """Читатель просматривает каталог и свой журнал операций, время от времени заново получая токен."""
+
+    weight = 9
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.email = (
+            f"reader{TAG}{random.randint(0, LAST_READER - FIRST_READER)}@example.com"
+        )
+        self.login(self.email)
+
+    @task(5)
+    def books(self):
+        self.client.get(
+            "/books/", params={"page_size": random.randint(1, 100)}, name="books/"
+        )
+
+    @task(2)
+    def books_search(self):
+        self.client.get(
+            "/books/",
+            params={"search": random.choice(SEARCH_WORDS)},
+            name="books/?search",
+        )
+
+    @task(3)
+    def lending(self):
+        self.client.get("/lending/", name="lending/")
+
+    @task(1)
+    def token(self):
+        self.login(self.email)
+
+
+class Librarian(LibraryUser):
+    """Библиотекарь выдает книги случайным читателям и принимает выданные ранее."""
+
+    weight = 1
+    wait_time = between(0.5, 1)
+
+    def on_start(self):
+        self.login(LIBRARIAN_EMAIL)
+        self.loans = []
+
+    def lending_create(self, operation, reader, book):
+        # отказ по правилам библиотеки (нет свободных экземпляров, книга уже у читателя) - штатный ответ API
+        with self.client.post(
+            "/lending/create/",
+            {"user": reader, "book": book, "operation": operation},
+            name=f"lending/create/ [{operation}]",
+            catch_response=True,
+        ) as response:
+            if response.status_code in (201, 400):
+                response.success()
+            return response.status_code == 201
+
+    @task(2)
+    def issuance(self):
+        reader = random.randint(FIRST_READER, LAST_READER)
+        book = random.randint(FIRST_BOOK, LAST_BOOK)
+        if self.lending_create("issuance", reader, book):
+            self.loans.append((reader, book))
+
+    @task(1)
+    def lending_return(self):
+        if self.loans:
+            self.lending_create(
+                "return", *self.loans.pop(random.randrange(len(self.loans)))
+            )
+
+
+@events.test_stop.add_listener
+def report(environment, **kwargs):
+    """Сводка по эндпоинтам: p50, p99 (мс) и пропускная способность (запросов в секунду)."""
+    for entry in sorted(
+        environment.stats.entries.values(), key=lambda entry: entry.name
+    ):
+        print(
+            f"{entry.method} {entry.name}: requests={entry.num_requests} "
+            f"failures={entry.num_failures} p50={entry.get_response_time_percentile(0.5):.0f} ms "
+            f"p99={entry.get_response_time_percentile(0.99):.0f} ms "
+            f"{entry.total_rps:.1f} req/s"
+        )
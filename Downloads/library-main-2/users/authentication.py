@@ -0,0 +1,109 @@
+# Аутентификация по JWT без чтения пользователя из БД (включается TOKEN_USER_ENABLED).
+# Пользователь запроса строится по утверждениям токена (id, email, роль библиотекаря), которые добавляются
+# при входе в UserTokenObtainPairSerializer. Отзыв токенов (смена роли, блокировка или удаление пользователя)
+# проверяется по общему кешу (Redis): токены, выданные при входе раньше отметки отзыва, не принимаются.
+# Отметки отзыва не должны вытесняться из кеша: при политике вытеснения Redis (allkeys-lru, volatile-lru и т.п.)
+# отозванный токен снова становится действительным. Redis должен работать с maxmemory-policy noeviction.
+# Асинхронные представления (library.async_views) аутентифицируются функцией aauthenticate с теми же проверками.
+
+import time
+from functools import cached_property
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.authentication import \
+    JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
+                                                 InvalidToken)
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from config import async_cache, settings
+from users.models import Users
+
+AUTH_TIME_CLAIM = "auth_time"  # время входа, копируется во все токены доступа, полученные по токену обновления
+
+
+def revoke_cache_key(user_pk):
+    return f"users:revoked:{user_pk}"
+
+
+def token_revoke(user_pks):
+    """Функция отзывает все выданные ранее токены пользователей. Внутри транзакции токены отзываются после
+    ее фиксации: вход между отзывом и фиксацией получил бы токен с прежней ролью и временем входа позже
+    отметки отзыва."""
+    user_pks = list(user_pks)
+
+    def revoke():
+        revoked_at = time.time()
+        timeout = int(settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"].total_seconds())
+        cache.set_many(
+            {revoke_cache_key(user_pk): revoked_at for user_pk in user_pks}, timeout
+        )
+
+    transaction.on_commit(revoke)
+
+
+def token_revoked(token):
+    revoked_at = cache.get(revoke_cache_key(token[api_settings.USER_ID_CLAIM]))
+    return revoked_at is not None and token.get(AUTH_TIME_CLAIM, 0) < revoked_at
+
+
+async def atoken_revoked(token):
+    revoked_at = await async_cache.aget(
+        revoke_cache_key(token[api_settings.USER_ID_CLAIM])
+    )
+    return revoked_at is not None and token.get(AUTH_TIME_CLAIM, 0) < revoked_at
+
+
+class TokenReader(TokenUser):
+    """Пользователь запроса, построенный по утверждениям токена. Полная запись Users загружается
+    из БД только при обращении к instance."""
+
+    @cached_property
+    def email(self):
+        return self.token.get("email", "")
+
+    @cached_property
+    def is_librarian(self):
+        return self.token.get("is_librarian")
+
+    @cached_property
+    def instance(self):
+        return Users.objects.get(pk=self.pk)
+
+
+class TokenUserAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        super().get_user(validated_token)  # проверка наличия id пользователя в токене
+        if token_revoked(validated_token):
+            raise AuthenticationFailed("Токен отозван.", code="token_revoked")
+        return TokenReader(validated_token)
+
+
+async def aauthenticate(request):
+    """Функция аутентифицирует запрос асинхронного представления по JWT (заголовок Authorization).
+    Возвращает пользователя или None, если токен не передан. Пользователь строится по токену (TokenReader),
+    как в TokenUserAuthentication, или читается из БД асинхронным ORM, как в JWTAuthentication.
+    """
+    authentication = JWTStatelessUserAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    validated_token = authentication.get_validated_token(raw_token)
+    try:
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken("Token contained no recognizable user identification")
+    if settings.TOKEN_USER_ENABLED:
+        if await atoken_revoked(validated_token):
+            raise AuthenticationFailed("Токен отозван.", code="token_revoked")
+        return TokenReader(validated_token)
+    try:
+        user = await Users.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except Users.DoesNotExist:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+    if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+        raise AuthenticationFailed("User is inactive", code="user_inactive")
+    return user
@@ -1,49 +1,330 @@
-import json
+# Наполнение БД синтетическими данными объема рабочей библиотеки: авторы, книги, читатели и многолетний журнал
+# операций (поступления, выдачи, возвраты, утери, списания). Журнал моделируется по дням с учетом свободных
+# экземпляров и открытых выдач, поэтому проходит те же проверки, что и операции через API.
+# В PostgreSQL строки загружаются потоком через COPY (драйверы psycopg2 и psycopg 3), в других БД - через
+# bulk_create. После загрузки счетчики книг и сводные таблицы отчетов приводятся в соответствие с журналом.
+# Команда предназначена для тестовых БД и нагрузочного тестирования (loadtest/locustfile.py).
 
+import csv
+import heapq
+import io
+import random
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
 from django.core.management import BaseCommand
-from django.db import connection
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+from django.db.models import Max, Min
+
+from library.models import Authors, Books, Lending
+from library.services import update_books_counters
+from library.stats import stats_rebuild
+from users.models import Users
+from users.permissions import LIBRARIAN_GROUP
 
-from users.models import Payments
+BATCH_SIZE = 10_000
+COPY_CHUNK_SIZE = 1 << 16  # размер блока данных COPY (символов) для psycopg 3
+# пароль всех синтетических пользователей (для нагрузочного тестирования)
+PASSWORD = "123qwe"
+LIBRARIAN_EMAIL = "librarian@example.com"
+FIRST_NAMES = (
+    "Иван Петр Анна Мария Олег Ольга Сергей Елена Алексей Наталья Дмитрий Татьяна Павел Ирина Михаил"
+).split()
+LAST_NAMES = (
+    "Иванов Петров Сидоров Смирнов Кузнецов Попов Соколов Лебедев Козлов Новиков Морозов Волков Зайцев"
+).split()
+TITLE_WORDS = (
+    "любовь жизнь море остров капитан дорога север зима лето город степь лес река тайна война мир "
+    "путешествие звезда ветер дом сад ночь утро письмо время память золото охотник странник корабль"
+).split()
 
 
 class Command(BaseCommand):
+    help = "Наполнение БД синтетическими авторами, книгами, читателями и журналом операций (только для тестовой БД)."
 
-    @staticmethod
-    def json_read_payments():
-        with open("payments.json", "r", encoding="utf-8") as file:
-            return json.load(file)
+    def add_arguments(self, parser):
+        parser.add_argument("--authors", type=int, default=10_000)
+        parser.add_argument("--books", type=int, default=100_000)
+        parser.add_argument("--readers", type=int, default=100_000)
+        parser.add_argument(
+            "--lendings",
+            type=int,
+            default=10_000_000,
+            help="примерное количество операций в журнале",
+        )
+        parser.add_argument(
+            "--years", type=int, default=5, help="глубина истории журнала"
+        )
+        parser.add_argument("--seed", type=int, default=None)
 
     def handle(self, *args, **options):
+        random.seed(options["seed"])
+        started = time.perf_counter()
+        self.password = make_password(PASSWORD)
+        self.librarian = self.get_librarian()
+        tag = f"{int(time.time())}-"  # метка запуска делает уникальными имена и e-mail
 
-        payments_for_create = []
-        payments_sequence = 1
-        self.clean_database()
-        self.reset_sequences_payments(payments_sequence)
-
-        for payments in Command.json_read_payments():
-            payments_for_create.append(
-                Payments(
-                    payments["pk"],
-                    payments["fields"]["user"],
-                    payments["fields"]["payment_date"],
-                    payments["fields"]["paid_course"],
-                    payments["fields"]["paid_lesson"],
-                    payments["fields"]["amount"],
-                    payments["fields"]["payment_method"],
-                )
+        self.load(
+            Authors,
+            (
+                {"author": f"{self.person_name()} {tag}{number}"}
+                for number in range(options["authors"])
+            ),
+        )
+        authors = self.id_range(Authors.objects.filter(author__contains=tag))
+        self.load(
+            Books,
+            (
+                {
+                    "name": f"{' '.join(random.sample(TITLE_WORDS, 3)).capitalize()} {tag}{number}",
+                    "author_id": random.randint(*authors),
+                    "genre": random.choice(Books.GENRE)[0],
+                    "annotation": " ".join(random.sample(TITLE_WORDS, 10)),
+                }
+                for number in range(options["books"])
+            ),
+        )
+        books = self.id_range(Books.objects.filter(name__contains=tag))
+        self.load(
+            Users,
+            (
+                {
+                    "email": f"reader{tag}{number}@example.com",
+                    "password": self.password,
+                    "reader_name": self.person_name(),
+                    "phone": f"+79{random.randint(0, 10**9 - 1):09d}",
+                }
+                for number in range(options["readers"])
+            ),
+        )
+        readers = self.id_range(Users.objects.filter(email__contains=tag))
+
+        self.counters = {}
+        self.next_id = (Lending.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        lendings = self.load(
+            Lending,
+            self.journal(books, readers, options["lendings"], options["years"]),
+            with_ids=True,
+        )
+        self.stdout.write(
+            f"Загружено операций: {lendings} за {time.perf_counter() - started:.0f} с."
+        )
+        # счетчики синтетических книг равны нулю, поэтому изменения счетчиков совпадают с итоговыми значениями
+        counters = list(self.counters.items())
+        for start in range(0, len(counters), 1000):
+            update_books_counters(dict(counters[start : start + 1000]))
+        stats_rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Готово за {time.perf_counter() - started:.0f} с.")
+        )
+        # параметры для нагрузочного тестирования (loadtest/locustfile.py)
+        self.stdout.write(
+            f"LOADTEST_TAG={tag} LOADTEST_READERS={readers[0]}:{readers[1]} "
+            f"LOADTEST_BOOKS={books[0]}:{books[1]}"
+        )
+
+    def get_librarian(self):
+        """Библиотекарь - автор поступлений, утерь и списаний."""
+        librarian, _ = Users.objects.get_or_create(
+            email=LIBRARIAN_EMAIL,
+            defaults={"password": self.password, "reader_name": "Библиотекарь"},
+        )
+        Group.objects.get_or_create(name=LIBRARIAN_GROUP)[0].user_set.add(librarian)
+        return librarian.pk
+
+    @staticmethod
+    def person_name():
+        return f"{random.choice(LAST_NAMES)} {random.choice(FIRST_NAMES)}"
+
+    @staticmethod
+    def id_range(queryset):
+        """Диапазон id загруженных строк: COPY и bulk_create выдают их подряд из последовательности таблицы."""
+        ids = queryset.aggregate(first=Min("pk"), last=Max("pk"))
+        return ids["first"], ids["last"]
+
+    def journal(self, books, readers, size, years):
+        """Генератор операций журнала по дням. Каждая выдача сразу получает дату и исход (возврат или утеря),
+        которые попадают в журнал в свой день. Выдачи, срок возврата которых не наступил, остаются открытыми.
+        """
+        first_book, last_book = books
+        first_reader, last_reader = readers
+        today = date.today()
+        start = today - timedelta(days=365 * years)
+        days = (today - start).days
+        issuances_per_day = max(1, size // 2 // days)
+        quantity = {}  # экземпляров в библиотеке (quantity_all)
+        lending = {}  # выдано читателям (quantity_lending)
+        open_loans = set()  # (читатель, книга) с открытой выдачей
+        # куча (дата, id, операция, читатель, книга) будущих возвратов и утерь
+        pending = []
+
+        for book in range(first_book, last_book + 1):
+            quantity[book] = random.randint(1, 10)
+            lending[book] = 0
+            yield self.operation(
+                self.librarian, book, "arrival", start, arrival_quantity=quantity[book]
             )
-        Payments.objects.bulk_create(payments_for_create)
-        self.reset_sequences_payments(len(payments_for_create))
+        for day in range(days + 1):
+            date_event = start + timedelta(days=day)
+            while pending and pending[0][0] <= date_event:
+                _, lending_id, operation, reader, book = heapq.heappop(pending)
+                open_loans.discard((reader, book))
+                if operation == "return":
+                    lending[book] -= 1
+                    yield self.operation(
+                        reader, book, "return", date_event, id=lending_id
+                    )
+                    if random.random() < 0.002 and quantity[book] > lending[book]:
+                        quantity[book] -= 1  # изношенный экземпляр списывается
+                        yield self.operation(
+                            self.librarian, book, "write_off", date_event
+                        )
+                else:
+                    # утерянная книга остается в quantity_lending, как и при утере через API
+                    quantity[book] -= 1
+                    yield self.operation(
+                        self.librarian, book, "loss", date_event, id=lending_id
+                    )
+            for _ in range(issuances_per_day):
+                reader = random.randint(first_reader, last_reader)
+                book = random.randint(first_book, last_book)
+                if (reader, book) in open_loans or quantity[book] <= lending[book]:
+                    continue
+                lending[book] += 1
+                open_loans.add((reader, book))
+                due = date_event + timedelta(days=random.randint(3, 30))
+                if due > today:
+                    yield self.operation(reader, book, "issuance", date_event)
+                    continue
+                outcome = "loss" if random.random() < 0.01 else "return"
+                outcome_id = self.allocate_id()
+                heapq.heappush(pending, (due, outcome_id, outcome, reader, book))
+                yield self.operation(
+                    reader,
+                    book,
+                    "issuance",
+                    date_event,
+                    id_return=outcome_id,
+                    is_return=outcome == "return",
+                    is_loss=outcome == "loss",
+                )
+
+    def allocate_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def operation(self, user, book, operation, date_event, id=None, **fields):
+        """Строка журнала. Ее вклад в счетчики книги учитывается так же, как при проведении операции через API."""
+        deltas = self.counters.setdefault(
+            book, {"quantity_all": 0, "quantity_lending": 0, "amount_lending": 0}
+        )
+        if operation == "arrival":
+            deltas["quantity_all"] += fields["arrival_quantity"]
+        elif operation == "issuance":
+            deltas["quantity_lending"] += 1
+            deltas["amount_lending"] += 1
+        elif operation == "return":
+            deltas["quantity_lending"] -= 1
+        elif operation == "write_off":
+            deltas["quantity_all"] -= 1
+        elif operation == "loss":
+            deltas["quantity_all"] -= 1
+            deltas["amount_lending"] -= 1
+        return {
+            "id": id or self.allocate_id(),
+            "user_id": user,
+            "book_id": book,
+            "operation": operation,
+            "date_event": date_event,
+            **fields,
+        }
+
+    def load(self, model, rows, with_ids=False):
+        """Загрузка строк (словарей полей) в таблицу модели одной транзакцией. Возвращает количество строк.
+        Если id задаются в строках (with_ids), последовательность id таблицы сдвигается за загруженные.
+        """
+        fields = [
+            field
+            for field in model._meta.concrete_fields
+            if with_ids or not field.primary_key
+        ]
+        defaults = {field.attname: field.get_default() for field in fields}
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                count = self.copy(model, fields, defaults, rows)
+            else:
+                count = self.bulk_create(model, defaults, rows)
+            if with_ids:
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                        cursor.execute(sql)
+        return count
 
     @staticmethod
-    def reset_sequences_payments(payments_sequence):
-        """Сихронизируем автоинкрементные значения таблицы продукты"""
+    def copy(model, fields, defaults, rows):
+        """Потоковая загрузка через COPY ... FROM STDIN без накопления строк в памяти. psycopg2 читает данные
+        из файлоподобного объекта (copy_expert), в psycopg 3 они передаются в COPY блоками (cursor.copy).
+        """
+        stream = CopyRows([field.attname for field in fields], defaults, rows)
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+        sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
         with connection.cursor() as cursor:
-            cursor.execute(
-                f"ALTER SEQUENCE users_payments_id_seq RESTART WITH {payments_sequence};"
-            )
+            if is_psycopg3:
+                with cursor.copy(sql) as copy:
+                    while data := stream.read(COPY_CHUNK_SIZE):
+                        copy.write(data)
+            else:
+                cursor.copy_expert(sql, stream)
+        return stream.count
 
     @staticmethod
-    def clean_database():
-        """Очищаем базу данных"""
-        Payments.objects.all().delete()
+    def bulk_create(model, defaults, rows):
+        count = 0
+        while batch := list(islice(rows, BATCH_SIZE)):
+            model.objects.bulk_create([model(**{**defaults, **row}) for row in batch])
+            count += len(batch)
+        return count
+
+
+class CopyRows:
+    """Файлоподобный объект для COPY: строки CSV формируются из словарей полей по мере чтения."""
+
+    def __init__(self, columns, defaults, rows):
+        self.columns = columns
+        self.defaults = defaults
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            batch = list(islice(self.rows, 1000))
+            if not batch:
+                break
+            for row in batch:
+                self.writer.writerow(
+                    [
+                        "\\N" if value is None else value
+                        for value in (
+                            row.get(column, self.defaults[column])
+                            for column in self.columns
+                        )
+                    ]
+                )
+            self.count += len(batch)
+            self.pending += self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        if size < 0:
+            data, self.pending = self.pending, ""
+        else:
+            data, self.pending = self.pending[:size], self.pending[size:]
+        return data
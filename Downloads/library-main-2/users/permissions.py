@@ -1,6 +1,64 @@
+# Роль пользователя (библиотекарь или читатель) определяется по членству в группе librarian.
+# Результат проверки запоминается на время запроса, а при включенном общем кеше (Redis) - и между запросами,
+# поэтому повторные проверки прав не обращаются к БД. При изменении состава групп кеш сбрасывается (users.signals).
+
+from django.core.cache import cache
+from django.db import transaction
 from rest_framework.permissions import BasePermission
 
+from config import async_cache, settings
+
+LIBRARIAN_GROUP = "librarian"
+
+
+def role_cache_key(user_pk):
+    return f"users:librarian:{user_pk}"
+
+
+def is_librarian(request):
+    """Функция проверяет, входит ли пользователь запроса в группу библиотекарей."""
+    if not hasattr(request, "_is_librarian"):
+        user = request.user
+        # при аутентификации без чтения из БД роль берется из токена (users.authentication.TokenReader)
+        librarian = getattr(user, "is_librarian", None)
+        if librarian is None and settings.CACHE_ENABLED and user.is_authenticated:
+            librarian = cache.get(role_cache_key(user.pk))
+        if librarian is None:
+            librarian = user.groups.filter(name=LIBRARIAN_GROUP).exists()
+            if settings.CACHE_ENABLED and user.is_authenticated:
+                cache.set(
+                    role_cache_key(user.pk), librarian, settings.ROLE_CACHE_TIMEOUT
+                )
+        request._is_librarian = librarian
+    return request._is_librarian
+
+
+async def ais_librarian(request):
+    """Асинхронный вариант is_librarian для асинхронных представлений (library.async_views)."""
+    if not hasattr(request, "_is_librarian"):
+        user = request.user
+        librarian = getattr(user, "is_librarian", None)
+        if librarian is None and settings.CACHE_ENABLED and user.is_authenticated:
+            librarian = await async_cache.aget(role_cache_key(user.pk))
+        if librarian is None:
+            librarian = await user.groups.filter(name=LIBRARIAN_GROUP).aexists()
+            if settings.CACHE_ENABLED and user.is_authenticated:
+                await async_cache.aset(
+                    role_cache_key(user.pk), librarian, settings.ROLE_CACHE_TIMEOUT
+                )
+        request._is_librarian = librarian
+    return request._is_librarian
+
+
+def role_invalidate(user_pks):
+    """Функция сбрасывает кешированные роли пользователей. Внутри транзакции (например, в админке) роли
+    сбрасываются после ее фиксации: запрос между сбросом и фиксацией прочитал бы из БД прежний состав групп
+    и снова сохранил бы в кеше прежнюю роль на ROLE_CACHE_TIMEOUT."""
+    if settings.CACHE_ENABLED:
+        keys = [role_cache_key(user_pk) for user_pk in user_pks]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
 
 class IsLibrarian(BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name="librarian").exists()
+        return is_librarian(request)
@@ -1,10 +1,15 @@
+import time
+
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from config.instrumentation import TimedSerializerMixin
+from users.authentication import AUTH_TIME_CLAIM
 from users.models import Users
+from users.permissions import LIBRARIAN_GROUP
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Users
         fields = (
@@ -28,4 +33,6 @@ class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
     def get_token(cls, user):
         token = super().get_token(user)
         token["email"] = user.email
+        token["is_librarian"] = user.groups.filter(name=LIBRARIAN_GROUP).exists()
+        token[AUTH_TIME_CLAIM] = time.time()
         return token
@@ -0,0 +1,44 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from users.authentication import token_revoke
+from users.models import Users
+from users.permissions import role_invalidate
+
+
+@receiver(m2m_changed, sender=Users.groups.through)
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Добавление и удаление пользователей из групп сбрасывает их кешированные роли."""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        user_pks = [instance.pk]
+    elif action == "pre_clear":
+        user_pks = list(instance.user_set.values_list("pk", flat=True))
+    else:
+        user_pks = pk_set
+    role_invalidate(user_pks)
+    token_revoke(user_pks)  # роль библиотекаря записана в выданных токенах
+
+
+@receiver([pre_save, pre_delete], sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """Переименование или удаление группы сбрасывает роли всех ее участников."""
+    if instance.pk:
+        user_pks = list(instance.user_set.values_list("pk", flat=True))
+        role_invalidate(user_pks)
+        token_revoke(user_pks)
+
+
+@receiver(post_save, sender=Users)
+def user_saved(sender, instance, created, **kwargs):
+    """Блокировка пользователя отзывает его токены."""
+    if not created and not instance.is_active:
+        token_revoke([instance.pk])
+
+
+@receiver(post_delete, sender=Users)
+def user_deleted(sender, instance, **kwargs):
+    token_revoke([instance.pk])
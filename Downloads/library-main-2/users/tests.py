@@ -1,9 +1,27 @@
+from contextlib import contextmanager
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+from rest_framework.views import APIView
 
+from config import settings
+from library.models import Authors, Lending
+from library.query_budget import QueryBudgetMixin
+from library.reconcile import reconcile_counters
+from library.stats import stats_check
+from users.authentication import TokenUserAuthentication
+from users.management.commands import fill
 from users.models import Users
+from users.permissions import IsLibrarian, role_cache_key
 
 
 class UsersTestCase(APITestCase):
@@ -60,3 +78,170 @@ class UsersTestCase(APITestCase):
         data = response.json()
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(data.get("tg_chat_id"), self.user.tg_chat_id)
+
+
+class UsersQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    """Число запросов к БД списка и просмотра пользователей не зависит от их количества."""
+
+    def setUp(self):
+        self.user = Users.objects.create(email="sv.bojad@gmail.com", password="123qwe")
+        group = Group.objects.create(name="librarian")
+        group.user_set.add(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def grow(self):
+        number = Users.objects.count()
+        Users.objects.bulk_create(
+            [Users(email=f"reader{number + index}@yandex.ru") for index in range(5)]
+        )
+
+    def test_users_list(self):
+        self.assertQueryBudget(2, reverse("users:users_list"), self.grow)
+
+    def test_users_retrieve(self):
+        url = reverse("users:users_retrieve", args=(self.user.pk,))
+        self.assertQueryBudget(2, url, self.grow)
+
+
+@patch.object(settings, "CACHE_ENABLED", True)
+class RoleCacheTestCase(APITestCase):
+    """Тестирование кеширования роли библиотекаря."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create(email="sv.bojad@gmail.com", password="123qwe")
+        self.group = Group.objects.create(name="librarian")
+        self.group.user_set.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("users:users_list")
+
+    def test_role_per_request(self):
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertTrue(IsLibrarian().has_permission(request, None))
+            self.assertTrue(IsLibrarian().has_permission(request, None))
+
+    def test_role_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_role_invalidate(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+            self.assertTrue(cache.get(role_cache_key(self.user.pk)))  # до фиксации
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@patch.object(settings, "CACHE_ENABLED", True)
+@patch.object(APIView, "authentication_classes", [TokenUserAuthentication])
+class TokenUserAuthenticationTestCase(APITestCase):
+    """Тестирование аутентификации по токену без чтения пользователя из БД."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create(email="sv.bojad@gmail.com")
+        self.user.set_password("123qwe")
+        self.user.save()
+        self.group = Group.objects.create(name="librarian")
+        self.group.user_set.add(self.user)
+        response = self.client.post(
+            reverse("users:login"),
+            {"email": "sv.bojad@gmail.com", "password": "123qwe"},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}"
+        )
+        self.url = reverse("library:lending_list")
+
+    def test_token_user(self):
+        """Пользователь и его роль берутся из токена: остается только запрос журнала."""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_revoked(self):
+        """Смена роли отзывает ранее выданные токены."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+            response = self.client.get(self.url)  # до фиксации токен еще действителен
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class FillCommandTestCase(TestCase):
+    """Тестирование наполнения БД синтетическими данными (команда fill)."""
+
+    def test_fill(self):
+        call_command(
+            "fill",
+            authors=5,
+            books=50,
+            readers=50,
+            lendings=5000,
+            years=1,
+            seed=1,
+            stdout=StringIO(),
+        )
+        self.assertGreater(Lending.objects.filter(operation="return").count(), 1000)
+        self.assertTrue(Lending.objects.filter(operation="issuance", id_return=0))
+        # журнал проходит те же проверки, что и операции через API: счетчики и сводки с ним совпадают
+        self.assertEqual(reconcile_counters(full=True, repair=False), {})
+        self.assertEqual(stats_check(), [])
+
+    def test_copy_drivers(self):
+        """COPY передает в БД одни и те же данные через psycopg2 (copy_expert) и psycopg 3 (cursor.copy)."""
+        fields = [Authors._meta.get_field(name) for name in ("author", "image")]
+        defaults = {field.attname: field.get_default() for field in fields}
+        loaded = {}
+        for psycopg3 in (False, True):
+            rows = ({"author": f"Автор {number}"} for number in range(5000))
+            cursor = CopyCursor()
+            with patch.object(fill, "is_psycopg3", psycopg3), patch.object(
+                fill.connection, "cursor", return_value=cursor
+            ):
+                count = fill.Command.copy(Authors, fields, defaults, rows)
+            self.assertEqual(count, 5000)
+            loaded[psycopg3] = (cursor.sql, "".join(cursor.data))
+            # psycopg 3 получает данные несколькими блоками
+            self.assertEqual(len(cursor.data) > 1, psycopg3)
+        self.assertEqual(loaded[False], loaded[True])
+        self.assertEqual(loaded[True][1].count("\n"), 5000)
+
+
+class CopyCursor:
+    """Курсор, который запоминает запрос COPY и переданные в него данные (API psycopg2 и psycopg 3)."""
+
+    def __init__(self):
+        self.sql = None
+        self.data = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def copy_expert(self, sql, file):
+        self.sql = sql
+        self.data.append(file.read())
+
+    @contextmanager
+    def copy(self, sql):
+        self.sql = sql
+        yield SimpleNamespace(write=self.data.append)
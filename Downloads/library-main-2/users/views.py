@@ -15,7 +15,7 @@ from users.serializer import UserSerializer, UserTokenObtainPairSerializer
 
 class UserListAPIView(ListAPIView):
     serializer_class = UserSerializer
-    queryset = Users.objects.all()
+    queryset = Users.objects.only(*UserSerializer.Meta.fields).order_by("id")
     permission_classes = [IsAuthenticated, IsLibrarian]
 
 
@@ -23,16 +23,16 @@ class UserRetrieveAPIView(RetrieveAPIView):
     serializer_class = UserSerializer
 
     def get_queryset(self):
+        queryset = Users.objects.only(*UserSerializer.Meta.fields)
         if IsLibrarian().has_permission(self.request, self):
-            return Users.objects.all()
+            return queryset
         else:
-            lending_object_list = list(Users.objects.filter(pk=self.kwargs["pk"]))
-            if len(lending_object_list) == 1:
+            if Users.objects.filter(pk=self.kwargs["pk"]).exists():
                 if self.kwargs["pk"] != self.request.user.id:
                     raise ValidationError(
                         "У вас недостаточно прав на просмтр учетных данных читателя !"
                     )
-                return Users.objects.filter(pk=self.request.user.id)
+                return queryset.filter(pk=self.request.user.id)
             else:
                 raise ValidationError(
                     "Такой читатель не зарегистрирован в библиотеке !"
@@ -45,8 +45,7 @@ class UserUpdateAPIView(UpdateAPIView):
     serializer_class = UserSerializer
 
     def get_queryset(self):
-        lending_object_list = list(Users.objects.filter(pk=self.kwargs["pk"]))
-        if len(lending_object_list) == 1:
+        if Users.objects.filter(pk=self.kwargs["pk"]).exists():
             if self.kwargs["pk"] != self.request.user.id:
                 raise ValidationError(
                     "У вас недостаточно прав на изменение учетных данных читателя !"
@@ -65,14 +64,12 @@ class UserUpdateAPIView(UpdateAPIView):
 
 class UserDestroyAPIView(DestroyAPIView):
     def get_queryset(self):
-        lending_object_list = list(Lending.objects.filter(user=self.request.user.id))
-        if len(lending_object_list) > 0:
+        if Lending.objects.filter(user=self.request.user.id).exists():
             raise ValidationError(
                 "Невозможно удалить читателя, который пользовался услугами библиотеки !"
             )
         else:
-            lending_object_list = list(Users.objects.filter(pk=self.kwargs["pk"]))
-            if len(lending_object_list) == 0:
+            if not Users.objects.filter(pk=self.kwargs["pk"]).exists():
                 raise ValidationError(
                     "Такой читатель не зарегистрирован в библиотеке !"
                 )